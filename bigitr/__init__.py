@@ -18,6 +18,7 @@ import argparse
 import os
 import sys
 
+from bigitr import appconfig
 from bigitr import context
 from bigitr import cvsimport
 from bigitr import git
@@ -74,6 +75,8 @@ class _Runner(object):
                 self.runner.err.report(repository)
             except:
                 self.runner.err.report(repository)
+            finally:
+                Git.close()
 
     def close(self):
         for l in self.ctx.logs.values():
@@ -87,19 +90,50 @@ class Synchronize(_Runner):
     def __init__(self, appconfig, config, repos, poll=False):
         _Runner.__init__(self, appconfig, config, repos)
         self.poll = poll
+        # whether the last poll found new content; None if not polled
+        self.changed = None
+        # whether the last run raised errors, which process() reports
+        # rather than raising
+        self.failed = False
 
     def run(self, poll=None):
         if poll is not None:
             self.poll = poll
+        self.changed = None
+        if self.poll:
+            self.changed = False
+        self.failed = False
         _Runner.run(self)
 
     def do(self, repo, Git, requestedBranch=None):
+        try:
+            self.doSync(repo, Git)
+        except:
+            self.failed = True
+            raise
+
+    def doSync(self, repo, Git):
         # Synchronize ignores branch specifications
         if self.poll:
             if not self.newContent(Git):
+                if self.ctx.getImportPollCVS():
+                    self.importChangedBranches(repo, Git)
                 return
+            self.changed = True
+        else:
+            # keep the shared reference repository current for new clones
+            Git.updateReference()
         self.runner.synchronize(repo, Git)
 
+    def importChangedBranches(self, repo, Git):
+        # no new Git content, so there is nothing to export
+        cvsbranches = self.runner.imp.changedBranches(repo)
+        if cvsbranches:
+            # all at once, to import them concurrently and push once
+            self.runner.imp.importBranches(repo, Git,
+                                           changedBranches=cvsbranches)
+            self.changed = True
+
     @util.saveDir
     def newContent(self, Git):
         gitPath = self.ctx.getGitDir()
@@ -108,12 +142,36 @@ class Synchronize(_Runner):
         if not os.path.exists(repoDir):
             return True
         os.chdir(repoDir)
+        if self.ctx.getPollMode() == appconfig.LSREMOTE:
+            if not self.remoteBranchesChanged(Git):
+                return False
         oldRefs = Git.refs()
         Git.fetch()
         if Git.refs() == oldRefs:
             return False
         return True
 
+    def remoteBranchesChanged(self, Git):
+        # the remote tracking refs from the last fetch are the snapshot
+        # against which to compare; ls-remote transfers no objects
+        branches = sorted(self.ctx.getTrackedBranches(Git.repo))
+        if not branches:
+            # nothing to compare; let fetch decide
+            return True
+        remoteRefs = Git.lsRemote('origin',
+            *['refs/heads/' + x for x in branches])
+        localRefs = dict((y, x) for x, y in Git.refs() or []
+                         if y.startswith('refs/remotes/origin/'))
+        for branch in branches:
+            remoteRef = remoteRefs.get('refs/heads/' + branch)
+            if remoteRef is None:
+                # deleted on the remote; fetch does not prune the stale
+                # tracking ref, so it would never match again
+                continue
+            if remoteRef != localRefs.get('refs/remotes/origin/' + branch):
+                return True
+        return False
+
     def _init_runner(self, *args):
         self.runner = sync.Synchronizer(self.ctx)
 
@@ -28,13 +28,29 @@ onerror = {
     'continue': CONTINUE,
 }
 
+FETCH = 0
+LSREMOTE = 1
+pollmode = {
+    'fetch': FETCH,
+    'ls-remote': LSREMOTE,
+}
+
 
 class AppConfig(config.Config):
     def __init__(self, configFileName):
         config.Config.__init__(self, configFileName, {
             'compresslogs': 'true',
+            'fastimport': 'false',
+            'gitdissociate': 'false',
+            'gitworktrees': 'false',
+            'incremental': 'false',
             'onerror': 'abort',
+            'parallel': '1',
+            'pollcvs': 'false',
+            'pollmode': 'fetch',
             'preimport': 'true',
+            'pushatomic': 'false',
+            'skipunchanged': 'false',
             'smarthost': 'localhost'})
 
     def getCompressLogs(self):
@@ -43,6 +59,24 @@ class AppConfig(config.Config):
     def getGitDir(self):
         return self.get('global', 'gitdir')
 
+    def getGitReferenceDir(self):
+        return self.getOptional('global', 'gitreferencedir')
+
+    def getGitCloneFilter(self):
+        return self.getOptional('global', 'gitclonefilter')
+
+    def getGitCloneDepth(self):
+        depth = self.getOptional('global', 'gitclonedepth')
+        if depth is None:
+            return None
+        return int(depth)
+
+    def getGitDissociate(self):
+        return self.getboolean('global', 'gitdissociate')
+
+    def getGitWorktrees(self):
+        return self.getboolean('global', 'gitworktrees')
+
     def getLogDir(self):
         return self.get('global', 'logdir')
 
@@ -54,6 +88,12 @@ class AppConfig(config.Config):
     def getSmartHost(self):
         return self.get('global', 'smarthost')
 
+    def getPollMode(self):
+        return pollmode[self.get('global', 'pollmode')]
+
+    def getPushAtomic(self):
+        return self.getboolean('global', 'pushatomic')
+
     def getImportError(self):
         return onerror[self.get('import', 'onerror')]
 
@@ -62,10 +102,31 @@ class AppConfig(config.Config):
 
     def getImportCVSDir(self):
         return self.get('import', 'cvsdir')
+
+    def getImportPollCVS(self):
+        return self.getboolean('import', 'pollcvs')
+
+    def getImportFastImport(self):
+        return self.getboolean('import', 'fastimport')
+
+    def getImportIncremental(self):
+        return self.getboolean('import', 'incremental')
+
+    def getImportParallel(self):
+        return max(1, self.getint('import', 'parallel'))
+
+    def getImportSkipUnchanged(self):
+        return self.getboolean('import', 'skipunchanged')
     
     def getExportPreImport(self):
         return self.getboolean('export', 'preimport')
 
+    def getExportIncremental(self):
+        return self.getboolean('export', 'incremental')
+
+    def getExportParallel(self):
+        return max(1, self.getint('export', 'parallel'))
+
     def getExportError(self):
         return onerror[self.get('export', 'onerror')]
 
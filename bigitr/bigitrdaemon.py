@@ -27,9 +27,12 @@ import time
 import traceback
 
 from bigitr import appconfig
+from bigitr import cvs
 from bigitr import daemonconfig
+from bigitr import pool
 from bigitr import progress
 from bigitr import repositorymap
+from bigitr import schedule
 from bigitr import Synchronize
 from bigitr import util
 
@@ -45,6 +48,11 @@ class Daemon(object):
             self.progress = progress.Progress(outFile=None)
         else:
             self.progress = progress.Progress()
+        self.pool = pool.Pool(self.cfg.parallelConversions())
+        # shared through lock files by all of the worker processes
+        cvs.limitConnections(self.pidfile + '.cvs',
+                             self.cfg.getCVSConnections())
+        self.schedule = schedule.Schedule()
         self.createContext(detach)
         self.createSynchronizers()
 
@@ -70,6 +78,9 @@ class Daemon(object):
         addMail = None
         if self.cfg.getMailAll():
             addMail = self.cfg.getEmail()
+        pollFreq = self.cfg.getPollFrequency()
+        syncFreq = self.cfg.getFullSyncFrequency()
+        maxPollFreq = self.cfg.getMaxPollFrequency()
         for appCtxName in self.cfg.getApplicationContexts():
             appCtx = self.cfg.getAppConfig(appCtxName)
             appCtx = appconfig.AppConfig(appCtx)
@@ -77,8 +88,19 @@ class Daemon(object):
                 repoCtx = repositorymap.RepositoryConfig(repoCtx)
                 for repo in repoCtx.getRepositories():
                     repoCtx.addEmail(repo, addMail)
-                    self.synchronizers.append(
-                        Synchronize(appCtx, repoCtx, [repo]))
+                    s = Synchronize(appCtx, repoCtx, [repo])
+                    self.synchronizers.append(s)
+                    repoPollFreq = repoCtx.getPollFrequency(repo)
+                    if repoPollFreq is None:
+                        repoPollFreq = pollFreq
+                    repoSyncFreq = repoCtx.getFullSyncFrequency(repo)
+                    if repoSyncFreq is None:
+                        repoSyncFreq = syncFreq
+                    repoMaxPollFreq = repoCtx.getMaxPollFrequency(repo)
+                    if repoMaxPollFreq is None:
+                        repoMaxPollFreq = maxPollFreq
+                    self.schedule.add(schedule.Job(
+                        s, repoPollFreq, repoSyncFreq, repoMaxPollFreq))
 
     def run(self):
         try:
@@ -112,23 +134,67 @@ class Daemon(object):
     def sigchld(self, signo, frame):
         pass
 
-    def runOnce(self, poll=False):
-        if poll:
-            self.progress.setPhase('poll')
-        else:
-            self.progress.setPhase('sync')
-        for s in self.synchronizers:
-            if not self.stop and not self.restart:
-                try:
-                    repoName = s.ctx.getRepositoryName(s.repos[0])
-                    self.progress.add(repoName)
-                    self.progress.report()
-                    s.run(poll=poll)
-                    self.progress.remove(repoName)
-                except:
-                    self.report()
-            else:
-                raise SystemExit(0)
+    def startJobs(self):
+        while (not self.stop and not self.restart and not self.pool.full()
+               and self.schedule.due(time.time())):
+            self.startJob(self.schedule.pop(), time.time())
+            # with parallel = 1, the job has already finished
+            self.finishJobs()
+
+    @staticmethod
+    def jobName(job):
+        if job.poll:
+            return job.name + '(poll)'
+        return job.name
+
+    def startJob(self, job, now):
+        job.start(now)
+        self.progress.setPhase('sync')
+        self.progress.add(self.jobName(job))
+        self.progress.report()
+        self.pool.start(job, self.runJob, job.synchronizer, job.poll)
+
+    def runJob(self, s, poll):
+        try:
+            s.run(poll=poll)
+            if s.failed:
+                return schedule.FAILED
+            if s.changed is False:
+                return schedule.IDLE
+            return schedule.SYNCED
+        except:
+            self.report()
+            return schedule.FAILED
+
+    def finishJobs(self, block=False):
+        for job, status in self.pool.reap(block=block):
+            self.progress.remove(self.jobName(job))
+            self.progress.report()
+            job.finish(status)
+            self.schedule.add(job)
+
+    def wait(self):
+        if self.stop or self.restart:
+            return
+        waitTime = self.schedule.waitTime(time.time())
+        if self.pool.active():
+            if waitTime is None or self.pool.full():
+                self.finishJobs(block=True)
+            elif waitTime > 0:
+                # SIGCHLD interrupts sleep as soon as a worker finishes;
+                # the limit covers a worker finishing just before sleeping
+                time.sleep(min(waitTime, 1))
+            return
+        if waitTime is None:
+            # no repositories configured
+            waitTime = self.cfg.getPollFrequency()
+        if waitTime > 0:
+            self.progress.clear()
+            self.progress.setPhase('sleep')
+            self.progress.add('%0.1f seconds' %waitTime)
+            self.progress.report()
+            time.sleep(waitTime)
+            self.progress.clear()
 
     def report(self):
         exception = sys.exc_info()
@@ -155,34 +221,14 @@ class Daemon(object):
 
 
     def mainLoop(self):
-        # FUTURE: implement self.cfg.parallelConversions() parallelization
-        syncFreq = self.cfg.getFullSyncFrequency()
-        pollFreq = self.cfg.getPollFrequency()
-        waitTime = 0
-        syncTime = 0
-        poll=False
         try:
             while not self.stop and not self.restart:
-                if waitTime > 0:
-                    self.progress.clear()
-                    self.progress.setPhase('sleep')
-                    self.progress.add('%0.1f seconds' %waitTime)
-                    self.progress.report()
-                    time.sleep(waitTime)
-                    self.progress.clear()
-                startTime = time.time()
-                if not poll:
-                    syncStartTime = startTime
-
-                self.runOnce(poll=poll)
-
-                now = time.time()
-                duration = now-startTime
-                syncDuration = now-syncStartTime
-                syncTime = max(0, syncFreq - syncDuration)
-                pollTime = max(0, pollFreq - duration)
-                poll = (pollTime < syncTime)
-                waitTime = min(syncTime, pollTime)
+                self.startJobs()
+                self.wait()
+                self.finishJobs()
+            # let running conversions finish before stopping or restarting
+            while self.pool.active():
+                self.finishJobs(block=True)
 
         finally:
             if self.restart:
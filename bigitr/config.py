@@ -15,9 +15,16 @@
 #
 
 import os
+import re
 import string
 import ConfigParser
 
+timeRE = re.compile(
+    r'\s*((?P<d>\d+)d\s*)?'
+    r'((?P<h>\d+)h\s*)?'
+    r'((?P<m>\d+)m\s*)?'
+    r'((?P<s>\d+)s?)?', re.I)
+
 class Config(ConfigParser.SafeConfigParser):
     def __init__(self, configFile, defaults={}):
         ConfigParser.SafeConfigParser.__init__(self, defaults)
@@ -77,6 +84,12 @@ class Config(ConfigParser.SafeConfigParser):
         i = ConfigParser.SafeConfigParser.items(self, *args, **kwargs)
         return [(x[0], self.get(args[0], x[0])) for x in i]
 
+    def _parseTimeSpec(self, timespec):
+        times = timeRE.search(timespec).groupdict()
+        # convert None to 0, strings to integers
+        times = dict((x, int(y) if y else 0) for x, y in times.items())
+        return times['d'] * 86000 + times['h'] * 3600 + times['m'] * 60 + times['s']
+
     def openConfig(self, configFileName):
         return open(configFileName)
 
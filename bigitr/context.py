@@ -52,6 +52,24 @@ class Context(object):
         checkout = os.path.basename(self.getCVSPath(repository))
         return '/'.join((base, repo, cvsbranch, checkout))
 
+    def getCVSImportCheckoutDir(self, repository, cvsbranch):
+        base = self.getImportCVSDir()
+        repo = self.getRepositoryName(repository)
+        checkout = os.path.basename(self.getCVSPath(repository))
+        return '/'.join((base, repo, cvsbranch, checkout))
+
+    def getCVSImportExportDir(self, repository, cvsbranch):
+        'export directory for one branch, when branches export concurrently'
+        base = self.getImportCVSDir()
+        repo = self.getRepositoryName(repository)
+        checkout = os.path.basename(self.getCVSPath(repository))
+        return '/'.join((base, repo, '.export-' + cvsbranch, checkout))
+
+    def getCVSLastImportFile(self, repository, cvsbranch):
+        base = self.getImportCVSDir()
+        repo = self.getRepositoryName(repository)
+        return '/'.join((base, repo, '.lastimport-' + cvsbranch))
+
     def getCVSExportDir(self, repository):
         base = self.getImportCVSDir()
         repo = self.getRepositoryName(repository)
@@ -14,9 +14,13 @@
 #  limitations under the License.
 #
 
+import errno
+import fcntl
+import functools
 import os
 import shell
 import tempfile
+import time
 
 from bigitr import util
 
@@ -27,10 +31,95 @@ from bigitr import util
 class CVSError(RuntimeError):
     pass
 
+class Connections(object):
+    'limit on cvs commands connected to CVS servers at once, across processes'
+    def __init__(self, lockBase=None, count=0):
+        self.lockBase = lockBase
+        self.count = count
+        # descriptors of the lock files of the slots this process holds
+        self.held = []
+
+    def acquire(self, block=True):
+        'take a slot; return: False if none is free and not block'
+        if not self.count:
+            return True
+        while True:
+            for i in range(self.count):
+                fd = os.open('%s.%d' %(self.lockBase, i),
+                             os.O_CREAT|os.O_RDWR, 0600)
+                # cvs must not keep the slot after it is released
+                fcntl.fcntl(fd, fcntl.F_SETFD,
+                            fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+                try:
+                    # flock locks are released even if the holder is killed
+                    fcntl.flock(fd, fcntl.LOCK_EX|fcntl.LOCK_NB)
+                except IOError, e:
+                    os.close(fd)
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    continue
+                self.held.append(fd)
+                return True
+            if not block:
+                return False
+            time.sleep(0.1)
+
+    def release(self):
+        if self.count:
+            # closing the only descriptor releases the lock
+            os.close(self.held.pop())
+
+# unlimited unless bigitrd sets GLOBAL.cvsconnections
+connections = Connections()
+
+def limitConnections(lockBase, count):
+    global connections
+    connections = Connections(lockBase, count)
+
+def connected(fn):
+    'hold a connection slot while fn runs cvs commands that use the server'
+    def wrapper(self, *args, **kwargs):
+        if self.connected:
+            # nested call
+            return fn(self, *args, **kwargs)
+        connections.acquire()
+        self.connected = True
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            self.connected = False
+            connections.release()
+    return wrapper
+
+def argSpace():
+    'bytes available for command arguments in the current environment'
+    # each string costs its bytes, a terminating NUL, and a pointer;
+    # leave headroom as POSIX recommends for xargs
+    environment = sum(len(k) + len(v) + 2 + 8 for k, v in os.environ.items())
+    return os.sysconf('SC_ARG_MAX') - environment - 2048
+
+def argChunks(args, names):
+    'split names into as few lists as fit on the command line after args'
+    space = argSpace() - sum(len(x) + 1 + 8 for x in args)
+    chunks = []
+    chunk = []
+    size = 0
+    for name in names:
+        cost = len(name) + 1 + 8
+        if chunk and size + cost > space:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+        chunk.append(name)
+        size += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
 def setCVSROOT(fn):
     def wrapper(self, *args, **kwargs):
         self.setEnvironment()
-        fn(self, *args, **kwargs)
+        return fn(self, *args, **kwargs)
     return wrapper
 
 def inCVSPATH(fn):
@@ -38,7 +127,7 @@ def inCVSPATH(fn):
         oldDir = os.getcwd()
         os.chdir(self.path)
         try:
-            fn(self, *args, **kwargs)
+            return fn(self, *args, **kwargs)
         except Exception as e:
             try:
                 # Failed CVS operations may leave checkout in inconsistent state.
@@ -55,7 +144,7 @@ def inCVSDIR(fn):
         oldDir = os.getcwd()
         os.chdir(os.path.dirname(self.path))
         try:
-            fn(self, *args, **kwargs)
+            return fn(self, *args, **kwargs)
         finally:
             os.chdir(oldDir)
     return wrapper
@@ -65,20 +154,32 @@ class CVS(object):
         '@{trunk}': None,
         }
 
-    def __init__(self, ctx, repo, branch):
+    def __init__(self, ctx, repo, branch, path=None):
         self.ctx = ctx
         self.repo = repo
         self.location = self.ctx.getCVSPath(repo)
-        self.path = ctx.getCVSBranchCheckoutDir(repo, branch)
+        if path is None:
+            path = ctx.getCVSBranchCheckoutDir(repo, branch)
+        self.path = path
         self.pathbase = os.path.basename(self.path)
         self.branch = branch
         self.mapped_branch = self.SYMBOLIC_BRANCH_MAP.get(branch, branch)
         self.log = self.ctx.logs[repo]
         self.root = ctx.getCVSRoot(repo)
+        self.connected = False
 
     def setEnvironment(self):
         os.environ['CVSROOT'] = self.root
 
+    def localRoot(self):
+        'return: repository directory if CVSROOT is local, otherwise None'
+        for method in (':local:', ':fork:'):
+            if self.root.startswith(method):
+                return self.root[len(method):]
+        if self.root.startswith('/'):
+            return self.root
+        return None
+
     def listContentFiles(self):
         allfiles = []
         dirlen = len(self.path) + 1
@@ -88,6 +189,7 @@ class CVS(object):
             allfiles.extend(['/'.join((root, x))[dirlen:] for x in files])
         return allfiles
 
+    @connected
     @setCVSROOT
     def export(self, targetDir):
         cmd = ['cvs', 'export', '-kk', '-d', targetDir, '-D', 'now']
@@ -96,49 +198,162 @@ class CVS(object):
         cmd.append(self.location)
         shell.run(self.log, *cmd)
 
+    def changedSince(self, timestamp):
+        'return: whether there may be any commits since timestamp'
+        localRoot = self.localRoot()
+        if localRoot:
+            return self.localChangedSince(localRoot, timestamp)
+        return self.rlogChangedSince(timestamp)
+
+    def localChangedSince(self, localRoot, timestamp):
+        # commits to any branch (and tagging) rewrite the ,v files,
+        # so this may report changes that are not on this branch
+        for root, dirs, files in os.walk('/'.join((localRoot, self.location))):
+            for fileName in files:
+                if (fileName.endswith(',v') and
+                    os.path.getmtime('/'.join((root, fileName))) > timestamp):
+                    return True
+        return False
+
+    @connected
     @setCVSROOT
-    @inCVSDIR
-    def checkout(self):
+    def rlogChangedSince(self, timestamp):
+        date = time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(timestamp))
+        cmd = ['cvs', '-q', 'rlog', '-N', '-S', '-d', '>' + date]
+        if self.mapped_branch is None:
+            cmd.append('-b')
+        else:
+            cmd.append('-r' + self.branch)
+        cmd.append(self.location)
+        # rlog warns with a non-zero return code about files that
+        # are not on the branch
+        rc, output = shell.read(self.log, *cmd, error=False)
+        if rc and not output:
+            # failed; assume that there are changes
+            return True
+        return any(x.startswith('revision ') for x in output.split('\n'))
+
+    def checkoutCommand(self):
         cmd = ['cvs', 'checkout', '-kk', '-d', self.pathbase]
         if self.mapped_branch is not None:
             cmd.extend(('-r', self.branch))
         cmd.append(self.location)
-        shell.run(self.log, *cmd)
+        return cmd
 
+    @connected
+    @setCVSROOT
+    @inCVSDIR
+    def checkout(self):
+        shell.run(self.log, *self.checkoutCommand())
+
+    @setCVSROOT
+    def startCheckout(self, block=True):
+        'start checkout without waiting; return: function that waits for it'
+        # None if not block and there is no connection slot free
+        if not connections.acquire(block):
+            return None
+        try:
+            s = shell.LoggingShell(self.log, *self.checkoutCommand(),
+                                   cwd=os.path.dirname(self.path))
+        except:
+            connections.release()
+            raise
+        return functools.partial(self.finishCheckout, s)
+
+    def finishCheckout(self, s):
+        try:
+            s.finish()
+        finally:
+            connections.release()
+
+    @connected
     @inCVSPATH
     def infoDiff(self):
         # cvs diff uses non-zero return codes for success
         shell.run(self.log, 'cvs', 'diff', error=False)
 
+    @connected
     @inCVSPATH
     def update(self):
         shell.run(self.log, 'cvs', 'update', '-kk', '-d')
 
+    @setCVSROOT
+    def startUpdate(self, block=True):
+        'start update without waiting; return: function that waits for it'
+        # None if not block and there is no connection slot free
+        if not connections.acquire(block):
+            return None
+        try:
+            s = shell.LoggingShell(self.log, 'cvs', 'update', '-kk', '-d',
+                                   cwd=self.path)
+        except:
+            connections.release()
+            raise
+        return functools.partial(self.finishUpdate, s)
+
+    @inCVSPATH
+    def finishUpdate(self, s):
+        # inCVSPATH removes the checkout if the update failed
+        try:
+            s.finish()
+        finally:
+            connections.release()
+
+    @connected
+    @inCVSPATH
+    def updateFiles(self):
+        'return: [fileName, ...] updated from the repository'
+        _, output = shell.read(self.log,
+            'cvs', '-q', 'update', '-kk', '-d', '-P')
+        return [x[2:] for x in output.split('\n') if x[:2] in ('U ', 'P ')]
+
+    @connected
     @inCVSPATH
     def deleteFiles(self, fileNames):
         if fileNames:
             for fileName in fileNames:
                 os.remove(fileName)
-            shell.run(self.log, 'cvs', 'remove', *fileNames)
+            self.runChunked(('cvs', 'remove'), fileNames)
 
     def copyFiles(self, sourceDir, fileNames):
         'call addFiles for any files being added rather than updated'
         util.copyFiles(sourceDir, self.path, fileNames)
 
+    @connected
     @inCVSPATH
     def addDirectories(self, dirNames):
+        missing = set()
         for dirName in dirNames:
-            parent = os.path.dirname(dirName)
-            if parent and parent != '/' and not os.path.exists(parent + '/CVS'):
-                self.addDirectories((parent,))
-            if not os.path.exists(dirName + '/CVS'):
-                shell.run(self.log, 'cvs', 'add', dirName)
+            while (dirName and dirName != '/' and dirName not in missing
+                   and not os.path.exists(dirName + '/CVS')):
+                missing.add(dirName)
+                dirName = os.path.dirname(dirName)
+        # one cvs add per depth, so that every parent is added before
+        # its children rather than one server round trip per directory
+        levels = {}
+        for dirName in missing:
+            levels.setdefault(dirName.count('/'), []).append(dirName)
+        for depth in sorted(levels):
+            self.runChunked(('cvs', 'add'), sorted(levels[depth]))
 
+    @connected
     @inCVSPATH
     def addFiles(self, fileNames):
         if fileNames:
-            shell.run(self.log, 'cvs', 'add', '-kk', *fileNames)
+            self.runChunked(('cvs', 'add', '-kk'), fileNames)
+
+    def runChunked(self, args, names):
+        'run args with names in as few commands as the OS allows'
+        chunks = argChunks(args, names)
+        done = 0
+        for i, chunk in enumerate(chunks):
+            if len(chunks) > 1:
+                done += len(chunk)
+                os.write(self.log.stdout, '%s: part %d of %d, %d of %d names\n'
+                    %(' '.join(args), i + 1, len(chunks), done, len(names)))
+            shell.run(self.log, *(args + tuple(chunk)))
 
+    @connected
     @inCVSPATH
     def commit(self, message):
         fd, name = tempfile.mkstemp('.bigitr')
@@ -14,7 +14,9 @@
 #  limitations under the License.
 #
 
+import functools
 import os
+import shutil
 import time
 
 from bigitr import cvs
@@ -22,6 +24,7 @@ from bigitr import errhandler
 from bigitr import git
 from bigitr import gitmerge
 from bigitr import ignore
+from bigitr import pool
 from bigitr import util
 
 class Importer(object):
@@ -32,36 +35,175 @@ class Importer(object):
     def importAll(self):
         for repository in self.ctx.getRepositories():
             Git = git.Git(self.ctx, repository)
-            self.importBranches(repository, Git)
+            try:
+                self.importBranches(repository, Git)
+            finally:
+                Git.close()
 
-    def importBranches(self, repository, Git, requestedBranch=None):
-        onerror = self.ctx.getImportError()
+    def getLastImport(self, repository, cvsbranch):
+        'return: time at which the last successful import started, or None'
+        lastImportFile = self.ctx.getCVSLastImportFile(repository, cvsbranch)
+        if not os.path.exists(lastImportFile):
+            return None
+        return float(file(lastImportFile).read())
+
+    def setLastImport(self, repository, cvsbranch, timestamp):
+        lastImportFile = self.ctx.getCVSLastImportFile(repository, cvsbranch)
+        file(lastImportFile, 'w').write('%f' %timestamp)
+
+    def clearLastImport(self, repository, cvsbranch):
+        lastImportFile = self.ctx.getCVSLastImportFile(repository, cvsbranch)
+        if os.path.exists(lastImportFile):
+            os.remove(lastImportFile)
+
+    def changedBranches(self, repository):
+        'return: [cvsbranch, ...] with possible commits since the last import'
+        changed = []
         for cvsbranch, gitbranch in self.ctx.getImportBranchMaps(repository):
-            if requestedBranch is None or cvsbranch == requestedBranch:
+            lastImport = self.getLastImport(repository, cvsbranch)
+            CVS = cvs.CVS(self.ctx, repository, cvsbranch)
+            if lastImport is None or CVS.changedSince(lastImport):
+                changed.append(cvsbranch)
+        return changed
+
+    def unchanged(self, repository, CVS, cvsbranch):
+        'return: whether CVS branch is known to be unchanged since last import'
+        if not self.ctx.getImportSkipUnchanged():
+            return False
+        lastImport = self.getLastImport(repository, cvsbranch)
+        if lastImport is None:
+            return False
+        return not CVS.changedSince(lastImport)
+
+    def importBranches(self, repository, Git, requestedBranch=None,
+                       changedBranches=None):
+        'changedBranches: CVS branches known to have changed, not checked again'
+        onerror = self.ctx.getImportError()
+        branchMaps = [(cvsbranch, gitbranch) for cvsbranch, gitbranch
+                      in self.ctx.getImportBranchMaps(repository)
+                      if (requestedBranch is None or cvsbranch == requestedBranch)
+                      and (changedBranches is None
+                           or cvsbranch in changedBranches)]
+        skipUnchanged = changedBranches is None
+        fetches = None
+        parallel = self.ctx.getImportParallel()
+        if parallel > 1 and len(branchMaps) > 1:
+            # exports mostly wait on the CVS server, so later branches
+            # are exported while earlier ones are committed to Git,
+            # which still happens one branch at a time in branch order
+            fetches = pool.Results(parallel)
+        started = 0
+        try:
+            for cvsbranch, gitbranch in branchMaps:
+                while (fetches and started < len(branchMaps)
+                       and not fetches.full()):
+                    startbranch = branchMaps[started][0]
+                    fetches.start(startbranch, self.fetchcvs, repository,
+                        cvs.CVS(self.ctx, repository, startbranch), startbranch,
+                        self.ctx.getCVSImportExportDir(repository, startbranch),
+                        skipUnchanged)
+                    started += 1
                 CVS = cvs.CVS(self.ctx, repository, cvsbranch)
                 try:
-                    self.importcvs(repository, Git, CVS, cvsbranch, gitbranch)
+                    if fetches:
+                        self.importcvs(repository, Git, CVS, cvsbranch,
+                                       gitbranch, fetches.result(cvsbranch))
+                    elif not skipUnchanged:
+                        self.importcvs(repository, Git, CVS, cvsbranch,
+                            gitbranch, self.fetchcvs(repository, CVS,
+                                cvsbranch, skipUnchanged=False))
+                    else:
+                        self.importcvs(repository, Git, CVS, cvsbranch,
+                                       gitbranch)
                 except Exception as e:
                     self.err(repository, onerror)
+                finally:
+                    if fetches:
+                        self.removeExportDir(repository, cvsbranch)
+        finally:
+            if fetches:
+                fetches.finish()
+                # exports started but never imported because of an abort
+                for cvsbranch, gitbranch in branchMaps[:started]:
+                    self.removeExportDir(repository, cvsbranch)
+            # even after an abort, push what was successfully imported
+            try:
+                Git.pushQueued()
+            except Exception as e:
+                self.err(repository, onerror)
+
+    def removeExportDir(self, repository, cvsbranch):
+        # each concurrently exported branch has its own full copy,
+        # which is no longer needed once the branch has been imported
+        exportDir = os.path.dirname(
+            self.ctx.getCVSImportExportDir(repository, cvsbranch))
+        if os.path.exists(exportDir):
+            # not util.removeRecursive, which would also remove the
+            # repository directory holding the last import times if
+            # this left it empty
+            shutil.rmtree(exportDir)
+
+    @util.saveDir
+    def fetchcvs(self, repository, CVS, cvsbranch, exportDir=None,
+                 skipUnchanged=True):
+        'return: (exportTime, exportDir, files, updated, deleted) or () if unchanged'
+        repoDir = '/'.join((self.ctx.getGitDir(),
+                            self.ctx.getRepositoryName(repository)))
+        if exportDir is None:
+            exportDir = self.ctx.getCVSExportDir(repository)
+
+        if (skipUnchanged and os.path.exists(repoDir) and
+            self.unchanged(repository, CVS, cvsbranch)):
+            return ()
+
+        # commits after the export starts might not be exported
+        exportTime = time.time()
+        if self.ctx.getImportIncremental():
+            exportDir = self.ctx.getCVSImportCheckoutDir(repository, cvsbranch)
+            exportedFiles, updatedFiles, deletedFiles = self.updateCheckout(
+                repository, cvsbranch, exportDir)
+        else:
+            updatedFiles = deletedFiles = None
+            if os.path.exists(exportDir):
+                util.removeRecursive(exportDir)
+            os.makedirs(exportDir)
+            os.chdir(os.path.dirname(exportDir))
+            CVS.export(os.path.basename(exportDir))
+            exportedFiles = util.listFiles(exportDir)
+        return exportTime, exportDir, exportedFiles, updatedFiles, deletedFiles
 
     @util.saveDir
-    def importcvs(self, repository, Git, CVS, cvsbranch, gitbranch):
+    def importcvs(self, repository, Git, CVS, cvsbranch, gitbranch,
+                  fetched=None):
         gitDir = self.ctx.getGitDir()
         repoName = self.ctx.getRepositoryName(repository)
         repoDir = '/'.join((gitDir, repoName))
         skeleton = self.ctx.getSkeleton(repository)
-        exportDir = self.ctx.getCVSExportDir(repository)
 
-        if os.path.exists(exportDir):
-            util.removeRecursive(exportDir)
-        os.makedirs(exportDir)
-        os.chdir(os.path.dirname(exportDir))
-        CVS.export(os.path.basename(exportDir))
+        if fetched is None:
+            fetched = self.fetchcvs(repository, CVS, cvsbranch)
+
+        if not fetched:
+            os.chdir(repoDir)
+            if gitbranch in Git.branches():
+                # nothing to export, copy, or commit, but merges
+                # downstream might have been failing
+                if Git.branch() != gitbranch:
+                    Git.checkout(gitbranch)
+                Git.fetch()
+                Git.mergeFastForward('origin/' + gitbranch)
+                merger = gitmerge.Merger(self.ctx)
+                merger.mergeFrom(repository, Git, gitbranch)
+                return
+            # the Git branch is missing, so import it anyway
+            fetched = self.fetchcvs(repository, CVS, cvsbranch,
+                                    skipUnchanged=False)
+
+        exportTime, exportDir, exportedFiles, updatedFiles, deletedFiles = fetched
         cvsignore = ignore.Ignore(Git.log, exportDir + '/.cvsignore')
         # Awaiting use case requiring partial import into Git before
         # writing test cases to implement it for import from CVS into Git
         # bigitrsync = ignore.Ignore(Git.log, gitDir + '/.bigitrsync', regex=True)
-        exportedFiles = util.listFiles(exportDir)
         if not exportedFiles:
             raise RuntimeError("CVS branch '%s' for location '%s' contains no files"
                                %(CVS.branch, CVS.location))
@@ -72,7 +214,20 @@ class Importer(object):
 
         Git.initializeGitRepository()
 
+        # the import is complete only once the branch has been pushed
+        setLastImport = functools.partial(self.setLastImport,
+            repository, cvsbranch, exportTime)
+
         os.chdir(repoDir)
+        if (self.ctx.getImportFastImport() and
+            not self.ctx.getGitImpPreHooks(repository, gitbranch)):
+            self.fastImport(repository, Git, gitbranch, cvsignore, exportDir,
+                            exportedFiles, updatedFiles, deletedFiles,
+                            setLastImport)
+            merger = gitmerge.Merger(self.ctx)
+            merger.mergeFrom(repository, Git, gitbranch)
+            return
+
         addSkeleton = False
         branches = Git.branches()
         if gitbranch not in branches:
@@ -92,25 +247,29 @@ class Importer(object):
         # clean up after any garbage left over from previous runs so
         # that we can change branches
         Git.pristine()
+        branchDir = Git.branchDir(gitbranch)
 
-        gitFiles = Git.listContentFiles()
-        gitFiles = cvsignore.filter(set(gitFiles))
-        gitFiles.discard('.bigitrsync')
-        # delete only files matching the sync expressions
-        # gitFiles = sorted(list(bigitrsync.include(gitFiles)))
-        for filename in gitFiles:
-            os.remove(filename)
+        if updatedFiles is None:
+            gitFiles = Git.listContentFiles()
+            gitFiles = cvsignore.filter(set(gitFiles))
+            gitFiles.discard('.bigitrsync')
+            # delete only files matching the sync expressions
+            # gitFiles = sorted(list(bigitrsync.include(gitFiles)))
+        else:
+            # the branch already matches the checkout before the update
+            exportedFiles = updatedFiles
+            gitFiles = deletedFiles
 
         os.chdir(gitDir)
 
-        util.copyFiles(exportDir, repoDir, exportedFiles)
+        util.syncFiles(exportDir, branchDir, exportedFiles, gitFiles)
 
         if addSkeleton:
             if skeleton:
                 skelFiles = util.listFiles(skeleton)
-                util.copyFiles(skeleton, repoDir, skelFiles)
+                util.copyFiles(skeleton, branchDir, skelFiles)
 
-        os.chdir(repoDir)
+        os.chdir(branchDir)
         Git.runImpPreHooks(gitbranch)
         if Git.status():
             # there is some change to commit
@@ -126,8 +285,73 @@ class Importer(object):
             # FIXME: try to create a commit message that includes all
             # the CVS commit messages since the previous commit, de-duplicated
             Git.commit('import from CVS as of %s' %time.asctime())
-            Git.push('origin', gitbranch, gitbranch)
-            Git.runImpPostHooks(gitbranch)
+            Git.queuePush(gitbranch, gitbranch,
+                functools.partial(Git.runImpPostHooks, gitbranch, checkout=True),
+                setLastImport)
+        else:
+            setLastImport()
 
         merger = gitmerge.Merger(self.ctx)
         merger.mergeFrom(repository, Git, gitbranch)
+
+    def fastImport(self, repository, Git, gitbranch, cvsignore, exportDir,
+                   exportedFiles, updatedFiles, deletedFiles, setLastImport):
+        # pre hooks need a working tree, so this is used only without them
+        Git.fetch()
+        parent = None
+        if 'remotes/origin/' + gitbranch in Git.branches():
+            parent = 'origin/' + gitbranch
+        files = [(x, '/'.join((exportDir, x))) for x in exportedFiles]
+        if parent is None:
+            # new branch
+            deletedFiles = []
+            skeleton = self.ctx.getSkeleton(repository)
+            if skeleton:
+                files.extend((x, '/'.join((skeleton, x)))
+                             for x in util.listFiles(skeleton))
+        elif updatedFiles is None:
+            # same files preserved as when importing through the working tree
+            gitFiles = set(x for x in Git.listTreeFiles(parent)
+                           if not os.path.basename(x).startswith('.git'))
+            gitFiles = cvsignore.filter(gitFiles)
+            gitFiles.discard('.bigitrsync')
+            deletedFiles = sorted(gitFiles - set(exportedFiles))
+        else:
+            files = [(x, '/'.join((exportDir, x))) for x in updatedFiles]
+
+        if Git.fastImport(gitbranch, parent, 'import from CVS as of %s'
+                          %time.asctime(), files, deletedFiles):
+            if parent:
+                Git.infoDiff(parent, gitbranch)
+            Git.queuePush(gitbranch, gitbranch,
+                functools.partial(Git.runImpPostHooks, gitbranch, checkout=True),
+                setLastImport)
+        else:
+            setLastImport()
+
+    def updateCheckout(self, repository, cvsbranch, checkoutDir):
+        'return: (allfiles, updatedfiles or None if all, deletedfiles or None)'
+        CVS = cvs.CVS(self.ctx, repository, cvsbranch, path=checkoutDir)
+        lastImport = self.getLastImport(repository, cvsbranch)
+        # the checkout no longer matches the Git branch until this
+        # import completes
+        self.clearLastImport(repository, cvsbranch)
+        if not os.path.exists(checkoutDir):
+            parentDir = os.path.dirname(checkoutDir)
+            if not os.path.exists(parentDir):
+                os.makedirs(parentDir)
+            CVS.checkout()
+            if not os.path.exists(checkoutDir):
+                raise RuntimeError("CVS branch '%s' for location '%s' does not exist"
+                                   %(CVS.branch, CVS.location))
+            return CVS.listContentFiles(), None, None
+        oldFiles = set(CVS.listContentFiles())
+        updatedFiles = set(CVS.updateFiles())
+        newFiles = CVS.listContentFiles()
+        if lastImport is None:
+            # cannot know what changed since the Git branch was imported
+            return newFiles, None, None
+        newFileSet = set(newFiles)
+        updatedFiles.update(newFileSet - oldFiles)
+        return (newFiles, sorted(updatedFiles & newFileSet),
+                sorted(oldFiles - newFileSet))
@@ -17,7 +17,6 @@
 # Read configuration file for Git / CVS synchronization daemon
 
 import glob
-import re
 
 from bigitr import config
 
@@ -27,22 +26,29 @@ class DaemonConfig(config.Config):
             'mailall': 'false',
             'smarthost': 'localhost'})
         self.requireAbsolutePaths('repoconfig', 'appconfig')
-        self.timeRE = re.compile(
-            r'\s*((?P<d>\d+)d\s*)?'
-            r'((?P<h>\d+)h\s*)?'
-            r'((?P<m>\d+)m\s*)?'
-            r'((?P<s>\d+)s?)?', re.I)
 
     def parallelConversions(self):
         'number of repositories to process in parallel'
         return int(self.getDefault('GLOBAL', 'parallel', 1))
 
+    def getCVSConnections(self):
+        'most cvs commands connected to CVS servers at once; 0 for no limit'
+        return int(self.getDefault('GLOBAL', 'cvsconnections', 0))
+
     def getPollFrequency(self):
         '[%dd][%dh][%dm][%d[s]] minimum frequency for polling full sync'
         # minimum time to wait since last poll started, per repository
         timespec = self.getGlobalDefault('GLOBAL', 'pollfrequency', '5m')
         return self._parseTimeSpec(timespec)
 
+    def getMaxPollFrequency(self):
+        '[%dd][%dh][%dm][%d[s]] ceiling for backing off polls of idle repositories'
+        timespec = self.getGlobalDefault('GLOBAL', 'maxpollfrequency', None)
+        if timespec is None:
+            # no backoff
+            return self.getPollFrequency()
+        return self._parseTimeSpec(timespec)
+
     def getFullSyncFrequency(self):
         '[%dd][%dh][%dm][%d[s]] minimum frequency for unconditional full sync'
         # minimum time to wait to start a full sync, per repository
@@ -78,9 +84,3 @@ class DaemonConfig(config.Config):
         for repoGlob in self.getGlobalFallback(section, 'repoconfig').split():
             repoConfig.extend(glob.glob(repoGlob))
         return sorted(repoConfig)
-
-    def _parseTimeSpec(self, timespec):
-        times = self.timeRE.search(timespec).groupdict()
-        # convert None to 0, strings to integers
-        times = dict((x, int(y) if y else 0) for x, y in times.items())
-        return times['d'] * 86000 + times['h'] * 3600 + times['m'] * 60 + times['s']
@@ -14,24 +14,180 @@
 #  limitations under the License.
 #
 
+import copy
+import fcntl
 import os
 import shell
 import shlex
+import stat
+import subprocess
+import sys
 
 from bigitr import util
 
+def cached(fn):
+    'remember the result until a method decorated with changesRefs runs'
+    name = fn.__name__
+    def wrapper(self):
+        # with worktrees, the current branch depends on the directory
+        key = (name, os.getcwd())
+        if key not in self.cache:
+            self.cache[key] = fn(self)
+        # callers may modify the result
+        return copy.copy(self.cache[key])
+    return wrapper
+
+def changesRefs(fn):
+    def wrapper(self, *args, **kwargs):
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            # even failed commands may have changed some refs
+            self.cache.clear()
+    return wrapper
+
+def changesRemote(fn):
+    def wrapper(self, *args, **kwargs):
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            # the next fetch may find something new
+            self.fetched = False
+    return wrapper
+
 class Git(object):
     def __init__(self, ctx, repo):
         self.ctx = ctx
         self.repo = repo
         self.log = self.ctx.logs[repo]
-
+        # results of @cached methods
+        self.cache = {}
+        # whether origin has been fetched since this process last pushed
+        self.fetched = False
+        # whether updateReference has run
+        self.referenceUpdated = False
+        # [[hash, remote ref, [callback, ...]], ...] for pushQueued
+        self.pushes = []
+        # long-lived git cat-file --batch-check, started on first use
+        self.catFile = None
+
+    def close(self):
+        if self.catFile is not None:
+            catFile = self.catFile
+            self.catFile = None
+            catFile.stdin.close()
+            catFile.finish()
+
+    def startCatFile(self):
+        # refs other than the per-worktree ones are shared by every
+        # working tree, so it does not matter which one is current
+        self.catFile = shell.LoggingShell(self.log,
+            'git', 'cat-file', '--batch-check',
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=self.repoDir())
+        # other children must not hold the pipe open after close()
+        fd = self.catFile.stdin.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFD,
+                    fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    def objectInfo(self, ref):
+        'return: (hash, type) for ref (any object name), or None if missing'
+        if '\n' in ref:
+            return None
+        if self.catFile is None:
+            self.startCatFile()
+        self.catFile.stdin.write(ref + '\n')
+        self.catFile.stdin.flush()
+        line = self.catFile.stdout.readline()
+        if not line:
+            self.close()
+            raise RuntimeError('git cat-file exited unexpectedly')
+        fields = line.split()
+        if len(fields) != 3:
+            # "<ref> missing" or "<ref> ambiguous"
+            return None
+        return fields[0], fields[1]
+
+    @changesRefs
     def clone(self, uri):
-        return shell.run(self.log, 'git', 'clone', uri)
+        cmd = ['git', 'clone']
+        cloneFilter = self.ctx.getGitCloneFilter()
+        if cloneFilter:
+            cmd.append('--filter=' + cloneFilter)
+        depth = self.ctx.getGitCloneDepth()
+        if depth:
+            # every branch is needed, not just the default branch
+            cmd.extend(('--depth', str(depth), '--no-single-branch'))
+        reference = self.updateReference()
+        if reference:
+            cmd.extend(('--reference', reference))
+            if self.ctx.getGitDissociate():
+                cmd.append('--dissociate')
+        cmd.append(uri)
+        rc = shell.run(self.log, *cmd)
+        self.fetched = True
+        return rc
+
+    def updateReference(self):
+        'fetch into the shared reference repository; return: its path or None'
+        reference = self.ctx.getGitReferenceDir()
+        if not reference or self.referenceUpdated:
+            return reference
+        gitDir = '--git-dir=' + reference
+        if not os.path.exists(reference):
+            shell.run(self.log, 'git', 'init', '--quiet', '--bare', reference)
+            # clones that are not dissociated borrow objects from the
+            # reference, so objects it no longer needs must never be pruned
+            shell.run(self.log, 'git', gitDir, 'config', 'gc.pruneExpire', 'never')
+        # one namespace per repository keeps every repository's history
+        # reachable; failing to refresh the reference only costs time
+        shell.run(self.log, 'git', gitDir, 'fetch', '--quiet', '--no-tags',
+            self.ctx.getGitRef(self.repo),
+            '+refs/heads/*:refs/remotes/%s/*' %self.ctx.getRepositoryName(self.repo),
+            error=False)
+        shell.run(self.log, 'git', gitDir, 'gc', '--auto', '--quiet', error=False)
+        self.referenceUpdated = True
+        return reference
 
     def fetch(self):
-        return shell.run(self.log, 'git', 'fetch', '--all')
+        # each fetch is a round trip to the server, and only pushes
+        # from this process are expected to change what it would find
+        if not self.fetched:
+            self.fetchAll()
+
+    @changesRefs
+    def fetchAll(self):
+        rc = shell.run(self.log, 'git', 'fetch', '--all')
+        self.fetched = True
+        return rc
+
+    def shallow(self):
+        # in a linked worktree, .git is a file and the shallow file is
+        # in the common git directory, so ask git
+        _, output = shell.read(self.log,
+            'git', 'rev-parse', '--is-shallow-repository')
+        return output.strip() == 'true'
+
+    def deepen(self, since, until):
+        'in a shallow clone, fetch history until since and until share history'
+        depth = self.ctx.getGitCloneDepth() or 1
+        while self.shallow():
+            rc, _ = shell.read(self.log,
+                'git', 'merge-base', since, until, error=False)
+            if rc == 0:
+                return
+            # when the roots have been fetched, the clone is complete
+            shell.run(self.log, 'git', 'fetch', '--deepen=%d' %depth, 'origin')
+            # the fetch also updates remote tracking branches
+            self.cache.clear()
+            depth *= 2
+
+    def lsRemote(self, remote, *refs):
+        'return: {ref: hash, ...} for refs/heads/* in remote (only refs if specified)'
+        _, output = shell.read(self.log,
+            'git', 'ls-remote', '--heads', remote, *refs)
+        return dict(reversed(x.split('\t')) for x in output.split('\n') if x)
 
+    @changesRefs
     def reset(self, ref='HEAD'):
         shell.run(self.log, 'git', 'reset', '--hard', ref)
 
@@ -41,11 +197,10 @@ class Git(object):
     def pristine(self):
         if self.statusIgnored():
             self.clean()
-            refs = self.refs()
-            if refs:
-                if 'HEAD' in (x[1] for x in refs):
-                    self.reset()
+            if self.revParse('HEAD'):
+                self.reset()
 
+    @cached
     def branches(self):
         _, branches = shell.read(self.log,
             'git', 'branch', '-a')
@@ -53,11 +208,14 @@ class Git(object):
             return set(x[2:].split()[0] for x in branches.split('\n') if x)
         return set()
 
+    @cached
     def branch(self):
+        # detached HEAD (as in the main tree when using worktrees) is ''
         _, branch = shell.read(self.log,
-            'git', 'symbolic-ref', '--short', '-q', 'HEAD')
-        return branch
+            'git', 'symbolic-ref', '--short', '-q', 'HEAD', error=False)
+        return branch.strip()
 
+    @cached
     def refs(self):
         # no refs yet returns an error in normal operations
         rc, refs = shell.read(self.log,
@@ -66,23 +224,167 @@ class Git(object):
             return [tuple(x.split()) for x in refs.strip().split('\n')]
         return None
 
+    @staticmethod
+    def perWorktree(ref):
+        'whether ref may name a different object in each working tree'
+        name = ref
+        for separator in '~^:':
+            name = name.split(separator, 1)[0]
+        return (not name or name.startswith('@')
+                or ('/' not in name and name.endswith('HEAD'))
+                or name.startswith('refs/worktree/')
+                or name.startswith('refs/bisect/'))
+
+    def revParse(self, ref):
+        'return: object hash for ref, or None if it does not exist'
+        if self.perWorktree(ref):
+            # the shared cat-file process may be in another working tree
+            rc, rev = shell.read(self.log,
+                'git', 'rev-parse', '--verify', '-q', ref, error=False)
+            if rc:
+                return None
+            return rev.strip()
+        # answered by cat-file rather than a new rev-parse process
+        info = self.objectInfo(ref)
+        if info is None:
+            return None
+        return info[0]
+
+    @changesRefs
+    def updateRef(self, ref, rev):
+        shell.run(self.log, 'git', 'update-ref', ref, rev)
+
+    def listTreeFiles(self, ref):
+        _, files = shell.read(self.log,
+            'git', 'ls-tree', '-r', '-z', '--name-only', ref)
+        return [x for x in files.split('\0') if x]
+
+    def committerIdent(self):
+        'return: "Name <email> time tz" as used by git fast-import'
+        _, ident = shell.read(self.log, 'git', 'var', 'GIT_COMMITTER_IDENT')
+        return ident.strip()
+
+    @staticmethod
+    def fastImportPath(path):
+        # paths starting with a quote or containing newlines must be quoted
+        if path.startswith('"') or '\n' in path:
+            return '"%s"' %(path.replace('\\', '\\\\').replace('"', '\\"')
+                                .replace('\n', '\\n'))
+        return path
+
+    @changesRefs
+    def fastImport(self, branch, parent, message, files, deletedFiles):
+        'commit files [(path, sourcefile), ...]; return: whether tree changed'
+        # builds the commit without the working tree or index
+        ref = 'refs/heads/' + branch
+        committer = self.committerIdent()
+        parentRev = None
+        if parent:
+            parentRev = self.revParse(parent)
+        p = shell.LoggingShell(self.log,
+            'git', 'fast-import', '--quiet', '--force', stdin=subprocess.PIPE)
+        try:
+            w = p.stdin.write
+            # reset so that a missing parent creates a root commit
+            w('reset %s\n' %ref)
+            w('commit %s\n' %ref)
+            w('committer %s\n' %committer)
+            w('data %d\n%s\n' %(len(message), message))
+            if parentRev:
+                w('from %s\n' %parentRev)
+            for path in deletedFiles:
+                w('D %s\n' %self.fastImportPath(path))
+            for path, sourceFile in files:
+                mode = '100644'
+                if os.stat(sourceFile).st_mode & stat.S_IXUSR:
+                    mode = '100755'
+                data = file(sourceFile).read()
+                w('M %s inline %s\ndata %d\n' %(
+                    mode, self.fastImportPath(path), len(data)))
+                w(data)
+                w('\n')
+            w('done\n')
+        finally:
+            p.stdin.close()
+            p.finish()
+        if not parentRev:
+            return True
+        if self.revParse(ref + '^{tree}') == self.revParse(parentRev + '^{tree}'):
+            # do not create empty commits
+            self.updateRef(ref, parentRev)
+            return False
+        return True
+
+    @changesRemote
+    @changesRefs
     def newBranch(self, branch):
         shell.run(self.log, 'git', 'branch', branch)
         shell.run(self.log, 'git', 'push', '--set-upstream', 'origin', branch)
 
+    @changesRefs
     def trackBranch(self, branch):
         shell.run(self.log, 'git', 'branch', '--track', branch, 'origin/'+branch)
         
+    def repoDir(self):
+        return '/'.join((self.ctx.getGitDir(),
+                         self.ctx.getRepositoryName(self.repo)))
+
+    def worktreeDir(self, branch):
+        # outside the main working tree, where git clean would see it
+        return '/'.join((self.ctx.getGitDir(),
+                         self.ctx.getRepositoryName(self.repo) + '.worktrees',
+                         branch))
+
+    def branchDir(self, branch):
+        'return: working tree in which branch is checked out'
+        if self.ctx.getGitWorktrees():
+            return self.worktreeDir(branch)
+        return self.repoDir()
+
+    def addWorktree(self, branch, *args):
+        'create the worktree for branch with git worktree add args, and enter it'
+        path = self.worktreeDir(branch)
+        repoDir = self.repoDir()
+        # a branch may be checked out in only one working tree
+        _, head = shell.read(self.log,
+            'git', '-C', repoDir, 'symbolic-ref', '-q', 'HEAD', error=False)
+        if head.strip() == 'refs/heads/' + branch:
+            shell.run(self.log, 'git', '-C', repoDir, 'checkout', '--detach')
+        # forget worktrees that have been removed
+        shell.run(self.log, 'git', '-C', repoDir, 'worktree', 'prune')
+        shell.run(self.log, 'git', '-C', repoDir, 'worktree', 'add', path, *args)
+        os.chdir(path)
+
+    @changesRefs
     def checkoutTracking(self, branch):
+        if self.ctx.getGitWorktrees():
+            self.addWorktree(branch, '--track', '-b', branch, 'origin/'+branch)
+            return
         shell.run(self.log,
             'git', 'checkout', '-f', '--track', 'origin/'+branch)
 
+    @changesRefs
     def checkoutNewImportBranch(self, branch):
+        if self.ctx.getGitWorktrees():
+            self.addWorktree(branch, '--detach')
         shell.run(self.log, 'git', 'checkout', '--orphan', branch)
         # this command will fail for initial checkins with no files
         shell.run(self.log, 'git', 'rm', '-rf', '.', error=False)
 
+    @changesRefs
     def checkout(self, branch):
+        if self.ctx.getGitWorktrees():
+            # each branch keeps its own working tree, so changing
+            # branches is changing directories
+            path = self.worktreeDir(branch)
+            if os.path.exists(path):
+                os.chdir(path)
+                # the branch may have moved since the tree was used,
+                # or a failed merge may have been left behind
+                self.pristine()
+            else:
+                self.addWorktree(branch, branch)
+            return
         # line ending normalization can cause checkout to fail to
         # change branch without -f even though there are no other
         # changes in the working directory
@@ -97,6 +399,15 @@ class Git(object):
         return [x for x in files.split('\0')
                 if x and not os.path.basename(x).startswith('.git')]
 
+    def diffTree(self, since, until):
+        'return [(status, path), ...] for files changed from since to until'
+        _, output = shell.read(self.log,
+            'git', 'diff-tree', '-r', '--no-renames', '--name-status', '-z',
+            since, until)
+        fields = output.split('\0')
+        return [(fields[i], fields[i+1])
+                for i in range(0, len(fields) - 1, 2)]
+
     def status(self):
         _, output = shell.read(self.log,
             'git', 'status', '--porcelain')
@@ -124,30 +435,157 @@ class Git(object):
     def addAll(self):
         shell.run(self.log, 'git', 'add', '-A', '.')
 
+    @changesRefs
     def mergeDefault(self, branch, message):
+        self.deepen('HEAD', branch)
         return shell.run(self.log, 'git', 'merge', branch, '-m', message,
                          error=False)
 
+    def isAncestor(self, ancestor, descendant):
+        rc = shell.run(self.log, 'git', 'merge-base', '--is-ancestor',
+                       ancestor, descendant, error=False)
+        return rc == 0
+
+    def upToDate(self, target, branch):
+        'return: whether origin/target has branch merged and nothing to push'
+        # hashes come from cat-file, so in the common case of nothing
+        # new this runs at most one git command, and none at all when
+        # branch is already where origin/target is
+        originRev = self.revParse('refs/remotes/origin/' + target)
+        branchRev = self.revParse(branch)
+        if originRev is None or branchRev is None:
+            return False
+        # a local target that origin does not have may be a failed push
+        revs = set((branchRev, self.revParse('refs/heads/' + target)))
+        revs -= set((None, originRev))
+        if not revs:
+            return True
+        rc, output = shell.read(self.log,
+            'git', 'rev-list', '-n', '1', '^' + originRev, *sorted(revs),
+            error=False)
+        return rc == 0 and not output.strip()
+
+    @changesRefs
+    def mergeTree(self, target, branch, message):
+        'merge branch into target without a working tree; return: success'
+        # False means that the merge has to be done (or its conflicts
+        # reported) in a working tree: the merge conflicts, target
+        # cannot be fast-forwarded to origin, or git is too old for
+        # merge-tree --write-tree
+        targetRev = self.revParse('refs/heads/' + target)
+        originRev = self.revParse('refs/remotes/origin/' + target)
+        if originRev is None:
+            return False
+        tip = targetRev
+        if tip is None or self.isAncestor(tip, originRev):
+            tip = originRev
+        elif not self.isAncestor(originRev, tip):
+            return False
+        self.deepen(tip, branch)
+        branchRev = self.revParse(branch)
+        if self.isAncestor(branchRev, tip):
+            merged = tip
+        elif self.isAncestor(tip, branchRev):
+            merged = branchRev
+        else:
+            rc, tree = shell.read(self.log,
+                'git', 'merge-tree', '--write-tree', tip, branchRev,
+                error=False)
+            if rc != 0:
+                return False
+            _, merged = shell.read(self.log,
+                'git', 'commit-tree', tree.split('\n')[0],
+                '-p', tip, '-p', branchRev, '-m', message)
+            merged = merged.strip()
+        if merged == targetRev:
+            return True
+        # refuses to update the branch if it has moved meanwhile
+        shell.run(self.log, 'git', 'update-ref', '-m', message,
+            'refs/heads/' + target, merged, targetRev or '')
+        if self.branch() == target:
+            # a working tree with target checked out is now out of date
+            shell.run(self.log, 'git', 'reset', '--hard', merged)
+        return True
+
+    @changesRefs
     def mergeFastForward(self, branch):
         shell.run(self.log, 'git', 'merge', '--ff', '--ff-only', branch)
 
+    @changesRefs
     def mergeIgnore(self, branch):
         shell.run(self.log, 'git', 'merge', '--strategy=ours', '--ff',
             '-m', 'branch "%s" closed' %branch, branch)
 
+    @changesRefs
     def commit(self, message):
         shell.run(self.log, 'git', 'commit', '-m', message)
 
+    @changesRemote
+    @changesRefs
     def push(self, remote, localbranch, remotebranch):
         shell.run(self.log, 'git', 'push', remote,
             ':'.join((localbranch, remotebranch)))
 
+    def queuePush(self, localbranch, remotebranch, *callbacks):
+        'push localbranch as it is now at the next pushQueued, then callbacks'
+        rev = self.revParse(localbranch)
+        ref = 'refs/heads/' + remotebranch
+        for push in self.pushes:
+            if push[1] == ref:
+                push[0] = rev
+                push[2].extend(callbacks)
+                return
+        self.pushes.append([rev, ref, list(callbacks)])
+
+    @changesRemote
+    @changesRefs
+    @util.saveDir
+    def pushQueued(self):
+        'push all queued branches to origin in one connection'
+        if not self.pushes:
+            return
+        pushes = self.pushes
+        self.pushes = []
+        os.chdir(self.repoDir())
+        cmd = ['git', 'push', '--porcelain']
+        if self.ctx.getPushAtomic():
+            cmd.append('--atomic')
+        cmd.append('origin')
+        cmd.extend(':'.join((rev, ref)) for rev, ref, _ in pushes)
+        _, output = shell.read(self.log, *cmd, error=False)
+        pushed = set()
+        for line in output.split('\n'):
+            # <flag> TAB <from>:<to> TAB <summary>; '!' is rejected
+            fields = line.split('\t')
+            if len(fields) == 3 and fields[0] != '!':
+                pushed.add(fields[1].split(':')[-1])
+
+        # callbacks such as post hooks only for successfully pushed refs,
+        # and one failing does not keep the others from running
+        failed = [ref for _, ref, _ in pushes if ref not in pushed]
+        exception = None
+        for _, ref, callbacks in pushes:
+            if ref in pushed:
+                try:
+                    for callback in callbacks:
+                        callback()
+                except Exception:
+                    if exception is None:
+                        exception = sys.exc_info()
+        if failed:
+            raise RuntimeError('push to origin failed for %s: see %s' %(
+                ' '.join(failed), self.log.thiserr))
+        if exception is not None:
+            raise exception[0], exception[1], exception[2]
+
     def logmessages(self, since, until):
         options = self.ctx.getGitLogOptions(self.repo, until)
         if options is None:
             options = []
         else:
             options = shlex.split(options)
+        # otherwise, everything back to the shallow boundary is listed
+        self.deepen(since, until)
         options = ['git', 'log'] + options + ['%s..%s' %(since, until)]
         _, messages = shell.read(self.log, *options)
         return messages
@@ -184,18 +622,34 @@ class Git(object):
                 self.commit('create new empty master branch')
                 self.push('origin', 'master', 'master')
 
+    @changesRemote
+    @changesRefs
     def runImpPreHooks(self, branch):
         for hook in self.ctx.getGitImpPreHooks(self.repo, branch):
             shell.run(self.log, *hook)
 
-    def runImpPostHooks(self, branch):
-        for hook in self.ctx.getGitImpPostHooks(self.repo, branch):
+    @changesRemote
+    @changesRefs
+    def runImpPostHooks(self, branch, checkout=False):
+        hooks = self.ctx.getGitImpPostHooks(self.repo, branch)
+        if hooks and checkout:
+            # hooks run with the branch checked out
+            self.checkout(branch)
+        for hook in hooks:
             shell.run(self.log, *hook)
 
+    @changesRemote
+    @changesRefs
     def runExpPreHooks(self, branch):
         for hook in self.ctx.getGitExpPreHooks(self.repo, branch):
             shell.run(self.log, *hook)
 
-    def runExpPostHooks(self, branch):
-        for hook in self.ctx.getGitExpPostHooks(self.repo, branch):
+    @changesRemote
+    @changesRefs
+    def runExpPostHooks(self, branch, checkout=False):
+        hooks = self.ctx.getGitExpPostHooks(self.repo, branch)
+        if hooks and checkout:
+            # hooks run with the branch checked out
+            self.checkout(branch)
+        for hook in hooks:
             shell.run(self.log, *hook)
@@ -14,7 +14,9 @@
 #  limitations under the License.
 #
 
+import functools
 import os
+import sys
 import time
 
 from bigitr import errhandler
@@ -31,21 +33,83 @@ class Exporter(object):
     def exportAll(self):
         for repository in self.ctx.getRepositories():
             Git = git.Git(self.ctx, repository)
-            self.exportBranches(repository, Git)
+            try:
+                self.exportBranches(repository, Git)
+            finally:
+                Git.close()
 
     def exportBranches(self, repository, Git, requestedBranch=None):
         onerror = self.ctx.getExportError()
-        for gitbranch, cvsbranch, exportbranch in self.ctx.getExportBranchMaps(
-                repository):
-            if requestedBranch is None or gitbranch == requestedBranch:
-                CVS = cvs.CVS(self.ctx, repository, cvsbranch)
+        try:
+            branchMaps = [(gitbranch, cvs.CVS(self.ctx, repository, cvsbranch),
+                           exportbranch)
+                          for gitbranch, cvsbranch, exportbranch
+                          in self.ctx.getExportBranchMaps(repository)
+                          if requestedBranch is None or gitbranch == requestedBranch]
+            refreshed = set()
+            if self.ctx.getExportParallel() > 1 and len(branchMaps) > 1:
+                refreshed = self.refreshCheckouts(repository, Git, branchMaps)
+            for gitbranch, CVS, exportbranch in branchMaps:
                 try:
-                    self.exportgit(repository, Git, CVS, gitbranch, exportbranch)
+                    if gitbranch in refreshed:
+                        self.exportgit(repository, Git, CVS, gitbranch,
+                                       exportbranch, refreshed=True)
+                    else:
+                        self.exportgit(repository, Git, CVS, gitbranch,
+                                       exportbranch)
                 except Exception as e:
                     self.err(repository, onerror)
+        finally:
+            # even after an abort, record what was committed to CVS
+            try:
+                Git.pushQueued()
+            except Exception as e:
+                self.err(repository, onerror)
 
     @util.saveDir
-    def exportgit(self, repository, Git, CVS, gitbranch, exportbranch):
+    def refreshCheckouts(self, repository, Git, branchMaps):
+        'update CVS checkouts concurrently; return: set(gitbranch, ...) updated'
+        repoDir = '/'.join((self.ctx.getGitDir(),
+                            self.ctx.getRepositoryName(repository)))
+        if not os.path.exists(repoDir):
+            # the first export clones the repository
+            return set()
+        os.chdir(repoDir)
+        Git.fetch()
+        parallel = self.ctx.getExportParallel()
+        refreshed = set()
+        pending = []
+        def finishOne():
+            gitbranch, finish = pending.pop(0)
+            try:
+                finish()
+                refreshed.add(gitbranch)
+            except Exception:
+                # exportgit tries again, and reports any failure
+                pass
+        for gitbranch, CVS, exportbranch in branchMaps:
+            # only the branches that exportgit would update
+            if (Git.revParse('origin/' + gitbranch) ==
+                Git.revParse('remotes/origin/' + exportbranch)):
+                continue
+            if len(pending) >= parallel:
+                finishOne()
+            # waiting for a connection while holding others could
+            # deadlock with other processes doing the same, so wait
+            # for this process's own updates instead
+            finish = self.startCheckoutCVS(CVS, block=not pending)
+            while finish is None:
+                finishOne()
+                finish = self.startCheckoutCVS(CVS, block=not pending)
+            pending.append((gitbranch, finish))
+        # exports need connections of their own
+        while pending:
+            finishOne()
+        return refreshed
+
+    @util.saveDir
+    def exportgit(self, repository, Git, CVS, gitbranch, exportbranch,
+                  refreshed=False):
         gitDir = self.ctx.getGitDir()
         repoName = self.ctx.getRepositoryName(repository)
         repoDir = '/'.join((gitDir, repoName))
@@ -54,9 +118,41 @@ class Exporter(object):
 
         self.cloneGit(repository, Git, repoDir)
 
-        branches = self.prepareGitClone(repository, Git, gitbranch)
-        GitMessages = self.getGitMessages(Git, branches, exportbranches,
-                                          gitbranch, originExportBranch)
+        # wait until we think there are changes to export before checking
+        # out from CVS, since this checkout/update can be slow; but start
+        # it as soon as the fetch shows changes, and prepare the Git
+        # working tree while it runs
+        Git.fetch()
+        finishCVS = None
+        if (not refreshed and Git.revParse('origin/' + gitbranch) !=
+            Git.revParse(originExportBranch)):
+            finishCVS = self.startCheckoutCVS(CVS)
+
+        try:
+            branches = self.prepareGitClone(repository, Git, gitbranch)
+            GitMessages = self.getGitMessages(Git, branches, exportbranches,
+                                              gitbranch, originExportBranch)
+            # it is not recommended that hooks commit, but if they do, they
+            # will have commit messages that are automated and should not
+            # show up in CVS commits. Therefore, run the hooks after getting
+            # the Git commit messages. However, by the same token, they must
+            # be run before calculating fileSets.
+            if GitMessages != '':
+                Git.runExpPreHooks(gitbranch)
+        except:
+            if finishCVS is not None:
+                # report the Git error; any CVS error has been logged
+                exception = sys.exc_info()
+                try:
+                    finishCVS()
+                except Exception:
+                    pass
+                raise exception[0], exception[1], exception[2]
+            raise
+
+        if finishCVS is not None:
+            finishCVS()
+
         if GitMessages == '':
             # There have been no changes in Git since the last export,
             # so there is nothing to export. (If CVS shows changes,
@@ -64,19 +160,13 @@ class Exporter(object):
             # populated CVS keywords checked into Git.)
             return
 
-        # it is not recommended that hooks commit, but if they do, they will
-        # have commit messages that are automated and should not show up in
-        # CVS commits. Therefore, run the hooks after getting the Git commit
-        # messages. However, by the same token, they must be run before
-        # calculating fileSets.
-
-        Git.runExpPreHooks(gitbranch)
-
-        # wait until we think there are changes to export before checking
-        # out from CVS, since this checkout/update can be slow
-        self.checkoutCVS(CVS)
+        if finishCVS is None and not refreshed:
+            self.checkoutCVS(CVS)
 
-        GitFileSet, DeletedFiles, AddedFiles, CommonFiles, DeletedDirs, AddedDirs = self.calculateFileSets(CVS, Git)
+        if self.ctx.getExportIncremental() and originExportBranch in branches:
+            GitFileSet, DeletedFiles, AddedFiles, CommonFiles, DeletedDirs, AddedDirs = self.calculateChangedFileSets(CVS, Git, originExportBranch, gitbranch)
+        else:
+            GitFileSet, DeletedFiles, AddedFiles, CommonFiles, DeletedDirs, AddedDirs = self.calculateFileSets(CVS, Git)
         FilesToDirectories = AddedDirs.intersection(DeletedFiles)
         DirectoriesToFiles = DeletedDirs.intersection(AddedFiles)
 
@@ -106,7 +196,7 @@ class Exporter(object):
             Git.infoDiff(originExportBranch, gitbranch)
 
         CVS.deleteFiles(sorted(list(DeletedFiles)))
-        CVS.copyFiles(repoDir, sorted(list(CommonFiles.union(AddedFiles))))
+        CVS.copyFiles(Git.branchDir(gitbranch), sorted(list(CommonFiles.union(AddedFiles))))
         # directories need to be added first, and here sorted order
         # causes directories to be specified in top-down order
         CVS.addDirectories(sorted(list(AddedDirs)))
@@ -118,16 +208,18 @@ class Exporter(object):
         CVS.infoDiff()
         # email with CVS.log.lastOutput() and GitMessages
         CVS.commit(GitMessages)
-        Git.push('origin', gitbranch, exportbranch)
-
         # posthooks only after successfully pushing export- merge to origin
-        CVS.runPostHooks()
-        Git.runExpPostHooks(gitbranch)
+        Git.queuePush(gitbranch, exportbranch,
+            CVS.runPostHooks,
+            functools.partial(Git.runExpPostHooks, gitbranch, checkout=True))
 
     @staticmethod
     def getGitMessages(Git, branches, exportbranches, gitbranch, originExportBranch):
         if (branches - exportbranches) == branches:
             return 'Initial export to CVS from git branch %s' %gitbranch
+        elif Git.revParse(originExportBranch) == Git.revParse(gitbranch):
+            # nothing new; no need to run git log to find out
+            return ''
         else:
             return Git.logmessages(originExportBranch, gitbranch)
 
@@ -154,9 +246,29 @@ class Exporter(object):
             CVS.update()
         else:
             CVS.checkout()
-            if not os.path.exists(CVS.path):
-                raise RuntimeError("CVS branch '%s' for location '%s' does not exist"
-                                   %(CVS.branch, CVS.location))
+            self.assertCVSCheckout(CVS)
+
+    def startCheckoutCVS(self, CVS, block=True):
+        'start checkoutCVS; return: function that waits for it, or None'
+        # None only if not block and no CVS connection is free
+        cvsDir = os.path.dirname(CVS.path)
+        if not os.path.exists(cvsDir):
+            os.makedirs(cvsDir)
+        if os.path.exists(CVS.path):
+            return CVS.startUpdate(block)
+        finishCheckout = CVS.startCheckout(block)
+        if finishCheckout is None:
+            return None
+        def finish():
+            finishCheckout()
+            self.assertCVSCheckout(CVS)
+        return finish
+
+    @staticmethod
+    def assertCVSCheckout(CVS):
+        if not os.path.exists(CVS.path):
+            raise RuntimeError("CVS branch '%s' for location '%s' does not exist"
+                               %(CVS.branch, CVS.location))
 
 
     def prepareGitClone(self, repository, Git, gitbranch):
@@ -202,6 +314,56 @@ class Exporter(object):
         DeletedDirs = CVSDirs - GitDirs
         return GitFileSet, DeletedFiles, AddedFiles, CommonFiles, DeletedDirs, AddedDirs
 
+    def calculateChangedFileSets(self, CVS, Git, since, until):
+        # Like calculateFileSets, but only for the files that changed
+        # in Git since the last export, so that neither the CVS checkout
+        # nor the unchanged files need to be read.  Changes are classified
+        # against the CVS checkout in case it has diverged from the last
+        # export (for example, a file added to both Git and CVS).
+        gitignore = ignore.Ignore(Git.log, '.gitignore')
+        bigitrsync = ignore.Ignore(Git.log, CVS.path + '/.bigitrsync', regex=True)
+        GitFileSet = set(Git.listContentFiles())
+        GitFileSet.discard('.bigitrsync')
+        GitFileSet = bigitrsync.include(GitFileSet)
+        ChangedFiles = set()
+        RemovedFiles = set()
+        for status, fileName in Git.diffTree(since, until):
+            if status == 'D':
+                RemovedFiles.add(fileName)
+            else:
+                ChangedFiles.add(fileName)
+        ChangedFiles = GitFileSet.intersection(ChangedFiles)
+        cvsPath = lambda x: '/'.join((CVS.path, x))
+        DeletedFiles = set(x for x in RemovedFiles - GitFileSet
+                           if os.path.isfile(cvsPath(x)))
+        DeletedFiles.discard('.bigitrsync')
+        DeletedFiles = bigitrsync.include(DeletedFiles)
+        DeletedFiles -= set(x for x in DeletedFiles
+                            if x.split('/')[-1] == '.cvsignore')
+        DeletedFiles = gitignore.filter(DeletedFiles)
+        CommonFiles = set(x for x in ChangedFiles if os.path.isfile(cvsPath(x)))
+        AddedFiles = ChangedFiles - CommonFiles
+        # only the directories that matter for the consistency checks:
+        # missing parents of added files, and added files that are
+        # directories in CVS
+        AddedDirs = set()
+        for fileName in AddedFiles:
+            dirName = os.path.dirname(fileName)
+            while dirName and not os.path.isdir(cvsPath(dirName)):
+                AddedDirs.add(dirName)
+                dirName = os.path.dirname(dirName)
+        # CVS directories in Git always exist in the checkout, as its
+        # metadata, so they are never missing parents; include them for
+        # assertNoCVSMetaData, as calculateFileSets does
+        for fileName in ChangedFiles:
+            dirName = os.path.dirname(fileName)
+            while dirName:
+                if os.path.basename(dirName) == 'CVS':
+                    AddedDirs.add(dirName)
+                dirName = os.path.dirname(dirName)
+        DeletedDirs = set(x for x in AddedFiles if os.path.isdir(cvsPath(x)))
+        return GitFileSet, DeletedFiles, AddedFiles, CommonFiles, DeletedDirs, AddedDirs
+
     @staticmethod
     def trackBranch(repository, Git, branch, branches):
         if branch not in branches:
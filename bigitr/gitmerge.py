@@ -14,6 +14,8 @@
 #  limitations under the License.
 #
 
+import functools
+
 from bigitr import errhandler
 from bigitr import util
 
@@ -25,9 +27,12 @@ class Merger(object):
     def mergeBranches(self, repository, Git, requestedBranch=None):
         onerror = self.ctx.getMergeError()
         try:
-            for gitbranch in sorted(self.ctx.getMergeBranchMaps(repository).keys()):
-                if requestedBranch is None or gitbranch == requestedBranch:
-                    self.mergeBranch(repository, Git, gitbranch)
+            try:
+                for gitbranch in sorted(self.ctx.getMergeBranchMaps(repository).keys()):
+                    if requestedBranch is None or gitbranch == requestedBranch:
+                        self.mergeBranch(repository, Git, gitbranch)
+            finally:
+                Git.pushQueued()
         except Exception as e:
             self.err(repository, onerror)
 
@@ -53,22 +58,38 @@ class Merger(object):
 
     def merge(self, repository, Git, gitbranch):
         success = True
+        pristine = False
 
-        Git.pristine()
-        for target in self.ctx.getMergeBranchMaps(repository
-                ).get(gitbranch, set()):
-            Git.checkout(target)
-            Git.mergeFastForward('origin/' + target)
-            mergeMsg = "Automated merge '%s' into '%s'" %(gitbranch, target)
-            rc = Git.mergeDefault(gitbranch, mergeMsg)
-            if rc != 0:
-                Git.log.mailLastOutput(mergeMsg)
-                success = False
-            else:
-                Git.push('origin', target, target)
-                Git.runImpPostHooks(target)
-                rc = self.merge(repository, Git, target)
-                if not rc:
+        # what to merge from each branch that was successfully merged
+        # into (or already had everything merged) in this cascade
+        sources = {gitbranch: gitbranch}
+        for target, branches in self.ctx.getMergePlan(repository, gitbranch):
+            merged = False
+            for branch in branches:
+                if branch not in sources:
+                    continue
+                if Git.upToDate(target, sources[branch]):
+                    sources.setdefault(target, 'origin/' + target)
+                    continue
+                mergeMsg = "Automated merge '%s' into '%s'" %(branch, target)
+                rc = 0
+                if not Git.mergeTree(target, sources[branch], mergeMsg):
+                    # repeat the merge in a working tree so that its
+                    # conflicts are in the output that is mailed
+                    if not pristine:
+                        Git.pristine()
+                        pristine = True
+                    Git.checkout(target)
+                    Git.mergeFastForward('origin/' + target)
+                    rc = Git.mergeDefault(sources[branch], mergeMsg)
+                if rc != 0:
+                    Git.log.mailLastOutput(mergeMsg)
                     success = False
+                else:
+                    merged = True
+                    sources[target] = target
+            if merged:
+                Git.queuePush(target, target,
+                    functools.partial(Git.runImpPostHooks, target, checkout=True))
 
         return success
@@ -0,0 +1,149 @@
+#
+# Copyright 2012 SAS Institute
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#
+# Bounded pool of forked worker processes.  Synchronization is mostly
+# waiting on cvs and git subprocesses, so processes rather than threads
+# keep each conversion isolated: its own working directory, environment
+# (CVSROOT), and log file descriptors.
+
+import cPickle as pickle
+import errno
+import os
+import sys
+import tempfile
+import traceback
+
+# exit status of a worker process that raised an exception
+FAILED = 255
+
+class Pool(object):
+    def __init__(self, size):
+        self.size = max(1, size)
+        self.children = {}
+        # results of jobs run without forking, waiting to be reaped
+        self.done = []
+
+    def full(self):
+        return len(self.children) >= self.size
+
+    def active(self):
+        return self.children.values()
+
+    def start(self, job, fn, *args):
+        'run fn(*args) for job; the integer fn returns is its reaped status'
+        if self.size == 1:
+            # nothing to overlap; keep the historical in-process behavior
+            self.done.append((job, fn(*args)))
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self.children[pid] = job
+            return
+
+        # child: never return into the caller's stack, which would
+        # run the parent's cleanup (such as removing the pid file)
+        status = FAILED
+        try:
+            status = fn(*args)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _wait(self, pid, flags):
+        while True:
+            try:
+                return os.waitpid(pid, flags)
+            except OSError, e:
+                # signals such as SIGTERM and SIGCHLD interrupt waiting
+                if e.errno != errno.EINTR:
+                    raise
+
+    @staticmethod
+    def _status(status):
+        if os.WIFEXITED(status):
+            return os.WEXITSTATUS(status)
+        return FAILED
+
+    def reap(self, block=False):
+        'return [(job, status), ...]; block waits for at least one job'
+        finished = self.done
+        self.done = []
+        for pid in self.children.keys():
+            waitpid, status = self._wait(pid, os.WNOHANG)
+            if waitpid:
+                finished.append((self.children.pop(pid), self._status(status)))
+        while block and not finished and self.children:
+            pid, status = self._wait(-1, 0)
+            if pid in self.children:
+                finished.append((self.children.pop(pid), self._status(status)))
+        return finished
+
+
+class Results(Pool):
+    'pool of jobs whose return values are passed back to the parent'
+    def __init__(self, size):
+        Pool.__init__(self, size)
+        self.files = {}
+        self.statuses = {}
+
+    def start(self, job, fn, *args):
+        # a file rather than a pipe, which a large result would fill
+        # while the parent is waiting for another job
+        resultFile = tempfile.TemporaryFile()
+        self.files[job] = resultFile
+        Pool.start(self, job, self._run, resultFile, fn, *args)
+
+    @staticmethod
+    def _run(resultFile, fn, *args):
+        try:
+            result = (fn(*args), None)
+        except Exception:
+            result = (None, traceback.format_exc())
+        pickle.dump(result, resultFile, pickle.HIGHEST_PROTOCOL)
+        resultFile.flush()
+        return 0
+
+    def result(self, job):
+        'wait for job; return: its return value, or raise RuntimeError'
+        resultFile = self.files.pop(job)
+        try:
+            while job not in self.statuses:
+                self.statuses.update(self.reap(block=True))
+            status = self.statuses.pop(job)
+            resultFile.seek(0)
+            try:
+                value, error = pickle.load(resultFile)
+            except EOFError:
+                raise RuntimeError('%s exited with status %d' %(job, status))
+        finally:
+            resultFile.close()
+        if error is not None:
+            # the traceback from the worker process
+            raise RuntimeError(error)
+        return value
+
+    def finish(self):
+        'wait for all jobs, discarding their results'
+        while self.active():
+            self.statuses.update(self.reap(block=True))
+        for resultFile in self.files.values():
+            resultFile.close()
+        self.files = {}
+        self.statuses = {}
@@ -33,6 +33,9 @@ class RepositoryConfig(config.Config):
                 raise KeyError('Duplicate repository name %s: %s and %s'
                                %(name, self.repos[name], r))
             self.repos[name] = r
+            # report merge cycles when loading rather than when merging
+            for sourcebranch in self.getMergeBranchMaps(r):
+                self.getMergePlan(r, sourcebranch)
         self.requireAbsolutePaths('skeleton')
 
     def getRepositories(self):
@@ -101,6 +104,63 @@ class RepositoryConfig(config.Config):
                     for x in sorted(self.options(repository))
                     if x.startswith('merge.'))
 
+    def getMergePlan(self, repository, sourcebranch):
+        'return: [(targetbranch, [mergebranch, ...]), ...] in merge order'
+        # every branch downstream of sourcebranch is merged into once,
+        # after all the branches that merge into it, so that a branch
+        # reached through more than one path is not merged, pushed,
+        # and hooked once for each path
+        merges = self.getMergeBranchMaps(repository)
+        order = []
+        visiting = []
+        def visit(branch):
+            if branch in order:
+                return
+            if branch in visiting:
+                cycle = visiting[visiting.index(branch):] + [branch]
+                raise ValueError('Merge cycle in %s: %s'
+                                 %(repository, ' -> '.join(cycle)))
+            visiting.append(branch)
+            for target in sorted(merges.get(branch, ()), reverse=True):
+                visit(target)
+            visiting.pop()
+            order.append(branch)
+        visit(sourcebranch)
+        order.reverse()
+        return [(target, [x for x in order if target in merges.get(x, ())])
+                for target in order[1:]]
+
+    def getTrackedBranches(self, repository):
+        'return: set(gitbranch, ...) for all branches exported or merged'
+        branches = set()
+        for gitbranch, _, exportbranch in self.getExportBranchMaps(repository):
+            branches.update((gitbranch, exportbranch))
+        for source, targets in self.getMergeBranchMaps(repository).items():
+            branches.add(source)
+            branches.update(targets)
+        return branches
+
+    def getPollFrequency(self, repository):
+        '[%dd][%dh][%dm][%d[s]] overrides bigitrd pollfrequency; None if unset'
+        timespec = self.getGlobalFallback(repository, 'pollfrequency', error=False)
+        if timespec is None:
+            return None
+        return self._parseTimeSpec(timespec)
+
+    def getMaxPollFrequency(self, repository):
+        '[%dd][%dh][%dm][%d[s]] overrides bigitrd maxpollfrequency; None if unset'
+        timespec = self.getGlobalFallback(repository, 'maxpollfrequency', error=False)
+        if timespec is None:
+            return None
+        return self._parseTimeSpec(timespec)
+
+    def getFullSyncFrequency(self, repository):
+        '[%dd][%dh][%dm][%d[s]] overrides bigitrd syncfrequency; None if unset'
+        timespec = self.getGlobalFallback(repository, 'syncfrequency', error=False)
+        if timespec is None:
+            return None
+        return self._parseTimeSpec(timespec)
+
     def getHook(self, type, when, repository):
         return self.getGlobalFallback(repository, when+'hook.'+type, error=False)
 
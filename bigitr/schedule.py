@@ -0,0 +1,98 @@
+#
+# Copyright 2012 SAS Institute
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#
+# Per-repository poll and full sync deadlines for bigitrd, so that
+# one slow repository does not delay polling every other repository.
+
+import heapq
+import itertools
+
+# job statuses; anything else (such as a worker killed by a signal)
+# is treated as FAILED
+SYNCED = 0
+IDLE = 1
+FAILED = 2
+
+class Job(object):
+    def __init__(self, synchronizer, pollFrequency, syncFrequency,
+                 maxPollFrequency=None):
+        self.synchronizer = synchronizer
+        self.name = synchronizer.ctx.getRepositoryName(synchronizer.repos[0])
+        self.pollFrequency = pollFrequency
+        self.syncFrequency = syncFrequency
+        # ceiling for backing off polls of idle repositories
+        if maxPollFrequency is None:
+            maxPollFrequency = pollFrequency
+        self.maxPollFrequency = max(pollFrequency, maxPollFrequency)
+        # consecutive polls that found nothing new
+        self.idlePolls = 0
+        # the first pass after bigitrd starts or restarts is a full sync
+        self.nextPoll = 0
+        self.nextSync = 0
+        self.startTime = None
+        self.poll = False
+
+    def deadline(self):
+        return min(self.nextPoll, self.nextSync)
+
+    def start(self, now):
+        self.startTime = now
+        # poll unless a full sync is due
+        self.poll = now < self.nextSync
+
+    def pollInterval(self):
+        'poll frequency doubled for each idle poll, up to maxPollFrequency'
+        return min(self.pollFrequency * 2 ** self.idlePolls,
+                   self.maxPollFrequency)
+
+    def finish(self, status=SYNCED):
+        if status == IDLE:
+            # stop counting once the ceiling has been reached
+            if self.pollInterval() < self.maxPollFrequency:
+                self.idlePolls += 1
+        elif status == SYNCED and self.poll:
+            # the poll saw a change; resume polling at the base frequency
+            self.idlePolls = 0
+        # frequencies are minimum times since the previous start
+        self.nextPoll = self.startTime + self.pollInterval()
+        if not self.poll:
+            self.nextSync = self.startTime + self.syncFrequency
+
+
+class Schedule(object):
+    'priority queue of idle jobs, most overdue first'
+    def __init__(self):
+        self.queue = []
+        # preserve configuration order between jobs with equal deadlines
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def add(self, job):
+        heapq.heappush(self.queue, (job.deadline(), self.counter.next(), job))
+
+    def due(self, now):
+        return bool(self.queue) and self.queue[0][0] <= now
+
+    def pop(self):
+        return heapq.heappop(self.queue)[-1]
+
+    def waitTime(self, now):
+        'seconds until the next job is due, or None if no jobs are waiting'
+        if not self.queue:
+            return None
+        return max(0, self.queue[0][0] - now)
@@ -44,6 +44,8 @@ class Synchronizer(object):
                 # report and keep going; no reason for one
                 # repository to keep other repositories from synchronizing
                 self.err.report(repository)
+            finally:
+                Git.close()
 
     def synchronize(self, repository, Git):
         if self.ctx.getExportPreImport():
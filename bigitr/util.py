@@ -15,6 +15,7 @@
 #
 
 import os
+import stat
 
 def listFiles(path):
     allfiles = []
@@ -33,6 +34,41 @@ def copyFiles(sourceDir, baseDir, fileNames):
         file(targetFile, 'w').write(file(sourceFile).read())
         os.chmod(targetFile, os.stat(sourceFile).st_mode)
 
+def sameContents(sourceFile, targetFile):
+    sourceFd = file(sourceFile)
+    targetFd = file(targetFile)
+    try:
+        while True:
+            sourceData = sourceFd.read(65536)
+            if sourceData != targetFd.read(65536):
+                return False
+            if not sourceData:
+                return True
+    finally:
+        sourceFd.close()
+        targetFd.close()
+
+def syncFiles(sourceDir, baseDir, fileNames, oldFileNames):
+    'copy fileNames that differ and remove other oldFileNames from baseDir'
+    # rewriting identical files would make git re-hash them
+    for fileName in set(oldFileNames) - set(fileNames):
+        targetFile = '/'.join((baseDir, fileName))
+        if os.path.exists(targetFile):
+            os.remove(targetFile)
+    for fileName in fileNames:
+        sourceFile = '/'.join((sourceDir, fileName))
+        targetFile = '/'.join((baseDir, fileName))
+        if not os.path.exists(targetFile):
+            copyFiles(sourceDir, baseDir, (fileName,))
+            continue
+        sourceStat = os.stat(sourceFile)
+        targetStat = os.stat(targetFile)
+        if (sourceStat.st_size != targetStat.st_size or
+            not sameContents(sourceFile, targetFile)):
+            file(targetFile, 'w').write(file(sourceFile).read())
+        if stat.S_IMODE(sourceStat.st_mode) != stat.S_IMODE(targetStat.st_mode):
+            os.chmod(targetFile, sourceStat.st_mode)
+
 def removeRecursive(dir):
     for b, dirs, files in os.walk(dir, topdown=False):
         for f in files:
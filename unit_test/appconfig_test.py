@@ -30,11 +30,24 @@ gitdir = /path/to/directory/holding/git/repositories
 logdir = /path/to/log/directory
 mailfrom = sendinguser@host
 smarthost = smtp.smarthost.name
+pollmode = ls-remote
+pushatomic = true
+gitreferencedir = /path/to/reference.git
+gitdissociate = true
+gitclonefilter = blob:none
+gitclonedepth = 100
+gitworktrees = true
 [import]
 onerror = continue
 cvsdir = /path/to/directory/for/cvs/exports
+pollcvs = true
+incremental = true
+fastimport = true
+parallel = 4
 [export]
 preimport = false
+incremental = true
+parallel = 3
 onerror = warn
 cvsdir = /path/to/directory/for/cvs/checkouts/for/branch/imports
 ''')
@@ -83,6 +96,76 @@ cvsdir = /path/to/directory/for/cvs/checkouts/for/branch/imports
         self.assertEqual(self.cfgdef.getSmartHost(),
             'localhost')
 
+    def test_getPollMode(self):
+        self.assertEqual(self.cfg.getPollMode(),
+            appconfig.LSREMOTE)
+
+    def test_getPollModeDefault(self):
+        self.assertEqual(self.cfgdef.getPollMode(),
+            appconfig.FETCH)
+
+    def test_getGitReferenceDir(self):
+        self.assertEqual(self.cfg.getGitReferenceDir(), '/path/to/reference.git')
+
+    def test_getGitReferenceDirDefault(self):
+        self.assertEqual(self.cfgdef.getGitReferenceDir(), None)
+
+    def test_getGitCloneFilter(self):
+        self.assertEqual(self.cfg.getGitCloneFilter(), 'blob:none')
+        self.assertEqual(self.cfgdef.getGitCloneFilter(), None)
+
+    def test_getGitCloneDepth(self):
+        self.assertEqual(self.cfg.getGitCloneDepth(), 100)
+        self.assertEqual(self.cfgdef.getGitCloneDepth(), None)
+
+    def test_getGitWorktrees(self):
+        self.assertEqual(self.cfg.getGitWorktrees(), True)
+        self.assertEqual(self.cfgdef.getGitWorktrees(), False)
+
+    def test_getGitDissociate(self):
+        self.assertEqual(self.cfg.getGitDissociate(), True)
+
+    def test_getGitDissociateDefault(self):
+        self.assertEqual(self.cfgdef.getGitDissociate(), False)
+
+    def test_getPushAtomic(self):
+        self.assertEqual(self.cfg.getPushAtomic(), True)
+
+    def test_getPushAtomicDefault(self):
+        self.assertEqual(self.cfgdef.getPushAtomic(), False)
+
+    def test_getExportIncremental(self):
+        self.assertEqual(self.cfg.getExportIncremental(), True)
+
+    def test_getExportIncrementalDefault(self):
+        self.assertEqual(self.cfgdef.getExportIncremental(), False)
+
+    def test_getExportParallel(self):
+        self.assertEqual(self.cfg.getExportParallel(), 3)
+        self.assertEqual(self.cfgdef.getExportParallel(), 1)
+
+    def test_getImportParallel(self):
+        self.assertEqual(self.cfg.getImportParallel(), 4)
+        self.assertEqual(self.cfgdef.getImportParallel(), 1)
+
+    def test_getImportFastImport(self):
+        self.assertEqual(self.cfg.getImportFastImport(), True)
+
+    def test_getImportFastImportDefault(self):
+        self.assertEqual(self.cfgdef.getImportFastImport(), False)
+
+    def test_getImportIncremental(self):
+        self.assertEqual(self.cfg.getImportIncremental(), True)
+
+    def test_getImportIncrementalDefault(self):
+        self.assertEqual(self.cfgdef.getImportIncremental(), False)
+
+    def test_getImportPollCVS(self):
+        self.assertEqual(self.cfg.getImportPollCVS(), True)
+
+    def test_getImportPollCVSDefault(self):
+        self.assertEqual(self.cfgdef.getImportPollCVS(), False)
+
     def test_getImportError(self):
         self.assertEqual(self.cfg.getImportError(),
             appconfig.CONTINUE)
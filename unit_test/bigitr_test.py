@@ -21,6 +21,7 @@ from cStringIO import StringIO
 import testutils
 
 import bigitr
+from bigitr import appconfig
 from bigitr import context
 from bigitr import cvsimport
 from bigitr import git
@@ -182,8 +183,12 @@ class TestSynchronize(testutils.TestCase):
         s.close = mock.Mock()
         s._init_runner()
         s.run()
+        self.assertEqual(s.changed, None)
+        self.assertEqual(s.failed, False)
         S.assert_called_once_with(s.ctx)
         S().synchronize.assert_called_once_with(mock.ANY, mock.ANY)
+        # full synchronizations maintain the reference repository
+        G().updateReference.assert_called_once_with()
         s.close.assert_called_once_with()
 
     @mock.patch('os.chdir')
@@ -193,6 +198,7 @@ class TestSynchronize(testutils.TestCase):
         self.assertEquals(s.poll, True)
         s.ctx = mock.Mock()
         s.ctx.getGitDir.return_value = '/imp'
+        s.ctx.getImportPollCVS.return_value = False
         s.repos = ['foo::bar']
         G().repo = 'foo'
         s.ctx.getRepositoryName.return_value = 'foo'
@@ -216,6 +222,7 @@ class TestSynchronize(testutils.TestCase):
         self.assertEquals(s.poll, True)
         s.ctx = mock.Mock()
         s.ctx.getGitDir.return_value = '/imp'
+        s.ctx.getImportPollCVS.return_value = False
         s.repos = ['foo::bar']
         G().repo = 'foo'
         s.ctx.getRepositoryName.return_value = 'foo'
@@ -230,6 +237,7 @@ class TestSynchronize(testutils.TestCase):
              mock.call(os.getcwd())])
         self.assertEqual(C.call_count, 2)
         G().fetch.assert_called_once_with()
+        self.assertEqual(s.changed, False)
         S.assert_called_once_with(s.ctx)
         S().synchronize.assert_not_called()
         s.close.assert_called_once_with()
@@ -241,6 +249,7 @@ class TestSynchronize(testutils.TestCase):
         self.assertEquals(s.poll, False)
         s.ctx = mock.Mock()
         s.ctx.getGitDir.return_value = '/imp'
+        s.ctx.getImportPollCVS.return_value = False
         s.repos = ['foo::bar']
         G().repo = 'foo'
         s.ctx.getRepositoryName.return_value = 'foo'
@@ -255,8 +264,10 @@ class TestSynchronize(testutils.TestCase):
              mock.call(os.getcwd())])
         self.assertEqual(C.call_count, 2)
         G().fetch.assert_called_once_with()
+        self.assertEqual(s.changed, False)
         S.assert_called_once_with(s.ctx)
         S().synchronize.assert_not_called()
+        self.assertFalse(G().updateReference.called)
         s.close.assert_called_once_with()
 
 
@@ -267,6 +278,7 @@ class TestSynchronize(testutils.TestCase):
         self.assertEquals(s.poll, True)
         s.ctx = mock.Mock()
         s.ctx.getGitDir.return_value = '/imp'
+        s.ctx.getImportPollCVS.return_value = False
         s.repos = ['foo::bar']
         G().repo = 'foo'
         s.ctx.getRepositoryName.return_value = 'foo'
@@ -276,6 +288,7 @@ class TestSynchronize(testutils.TestCase):
         with mock.patch('os.path.exists') as E:
             s.run()
             E.assert_has_call('/imp/foo')
+        self.assertEqual(s.changed, True)
         C.assert_has_calls(
             [mock.call('/imp/foo'),
              mock.call(os.getcwd())])
@@ -285,6 +298,125 @@ class TestSynchronize(testutils.TestCase):
         S().synchronize.assert_called_once_with(mock.ANY, mock.ANY)
         s.close.assert_called_once_with()
 
+    def lsRemoteSynchronize(self):
+        s = bigitr.Synchronize('a', 'c', 'r', poll=True)
+        s.ctx = mock.Mock()
+        s.ctx.getGitDir.return_value = '/imp'
+        s.ctx.getImportPollCVS.return_value = False
+        s.ctx.getPollMode.return_value = appconfig.LSREMOTE
+        s.ctx.getTrackedBranches.return_value = set(('master', 'export-master'))
+        s.repos = ['foo::bar']
+        s.ctx.getRepositoryName.return_value = 'foo'
+        s.close = mock.Mock()
+        s._init_runner()
+        return s
+
+    @mock.patch('os.chdir')
+    @mock.patch('os.path.exists')
+    def test_runPollLsRemoteNoChange(self, E, C, G, R, S):
+        R.return_value = None
+        s = self.lsRemoteSynchronize()
+        G().repo = 'foo'
+        G().lsRemote.return_value = {
+            'refs/heads/master': '1',
+            'refs/heads/export-master': '2'}
+        G().refs.return_value = [
+            ('1', 'refs/heads/master'),
+            ('1', 'refs/remotes/origin/master'),
+            ('2', 'refs/remotes/origin/export-master'),
+            ('3', 'refs/remotes/origin/untracked')]
+        s.run()
+        G().lsRemote.assert_called_once_with('origin',
+            'refs/heads/export-master', 'refs/heads/master')
+        self.assertFalse(G().fetch.called)
+        self.assertEqual(s.changed, False)
+        self.assertFalse(S().synchronize.called)
+
+    @mock.patch('os.chdir')
+    @mock.patch('os.path.exists')
+    def test_runPollLsRemoteChange(self, E, C, G, R, S):
+        R.return_value = None
+        s = self.lsRemoteSynchronize()
+        G().repo = 'foo'
+        G().lsRemote.return_value = {
+            'refs/heads/master': '4',
+            'refs/heads/export-master': '2'}
+        G().refs.side_effect = [
+            [('1', 'refs/remotes/origin/master'),
+             ('2', 'refs/remotes/origin/export-master')],
+            [('1', 'refs/remotes/origin/master'),
+             ('2', 'refs/remotes/origin/export-master')],
+            [('4', 'refs/remotes/origin/master'),
+             ('2', 'refs/remotes/origin/export-master')]]
+        s.run()
+        G().fetch.assert_called_once_with()
+        self.assertEqual(s.changed, True)
+        S().synchronize.assert_called_once_with(mock.ANY, mock.ANY)
+
+    @mock.patch('os.chdir')
+    @mock.patch('os.path.exists')
+    def test_runPollLsRemoteNewBranch(self, E, C, G, R, S):
+        R.return_value = None
+        s = self.lsRemoteSynchronize()
+        G().repo = 'foo'
+        G().lsRemote.return_value = {
+            'refs/heads/master': '1',
+            'refs/heads/export-master': '2'}
+        G().refs.return_value = [('1', 'refs/remotes/origin/master')]
+        self.assertTrue(s.remoteBranchesChanged(G()))
+
+    @mock.patch('os.chdir')
+    @mock.patch('os.path.exists')
+    def test_runPollLsRemoteDeletedBranch(self, E, C, G, R, S):
+        R.return_value = None
+        s = self.lsRemoteSynchronize()
+        G().repo = 'foo'
+        G().lsRemote.return_value = {'refs/heads/master': '1'}
+        G().refs.return_value = [
+            ('1', 'refs/remotes/origin/master'),
+            ('2', 'refs/remotes/origin/export-master')]
+        s.run()
+        self.assertFalse(G().fetch.called)
+        self.assertEqual(s.changed, False)
+        self.assertFalse(S().synchronize.called)
+
+    @mock.patch('os.chdir')
+    @mock.patch('os.path.exists')
+    def test_runPollLsRemoteNoBranches(self, E, C, G, R, S):
+        R.return_value = None
+        s = self.lsRemoteSynchronize()
+        s.ctx.getTrackedBranches.return_value = set()
+        self.assertTrue(s.remoteBranchesChanged(G()))
+        self.assertFalse(G().lsRemote.called)
+
+    @mock.patch('os.chdir')
+    @mock.patch('os.path.exists')
+    def test_runPollCVSChange(self, E, C, G, R, S):
+        R.return_value = None
+        s = bigitr.Synchronize('a', 'c', 'r', poll=True)
+        s.ctx = mock.Mock()
+        s.ctx.getGitDir.return_value = '/imp'
+        s.ctx.getPollMode.return_value = appconfig.FETCH
+        s.ctx.getImportPollCVS.return_value = True
+        s.repos = ['foo']
+        s.ctx.getRepositoryName.return_value = 'foo'
+        s.close = mock.Mock()
+        s._init_runner()
+        G().refs.return_value = [('1', 'refs/remotes/origin/master')]
+        S().imp.changedBranches.return_value = ['b1', 'b3']
+        s.run()
+        S().imp.changedBranches.assert_called_once_with(mock.ANY)
+        S().imp.importBranches.assert_called_once_with(
+            mock.ANY, G(), changedBranches=['b1', 'b3'])
+        self.assertFalse(S().synchronize.called)
+        self.assertEqual(s.changed, True)
+
+        S().imp.importBranches.reset_mock()
+        S().imp.changedBranches.return_value = []
+        s.run()
+        self.assertFalse(S().imp.importBranches.called)
+        self.assertEqual(s.changed, False)
+
 
 class TestImport(testutils.TestCase):
     @mock.patch('bigitr.cvsimport.Importer')
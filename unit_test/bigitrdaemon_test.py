@@ -24,6 +24,8 @@ import tempfile
 import testutils
 
 from bigitr import bigitrdaemon
+from bigitr import pool
+from bigitr import schedule
 from bigitr import Synchronize
 
 
@@ -84,6 +86,14 @@ repoconfig = ${DDIR}/bar
         cC.assert_called_once_with(True)
         P.assert_called_once_with(outFile=None)
 
+    @mock.patch('bigitr.cvs.limitConnections')
+    @mock.patch('bigitr.progress.Progress')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.createContext')
+    def test_initCVSConnections(self, cC, P, lC):
+        file(self.daemonConfig, 'a').write('[GLOBAL]\ncvsconnections = 3\n')
+        d = bigitrdaemon.Daemon('/foo', self.daemonConfig, False, '${DDIR}/pid')
+        lC.assert_called_once_with(self.pidFile + '.cvs', 3)
+
     @mock.patch('bigitr.progress.Progress')
     @mock.patch('bigitr.bigitrdaemon.Daemon.createContext')
     def test_initNoDetach(self, cC, P):
@@ -131,6 +141,23 @@ repoconfig = ${DDIR}/bar
                 if email is not None:
                     self.assertFalse('a@b' in email)
 
+    @mock.patch('bigitr.bigitrdaemon.Daemon.createContext')
+    def test_createSynchronizersSchedule(self, cC):
+        file(self.dir + '/bar', 'w').write(
+            '[bar]\npollfrequency = 1m\nsyncfrequency = 2h\n')
+        d = bigitrdaemon.Daemon('/foo', self.daemonConfig, False, self.pidFile)
+        self.assertEqual(len(d.schedule), 4)
+        jobs = dict((x[-1].name, x[-1]) for x in d.schedule.queue)
+        self.assertEqual(sorted(jobs.keys()),
+                         ['bar', 'foo1.1', 'foo1.2', 'foo2.1'])
+        self.assertEqual(jobs['bar'].pollFrequency, 60)
+        self.assertEqual(jobs['bar'].syncFrequency, 7200)
+        self.assertEqual(jobs['foo1.1'].pollFrequency, 300)
+        self.assertEqual(jobs['foo1.1'].syncFrequency, 86000)
+        for job in jobs.values():
+            self.assertTrue(job.synchronizer in d.synchronizers)
+            self.assertEqual(job.deadline(), 0)
+
     @mock.patch('bigitr.bigitrdaemon.Daemon.createContext')
     def test_createSynchronizersAddEmail(self, cC):
         cfg = file(self.daemonConfig).read()
@@ -236,51 +263,318 @@ repoconfig = ${DDIR}/bar
         d = bigitrdaemon.Daemon()
         d.sigchld(signal.SIGCHLD, None)
 
-    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
-    def test_runOnce(self, I):
-        I.return_value = None
+    @staticmethod
+    def mockSynchronizer(name):
+        s = mock.Mock()
+        s.repos = [name]
+        s.ctx.getRepositoryName.return_value = name
+        s.failed = False
+        return s
+
+    def scheduledDaemon(self, parallel=1):
         d = bigitrdaemon.Daemon()
         d.progress = mock.Mock()
-        s = mock.Mock()
-        s.repos = ['foo']
-        s.ctx.getRepositoryName.return_value = 'foo'
+        d.pool = pool.Pool(parallel)
+        d.schedule = schedule.Schedule()
         d.stop = False
         d.restart = False
-        d.synchronizers = [s]
-        d.runOnce()
-        s.run.assert_called_once_with(poll=False)
-        d.progress.setPhase.assert_called_once_with('sync')
-        d.progress.add.assert_called_once_with('foo')
-        d.progress.report.assert_called_once_with()
-        d.progress.remove.assert_called_once_with('foo')
-
-        s.run.reset_mock()
-        d.progress.reset_mock()
-        d.runOnce(poll=True)
-        s.run.assert_called_once_with(poll=True)
-        d.progress.setPhase.assert_called_once_with('poll')
-        d.progress.add.assert_called_once_with('foo')
-        d.progress.report.assert_called_once_with()
-        d.progress.remove.assert_called_once_with('foo')
+        return d
 
-        d.progress.reset_mock()
-        d.stop = True
-        self.assertRaises(SystemExit, d.runOnce)
-        d.progress.setPhase.assert_called_once_with('sync')
+    @mock.patch('time.time')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_startJobs(self, I, Time):
+        I.return_value = None
+        Time.return_value = 100
+        d = self.scheduledDaemon()
+        a = schedule.Job(self.mockSynchronizer('a'), 10, 100)
+        b = schedule.Job(self.mockSynchronizer('b'), 10, 100)
+        c = schedule.Job(self.mockSynchronizer('c'), 10, 100)
+        b.nextSync = 50
+        b.nextPoll = 50
+        c.nextSync = 1000
+        c.nextPoll = 1000
+        for job in (a, b, c):
+            d.schedule.add(job)
+        d.startJobs()
+        # most overdue first; c is not due
+        a.synchronizer.run.assert_called_once_with(poll=False)
+        b.synchronizer.run.assert_called_once_with(poll=False)
+        self.assertFalse(c.synchronizer.run.called)
+        d.progress.add.assert_has_calls([mock.call('a'), mock.call('b')])
+        d.progress.remove.assert_has_calls([mock.call('a'), mock.call('b')])
+        # rescheduled after finishing
+        self.assertEqual(len(d.schedule), 3)
+        self.assertEqual(a.nextPoll, 110)
+        self.assertEqual(a.nextSync, 200)
+        self.assertEqual(d.schedule.pop(), a)
+
+    @mock.patch('time.time')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_startJobsPoll(self, I, Time):
+        I.return_value = None
+        Time.return_value = 100
+        d = self.scheduledDaemon()
+        a = schedule.Job(self.mockSynchronizer('a'), 10, 100)
+        a.nextPoll = 90
+        a.nextSync = 150
+        d.schedule.add(a)
+        d.startJobs()
+        a.synchronizer.run.assert_called_once_with(poll=True)
+        d.progress.add.assert_called_once_with('a(poll)')
+        self.assertEqual(a.nextPoll, 110)
+        self.assertEqual(a.nextSync, 150)
 
-        d.progress.reset_mock()
+    @mock.patch('time.time')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_startJobsStopped(self, I, Time):
+        I.return_value = None
+        Time.return_value = 100
+        d = self.scheduledDaemon()
+        a = schedule.Job(self.mockSynchronizer('a'), 10, 100)
+        d.schedule.add(a)
+        d.stop = True
+        d.startJobs()
+        self.assertFalse(a.synchronizer.run.called)
         d.stop = False
         d.restart = True
-        self.assertRaises(SystemExit, d.runOnce)
-        d.progress.setPhase.assert_called_once_with('sync')
+        d.startJobs()
+        self.assertFalse(a.synchronizer.run.called)
 
-        s.run.reset_mock()
-        d.restart = False
-        s.run.side_effect = lambda **x: [][1]
+    @mock.patch('time.time')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_startJobsParallel(self, I, Time):
+        I.return_value = None
+        Time.return_value = 100
+        d = self.scheduledDaemon(parallel=2)
+        d.pool = mock.Mock()
+        running = []
+        d.pool.full.side_effect = lambda: len(running) >= 2
+        d.pool.start.side_effect = lambda job, fn, *args: running.append(job)
+        d.pool.reap.return_value = []
+        jobs = [schedule.Job(self.mockSynchronizer(x), 10, 100)
+                for x in ('a', 'b', 'c')]
+        for job in jobs:
+            d.schedule.add(job)
+        d.startJobs()
+        d.pool.start.assert_has_calls([
+            mock.call(jobs[0], d.runJob, jobs[0].synchronizer, False),
+            mock.call(jobs[1], d.runJob, jobs[1].synchronizer, False)])
+        self.assertEqual(d.pool.start.call_count, 2)
+        self.assertEqual(len(d.schedule), 1)
+
+    @mock.patch('time.sleep')
+    @mock.patch('time.time')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_waitIdle(self, I, Time, sleep):
+        I.return_value = None
+        Time.return_value = 100
+        d = self.scheduledDaemon()
+        a = schedule.Job(self.mockSynchronizer('a'), 10, 100)
+        a.nextPoll = 105
+        a.nextSync = 150
+        d.schedule.add(a)
+        d.wait()
+        sleep.assert_called_once_with(5)
+        d.progress.setPhase.assert_called_once_with('sleep')
+        d.progress.add.assert_called_once_with('5.0 seconds')
+
+        sleep.reset_mock()
+        d.stop = True
+        d.wait()
+        self.assertFalse(sleep.called)
+
+    @mock.patch('time.sleep')
+    @mock.patch('time.time')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_waitNoRepositories(self, I, Time, sleep):
+        I.return_value = None
+        Time.return_value = 100
+        d = self.scheduledDaemon()
+        d.cfg = mock.Mock()
+        d.cfg.getPollFrequency.return_value = 300
+        d.wait()
+        sleep.assert_called_once_with(300)
+
+    @mock.patch('time.sleep')
+    @mock.patch('time.time')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_waitActive(self, I, Time, sleep):
+        I.return_value = None
+        Time.return_value = 100
+        d = self.scheduledDaemon(parallel=2)
+        d.pool = mock.Mock()
+        d.pool.active.return_value = ['running']
+        d.pool.full.return_value = False
+        d.pool.reap.return_value = []
+        a = schedule.Job(self.mockSynchronizer('a'), 10, 100)
+        a.nextPoll = 105
+        a.nextSync = 150
+        d.schedule.add(a)
+        # wake up to reap finished workers while waiting for a deadline
+        d.wait()
+        sleep.assert_called_once_with(1)
+        self.assertFalse(d.pool.reap.called)
+        d.progress.setPhase.assert_not_called()
+
+        # nothing can start until a worker finishes
+        sleep.reset_mock()
+        d.pool.full.return_value = True
+        d.wait()
+        self.assertFalse(sleep.called)
+        d.pool.reap.assert_called_once_with(block=True)
+
+    @mock.patch('os.execl')
+    @mock.patch('time.time')
+    @mock.patch('time.sleep')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_mainLoop(self, I, sleep, Time, execl):
+        I.return_value = None
+        d = self.scheduledDaemon()
+        d.context = mock.Mock()
+        d.context.detach_process = False
+        clock = [0]
+        Time.side_effect = lambda: clock[0]
+        def advance(seconds):
+            clock[0] += seconds
+        sleep.side_effect = advance
+        polls = []
+        def run(poll):
+            polls.append(poll)
+            advance(1)
+            if len(polls) == 3:
+                d.stop = True
+        s = self.mockSynchronizer('foo')
+        s.run.side_effect = run
+        s.changed = None
+        # first sync is full.  It is shorter than syncfrequency, so the
+        # second sync is a poll.  The third sync is due at the same time
+        # as the next poll, so it is a full sync
+        d.schedule.add(schedule.Job(s, 5, 10))
+        self.assertRaises(SystemExit, d.mainLoop)
+        self.assertEqual(polls, [False, True, False])
+        sleep.assert_has_calls([mock.call(4), mock.call(4)])
+        self.assertEqual(sleep.call_count, 2)
+        execl.assert_not_called()
+
+    @mock.patch('os.execl')
+    @mock.patch('time.time')
+    @mock.patch('time.sleep')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_mainLoopPerRepository(self, I, sleep, Time, execl):
+        I.return_value = None
+        d = self.scheduledDaemon()
+        d.context = mock.Mock()
+        d.context.detach_process = False
+        clock = [0]
+        Time.side_effect = lambda: clock[0]
+        def advance(seconds):
+            clock[0] += seconds
+        sleep.side_effect = advance
+        runs = []
+        def runner(name, duration):
+            def run(poll):
+                runs.append((name, clock[0]))
+                advance(duration)
+                if clock[0] >= 30:
+                    d.stop = True
+            return run
+        slow = self.mockSynchronizer('slow')
+        slow.run.side_effect = runner('slow', 20)
+        slow.changed = None
+        fast = self.mockSynchronizer('fast')
+        fast.run.side_effect = runner('fast', 1)
+        fast.changed = None
+        d.schedule.add(schedule.Job(slow, 100, 1000))
+        d.schedule.add(schedule.Job(fast, 5, 1000))
+        self.assertRaises(SystemExit, d.mainLoop)
+        # the slow repository is not polled again before it is due,
+        # and does not delay the fast repository beyond its own run
+        self.assertEqual(runs, [('slow', 0), ('fast', 20), ('fast', 25),
+                                ('fast', 30)])
+
+    @mock.patch('os.execl')
+    @mock.patch('time.time')
+    @mock.patch('time.sleep')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_mainLoopPollBackoff(self, I, sleep, Time, execl):
+        I.return_value = None
+        d = self.scheduledDaemon()
+        d.context = mock.Mock()
+        d.context.detach_process = False
+        clock = [0]
+        Time.side_effect = lambda: clock[0]
+        def advance(seconds):
+            clock[0] += seconds
+        sleep.side_effect = advance
+        runs = []
+        # full sync, three idle polls, one poll with changes, one idle poll
+        changes = [None, False, False, False, True, False]
+        s = self.mockSynchronizer('foo')
+        def run(poll):
+            runs.append((clock[0], poll))
+            s.changed = changes[len(runs) - 1]
+            if len(runs) == len(changes):
+                d.stop = True
+        s.run.side_effect = run
+        d.schedule.add(schedule.Job(s, 10, 1000, 30))
+        self.assertRaises(SystemExit, d.mainLoop)
+        self.assertEqual(runs, [(0, False), (10, True), (30, True),
+                                (60, True), (90, True), (100, True)])
+
+    @mock.patch('bigitr.bigitrdaemon.Daemon.createContext')
+    def test_createSynchronizersMaxPollFrequency(self, cC):
+        file(self.dir + '/bar', 'w').write('[bar]\nmaxpollfrequency = 1h\n')
+        d = bigitrdaemon.Daemon('/foo', self.daemonConfig, False, self.pidFile)
+        jobs = dict((x[-1].name, x[-1]) for x in d.schedule.queue)
+        self.assertEqual(jobs['bar'].maxPollFrequency, 3600)
+        # no backoff by default
+        self.assertEqual(jobs['foo1.1'].maxPollFrequency, 300)
+
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_runJob(self, I):
+        I.return_value = None
+        d = bigitrdaemon.Daemon()
         d.report = mock.Mock()
-        d.runOnce()
+        s = mock.Mock()
+        s.changed = True
+        s.failed = False
+        self.assertEqual(d.runJob(s, True), schedule.SYNCED)
+        s.run.assert_called_once_with(poll=True)
+        s.changed = None
+        self.assertEqual(d.runJob(s, False), schedule.SYNCED)
+        s.changed = False
+        self.assertEqual(d.runJob(s, True), schedule.IDLE)
+        self.assertFalse(d.report.called)
+        s.run.side_effect = lambda **x: [][1]
+        self.assertEqual(d.runJob(s, False), schedule.FAILED)
         d.report.assert_called_once_with()
 
+    @mock.patch('bigitr.git.Git')
+    @mock.patch('bigitr.sync.Synchronizer')
+    @mock.patch('bigitr._Runner.__init__')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_runJobPollError(self, I, R, S, G):
+        I.return_value = None
+        R.return_value = None
+        d = bigitrdaemon.Daemon()
+        d.report = mock.Mock()
+        s = Synchronize('a', 'c', 'r')
+        s.ctx = mock.Mock()
+        s.repos = ['foo']
+        s.close = mock.Mock()
+        s._init_runner()
+        s.newContent = mock.Mock()
+        s.newContent.side_effect = RuntimeError('fetch failed')
+        # the synchronizer reports the error itself, but the failed
+        # poll must not count as idle
+        self.assertEqual(d.runJob(s, True), schedule.FAILED)
+        S().err.report.assert_called_once_with(mock.ANY)
+        self.assertFalse(d.report.called)
+        s.newContent.side_effect = None
+        s.newContent.return_value = False
+        s.ctx.getImportPollCVS.return_value = False
+        self.assertEqual(d.runJob(s, True), schedule.IDLE)
+
     @mock.patch('smtplib.SMTP')
     @mock.patch('bigitr.bigitrdaemon.Daemon.createContext')
     def test_report(self, cC, S):
@@ -316,52 +610,15 @@ repoconfig = ${DDIR}/bar
         t.assert_not_called()
 
     @mock.patch('os.execl')
-    @mock.patch('time.time')
     @mock.patch('time.sleep')
     @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
-    @mock.patch('bigitr.bigitrdaemon.Daemon.runOnce')
-    def test_mainLoop(self, rO, I, sleep, Time, execl):
+    @mock.patch('bigitr.bigitrdaemon.Daemon.startJobs')
+    def test_mainLoopSignalHandling(self, sJ, I, sleep, execl):
         I.return_value = None
         d = bigitrdaemon.Daemon()
         d.progress = mock.Mock()
-        d.i = 0
-        def stop(**kw):
-            if 2 == d.i:
-                d.stop = True
-            d.i += 1
-        d.runOnce.side_effect = stop
-        d.cfg = mock.Mock()
-        d.cfg.getFullSyncFrequency.return_value = 10
-        d.cfg.getPollFrequency.return_value = 5
-        d.stop = False
-        d.restart = False
-        d.context = mock.Mock()
-        d.context.detach_process = False
-        # first sync is full.  It is shorter than syncfrequency, so the
-        # second sync is a poll.  It takes just long enough to exceed the
-        # total sync time since last sync, so the
-        # third sync is full
-        Time.side_effect = [0.1, 1.1,
-                            1.2, 10.3,
-                            10.4, 10.5]
-        self.assertRaises(SystemExit, d.mainLoop)
-        d.runOnce.assert_has_calls([mock.call(poll=False),
-                                    mock.call(poll=True),
-                                    mock.call(poll=False)])
-        sleep.assert_called_once_with(4.0)
-        execl.assert_not_called()
-
-    @mock.patch('os.execl')
-    @mock.patch('time.sleep')
-    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
-    @mock.patch('bigitr.bigitrdaemon.Daemon.runOnce')
-    def test_mainLoopSignalHandling(self, rO, I, sleep, execl):
-        I.return_value = None
-        d = bigitrdaemon.Daemon()
-        d.progress = mock.Mock()
-        d.cfg = mock.Mock()
-        d.cfg.getFullSyncFrequency.return_value = 1000
-        d.cfg.getPollFrequency.return_value = 10000
+        d.pool = pool.Pool(1)
+        d.schedule = schedule.Schedule()
         d.context = mock.Mock()
         d.context.detach_process = False
         d.stop = False
@@ -377,6 +634,28 @@ repoconfig = ${DDIR}/bar
         d.stop = True
         self.assertRaises(SystemExit, d.mainLoop)
         execl.assert_not_called()
+        sJ.assert_not_called()
+
+    @mock.patch('os.execl')
+    @mock.patch('bigitr.bigitrdaemon.Daemon.__init__')
+    def test_mainLoopDrainsOnStop(self, I, execl):
+        I.return_value = None
+        d = bigitrdaemon.Daemon()
+        d.progress = mock.Mock()
+        d.pool = mock.Mock()
+        d.schedule = schedule.Schedule()
+        d.context = mock.Mock()
+        d.stop = True
+        d.restart = False
+        job = schedule.Job(self.mockSynchronizer('a'), 10, 100)
+        job.startTime = 0
+        running = [job]
+        d.pool.active.side_effect = lambda: list(running)
+        d.pool.reap.side_effect = lambda block=False: (
+            [(running.pop(0), 0)] if block and running else [])
+        self.assertRaises(SystemExit, d.mainLoop)
+        self.assertEqual(running, [])
+        execl.assert_not_called()
 
 @mock.patch('bigitr.bigitrdaemon.Daemon')
 class TestMain(testutils.TestCase):
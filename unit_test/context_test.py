@@ -62,6 +62,18 @@ class TestLoggingShell(testutils.TestCase):
         branchdir = self.ctx.getCVSBranchCheckoutDir('dir/repo', 'a1')
         self.assertEqual(branchdir, '/cvs/repo/a1/rEpo')
 
+    def test_getCVSImportCheckoutDir(self):
+        branchdir = self.ctx.getCVSImportCheckoutDir('dir/repo', 'a1')
+        self.assertEqual(branchdir, '/cvsin/repo/a1/rEpo')
+
+    def test_getCVSImportExportDir(self):
+        branchdir = self.ctx.getCVSImportExportDir('dir/repo', 'a1')
+        self.assertEqual(branchdir, '/cvsin/repo/.export-a1/rEpo')
+
+    def test_getCVSLastImportFile(self):
+        lastImportFile = self.ctx.getCVSLastImportFile('dir/repo', 'a1')
+        self.assertEqual(lastImportFile, '/cvsin/repo/.lastimport-a1')
+
     def test_getCVSExportDir(self):
         branchdir = self.ctx.getCVSExportDir('dir/repo')
         self.assertEqual(branchdir, '/cvsin/repo/rEpo')
@@ -60,6 +60,13 @@ class TestCVS(testutils.TestCase):
         else:
             os.unsetenv('CVSROOT')
 
+    def test_path(self):
+        self.assertEqual(self.cvs.path, '%s/repo/brnch/Loc' %self.cdir)
+        self.assertEqual(self.cvs.pathbase, 'Loc')
+        c = cvs.CVS(self.ctx, 'repo', 'brnch', path='/other/dir/Loc2')
+        self.assertEqual(c.path, '/other/dir/Loc2')
+        self.assertEqual(c.pathbase, 'Loc2')
+
     def test_setEnvironment(self):
         self.cvs.setEnvironment()
         self.assertEqual(os.environ['CVSROOT'],
@@ -76,6 +83,56 @@ class TestCVS(testutils.TestCase):
         files = self.cvs.listContentFiles()
         self.assertEqual(files, ['includeme', 'dir/metoo'])
 
+    def test_localRoot(self):
+        self.assertEqual(self.cvs.localRoot(), None)
+        self.cvs.root = ':pserver:user@host:/path'
+        self.assertEqual(self.cvs.localRoot(), None)
+        self.cvs.root = '/path'
+        self.assertEqual(self.cvs.localRoot(), '/path')
+        self.cvs.root = ':local:/path'
+        self.assertEqual(self.cvs.localRoot(), '/path')
+        self.cvs.root = ':fork:/path'
+        self.assertEqual(self.cvs.localRoot(), '/path')
+
+    def test_changedSinceLocal(self):
+        self.cvs.root = ':local:' + self.dir
+        os.makedirs(self.dir + '/Some/Loc/Attic')
+        rcsFile = self.dir + '/Some/Loc/Attic/a,v'
+        file(rcsFile, 'w')
+        os.utime(rcsFile, (1000, 1000))
+        otherFile = self.dir + '/Some/Loc/b'
+        file(otherFile, 'w')
+        with mock.patch('bigitr.cvs.shell.read') as r:
+            self.assertFalse(self.cvs.changedSince(1000))
+            self.assertTrue(self.cvs.changedSince(999))
+            self.assertFalse(r.called)
+
+    def test_changedSince(self):
+        with mock.patch('bigitr.cvs.shell.read') as r:
+            r.return_value = (0, '')
+            self.assertFalse(self.cvs.changedSince(0))
+            r.assert_called_once_with(mock.ANY,
+                'cvs', '-q', 'rlog', '-N', '-S',
+                '-d', '>1970-01-01 00:00:00 UTC', '-rbrnch', 'Some/Loc',
+                error=False)
+            self.assertEqual(os.environ['CVSROOT'],
+                self.ctx.getCVSRoot('repo'))
+            r.return_value = (1, '''
+RCS file: /path/Some/Loc/a,v
+head: 1.1
+----------------------------
+revision 1.1.2.1
+date: 2012/01/01 00:00:00;  author: user;  state: Exp;  lines: +1 -0
+message
+=============================================================================
+''')
+            self.assertTrue(self.cvs.changedSince(0))
+
+    def test_changedSinceError(self):
+        with mock.patch('bigitr.cvs.shell.read') as r:
+            r.return_value = (1, '')
+            self.assertTrue(self.cvs.changedSince(0))
+
     def test_export(self):
         with mock.patch('bigitr.git.shell.run'):
             self.cvs.export('targetdir')
@@ -107,6 +164,35 @@ class TestCVS(testutils.TestCase):
                 os.chdir.assert_any_call(os.getcwd())
                 os.chdir.assert_any_call('%s/repo/brnch/Loc' %self.cdir)
 
+    @mock.patch('bigitr.cvs.shell.LoggingShell')
+    def test_startCheckout(self, LS):
+        finish = self.cvs.startCheckout()
+        LS.assert_called_once_with(mock.ANY,
+            'cvs', 'checkout', '-kk', '-d', 'Loc', '-r', 'brnch', 'Some/Loc',
+            cwd='%s/repo/brnch' %self.cdir)
+        self.assertEqual(os.environ['CVSROOT'], self.ctx.getCVSRoot('repo'))
+        self.assertFalse(LS().finish.called)
+        finish()
+        LS().finish.assert_called_once_with()
+
+    @mock.patch('bigitr.cvs.shell.LoggingShell')
+    def test_startUpdate(self, LS):
+        finish = self.cvs.startUpdate()
+        LS.assert_called_once_with(mock.ANY,
+            'cvs', 'update', '-kk', '-d', cwd=self.fdir)
+        self.assertFalse(LS().finish.called)
+        finish()
+        LS().finish.assert_called_once_with()
+        self.assertTrue(os.path.exists(self.fdir))
+
+    @mock.patch('bigitr.util.removeRecursive')
+    @mock.patch('bigitr.cvs.shell.LoggingShell')
+    def test_startUpdateError(self, LS, rR):
+        LS().finish.side_effect = shell.ErrorExitCode(1)
+        finish = self.cvs.startUpdate()
+        self.assertRaises(cvs.CVSError, finish)
+        rR.assert_called_once_with(self.fdir)
+
     def test_update(self):
         with mock.patch('bigitr.git.shell.run'):
             with mock.patch.multiple('os', getcwd=mock.DEFAULT,
@@ -119,6 +205,17 @@ class TestCVS(testutils.TestCase):
                 os.chdir.assert_any_call(os.getcwd())
                 os.chdir.assert_any_call('%s/repo/brnch/Loc' %self.cdir)
 
+    def test_updateFiles(self):
+        with mock.patch('bigitr.cvs.shell.read') as r:
+            r.return_value = (0, 'U a\nP dir/b\n? c\nM d\nU dir/new/e\n')
+            with mock.patch.multiple('os', getcwd=mock.DEFAULT,
+                                           chdir=mock.DEFAULT):
+                files = self.cvs.updateFiles()
+                r.assert_called_once_with(mock.ANY,
+                    'cvs', '-q', 'update', '-kk', '-d', '-P')
+                os.chdir.assert_any_call('%s/repo/brnch/Loc' %self.cdir)
+            self.assertEqual(files, ['a', 'dir/b', 'dir/new/e'])
+
     def test_deleteFiles(self):
         with mock.patch('bigitr.git.shell.run'):
             with mock.patch.multiple('os', getcwd=mock.DEFAULT,
@@ -168,23 +265,35 @@ class TestCVS(testutils.TestCase):
                 # if CVS directories do not exist
                 os.path.exists.return_value = False
                 self.cvs.addDirectories(['a', 'b', 'dir/metoo'])
-                shell.run.assert_has_calls([
-                    mock.call(mock.ANY, 'cvs', 'add', 'a'),
-                    mock.call(mock.ANY, 'cvs', 'add', 'b'),
-                    mock.call(mock.ANY, 'cvs', 'add', 'dir'),
+                self.assertEqual(shell.run.call_args_list, [
+                    mock.call(mock.ANY, 'cvs', 'add', 'a', 'b', 'dir'),
                     mock.call(mock.ANY, 'cvs', 'add', 'dir/metoo'),
                 ])
                 shell.run.reset_mock()
                 # make sure absolute paths do not recurse
                 os.path.exists.return_value = False
                 self.cvs.addDirectories(['/a', '/b', '/dir/metoo'])
-                shell.run.assert_has_calls([
-                    mock.call(mock.ANY, 'cvs', 'add', '/a'),
-                    mock.call(mock.ANY, 'cvs', 'add', '/b'),
-                    mock.call(mock.ANY, 'cvs', 'add', '/dir'),
+                self.assertEqual(shell.run.call_args_list, [
+                    mock.call(mock.ANY, 'cvs', 'add', '/a', '/b', '/dir'),
                     mock.call(mock.ANY, 'cvs', 'add', '/dir/metoo'),
                 ])
 
+    def test_addDirectoriesLevels(self):
+        with mock.patch('bigitr.git.shell.run'):
+            with mock.patch('os.path.exists'):
+                # only a/CVS exists already
+                os.path.exists.side_effect = lambda x: x == 'a/CVS'
+                self.cvs.addDirectories(
+                    ['a/b/c', 'a/b/d', 'a/e', 'f/g/h', 'a/b'])
+                self.assertEqual(shell.run.call_args_list, [
+                    mock.call(mock.ANY, 'cvs', 'add', 'f'),
+                    mock.call(mock.ANY, 'cvs', 'add', 'a/b', 'a/e', 'f/g'),
+                    mock.call(mock.ANY, 'cvs', 'add', 'a/b/c', 'a/b/d',
+                              'f/g/h'),
+                ])
+                self.assertFalse(os.path.exists.call_args_list.count(
+                    mock.call('a/b/CVS')) > 1)
+
     def test_addFiles(self):
         with mock.patch('bigitr.git.shell.run'):
             self.cvs.addFiles(['/a', '/b', '/dir/metoo'])
@@ -196,6 +305,37 @@ class TestCVS(testutils.TestCase):
             self.cvs.addFiles([])
             self.assertFalse(shell.run.called)
 
+    @mock.patch('os.write')
+    @mock.patch('bigitr.cvs.argSpace')
+    def test_addFilesChunked(self, aS, w):
+        # room for 'cvs', 'add', '-kk' and two 6-byte names
+        aS.return_value = 4 + 4 + 4 + 3 * 8 + 2 * (6 + 1 + 8)
+        with mock.patch('bigitr.git.shell.run'):
+            self.cvs.addFiles(['/dir/a', '/dir/b', '/dir/c'])
+            self.assertEqual(shell.run.call_args_list, [
+                mock.call(mock.ANY, 'cvs', 'add', '-kk', '/dir/a', '/dir/b'),
+                mock.call(mock.ANY, 'cvs', 'add', '-kk', '/dir/c'),
+            ])
+            w.assert_has_calls([
+                mock.call(mock.ANY, 'cvs add -kk: part 1 of 2, 2 of 3 names\n'),
+                mock.call(mock.ANY, 'cvs add -kk: part 2 of 2, 3 of 3 names\n'),
+            ])
+
+    @mock.patch('bigitr.cvs.argSpace')
+    def test_argChunks(self, aS):
+        aS.return_value = 2 * 10 + 3 * 10
+        self.assertEqual(cvs.argChunks(('a', 'b'), []), [])
+        self.assertEqual(cvs.argChunks(('a', 'b'), ['1', '2', '3', '4']),
+                         [['1', '2', '3'], ['4']])
+        # a name too long for any command is still passed on its own
+        self.assertEqual(cvs.argChunks(('a', 'b'), ['x' * 100, '1']),
+                         [['x' * 100], ['1']])
+
+    def test_argSpace(self):
+        self.assertTrue(0 < cvs.argSpace() < os.sysconf('SC_ARG_MAX'))
+        with mock.patch.dict('os.environ', {'BIGITR_TEST': 'x' * 1000}):
+            self.assertTrue(cvs.argSpace() < os.sysconf('SC_ARG_MAX') - 1000)
+
     @mock.patch('bigitr.util.removeRecursive')
     def test_commit(self, rR):
         with mock.patch('bigitr.git.shell.run'):
@@ -317,6 +457,15 @@ class TestCVSTrunk(testutils.TestCase):
             self.assertEqual(os.environ['CVSROOT'],
                 self.ctx.getCVSRoot('repo'))
 
+    def test_changedSince(self):
+        with mock.patch('bigitr.cvs.shell.read') as r:
+            r.return_value = (0, '')
+            self.assertFalse(self.cvs.changedSince(0))
+            r.assert_called_once_with(mock.ANY,
+                'cvs', '-q', 'rlog', '-N', '-S',
+                '-d', '>1970-01-01 00:00:00 UTC', '-b', 'Some/Loc',
+                error=False)
+
     def test_checkout(self):
         with mock.patch('bigitr.git.shell.run'):
             with mock.patch.multiple('os', getcwd=mock.DEFAULT,
@@ -359,3 +508,102 @@ class TestCVSTrunk(testutils.TestCase):
             shell.run.assert_has_calls([
                 mock.call(mock.ANY, 'postcommand', 'trunk'),
             ])
+
+
+class TestConnections(testutils.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(suffix='.bigitr')
+        self.connections = cvs.connections
+        self.cvsroot = os.environ.get('CVSROOT')
+        self.ctx = mock.MagicMock()
+        self.ctx.getCVSRoot.return_value = ':local:/cvs'
+
+    def tearDown(self):
+        cvs.connections = self.connections
+        self.removeRecursive(self.dir)
+        if self.cvsroot:
+            os.environ['CVSROOT'] = self.cvsroot
+        elif 'CVSROOT' in os.environ:
+            del os.environ['CVSROOT']
+
+    def test_unlimited(self):
+        c = cvs.Connections()
+        for i in range(10):
+            self.assertTrue(c.acquire(block=False))
+        c.release()
+        self.assertEqual(c.held, [])
+
+    def test_limit(self):
+        c = cvs.Connections(self.dir + '/lock', 2)
+        other = cvs.Connections(self.dir + '/lock', 2)
+        self.assertTrue(c.acquire())
+        self.assertTrue(other.acquire(block=False))
+        self.assertFalse(c.acquire(block=False))
+        self.assertFalse(other.acquire(block=False))
+        other.release()
+        self.assertTrue(c.acquire(block=False))
+        self.assertEqual(len(c.held), 2)
+        c.release()
+        c.release()
+        self.assertEqual(c.held, [])
+        self.assertTrue(other.acquire(block=False))
+        self.assertTrue(other.acquire(block=False))
+        self.assertEqual(sorted(os.listdir(self.dir)), ['lock.0', 'lock.1'])
+
+    @mock.patch('time.sleep')
+    def test_acquireBlock(self, sleep):
+        c = cvs.Connections(self.dir + '/lock', 1)
+        other = cvs.Connections(self.dir + '/lock', 1)
+        other.acquire()
+        sleep.side_effect = lambda x: other.release()
+        self.assertTrue(c.acquire())
+        sleep.assert_called_once_with(0.1)
+
+    def test_limitConnections(self):
+        cvs.limitConnections(self.dir + '/lock', 3)
+        self.assertEqual(cvs.connections.lockBase, self.dir + '/lock')
+        self.assertEqual(cvs.connections.count, 3)
+
+    def test_connected(self):
+        cvs.connections = mock.Mock()
+        class C(object):
+            connected = False
+            @cvs.connected
+            def outer(self):
+                cvs.connections.acquire.assert_called_once_with()
+                self.assertTrue(self.connected)
+                return self.inner()
+            @cvs.connected
+            def inner(self):
+                return 1
+        c = C()
+        c.assertTrue = self.assertTrue
+        self.assertEqual(c.outer(), 1)
+        cvs.connections.acquire.assert_called_once_with()
+        cvs.connections.release.assert_called_once_with()
+        self.assertFalse(c.connected)
+
+    @mock.patch('bigitr.cvs.shell.LoggingShell')
+    def test_startUpdateNoConnection(self, LS):
+        cvs.connections = mock.Mock()
+        cvs.connections.acquire.return_value = False
+        CVS = cvs.CVS(self.ctx, 'repo', 'brnch', path=self.dir)
+        self.assertEqual(CVS.startUpdate(block=False), None)
+        cvs.connections.acquire.assert_called_once_with(False)
+        self.assertEqual(CVS.startCheckout(block=False), None)
+        self.assertFalse(LS.called)
+        self.assertFalse(cvs.connections.release.called)
+
+    @mock.patch('bigitr.cvs.shell.LoggingShell')
+    def test_startUpdateConnection(self, LS):
+        cvs.connections = mock.Mock()
+        CVS = cvs.CVS(self.ctx, 'repo', 'brnch', path=self.dir)
+        finish = CVS.startUpdate()
+        cvs.connections.acquire.assert_called_once_with(True)
+        self.assertFalse(cvs.connections.release.called)
+        finish()
+        cvs.connections.release.assert_called_once_with()
+        finish = CVS.startCheckout()
+        LS().finish.side_effect = shell.ErrorExitCode(1)
+        self.assertRaises(shell.ErrorExitCode, finish)
+        self.assertEqual(cvs.connections.release.call_count, 2)
@@ -53,6 +53,7 @@ class CVSImportTest(testutils.TestCase):
                 self.mocklog = mocklog()
                 self.imp = cvsimport.Importer(self.ctx)
                 self.Git = mock.Mock()
+                self.Git.branchDir.return_value = '/gitdir/repo2'
                 self.CVS = mock.Mock()
 
     # tests importBranches normal use thoroughly
@@ -67,22 +68,486 @@ class CVSImportTest(testutils.TestCase):
     def test_importBranchesError(self):
         with mock.patch.object(self.imp, 'importcvs'):
             self.imp.importcvs.side_effect = lambda *x: 1/0
+            Git = mock.Mock()
             self.assertRaises(ZeroDivisionError,
-                self.imp.importBranches, 'repo', mock.Mock())
+                self.imp.importBranches, 'repo', Git)
+            # imports completed before the error are still pushed
+            Git.pushQueued.assert_called_once_with()
 
+    def test_importBranchesPushError(self):
+        with mock.patch.object(self.imp, 'importcvs'):
+            Git = mock.Mock()
+            Git.pushQueued.side_effect = lambda: 1/0
+            self.ctx._ac.set('import', 'onerror', 'continue')
+            self.imp.importBranches('repo', Git)
+            self.imp.importcvs.assert_called_once_with(
+                'repo', Git, mock.ANY, 'b1', 'cvs-b1')
+            Git.pushQueued.assert_called_once_with()
+
+    @mock.patch('bigitr.pool.Results')
+    def test_importBranchesParallel(self, R):
+        self.ctx._ac.set('import', 'parallel', '2')
+        R().full.return_value = False
+        R().result.side_effect = lambda b: 'fetched-' + b
+        Git = mock.Mock()
+        with mock.patch.object(self.imp, 'importcvs'):
+            self.imp.importBranches('repo2', Git)
+            R.assert_called_with(2)
+            R().start.assert_has_calls([
+                mock.call('b1', self.imp.fetchcvs, 'repo2', mock.ANY, 'b1',
+                          '/cvsdir/repo2/.export-b1/Loc', True),
+                mock.call('b2', self.imp.fetchcvs, 'repo2', mock.ANY, 'b2',
+                          '/cvsdir/repo2/.export-b2/Loc', True)])
+            self.imp.importcvs.assert_has_calls([
+                mock.call('repo2', Git, mock.ANY, 'b1', 'cvs-b1', 'fetched-b1'),
+                mock.call('repo2', Git, mock.ANY, 'b2', 'cvs-b2', 'fetched-b2')])
+            R().finish.assert_called_once_with()
+            Git.pushQueued.assert_called_once_with()
+
+    @mock.patch('bigitr.pool.Results')
+    def test_importBranchesParallelRemovesExports(self, R):
+        self.ctx._ac.set('import', 'parallel', '2')
+        R().full.return_value = False
+        R().result.side_effect = lambda b: 'fetched-' + b
+        removed = []
+        def importcvs(*args):
+            # the branch's export is still there while it is imported
+            self.assertFalse(args[3] in removed)
+        with mock.patch.multiple(self.imp, importcvs=mock.DEFAULT,
+                                 removeExportDir=mock.DEFAULT):
+            self.imp.importcvs.side_effect = importcvs
+            self.imp.removeExportDir.side_effect = lambda r, b: removed.append(b)
+            self.imp.importBranches('repo2', mock.Mock())
+            self.assertEqual(removed[:2], ['b1', 'b2'])
+
+    @mock.patch('bigitr.pool.Results')
+    def test_importBranchesParallelAbortRemovesExports(self, R):
+        self.ctx._ac.set('import', 'parallel', '2')
+        R().full.return_value = False
+        with mock.patch.multiple(self.imp, importcvs=mock.DEFAULT,
+                                 removeExportDir=mock.DEFAULT):
+            self.imp.importcvs.side_effect = lambda *x: 1/0
+            self.assertRaises(ZeroDivisionError,
+                self.imp.importBranches, 'repo2', mock.Mock())
+            # b2 was exported but never imported
+            self.imp.removeExportDir.assert_has_calls([
+                mock.call('repo2', 'b1'), mock.call('repo2', 'b2')])
+            R().finish.assert_called_once_with()
+
+    def test_removeExportDir(self):
+        d = tempfile.mkdtemp(suffix='.bigitr')
+        try:
+            with mock.patch.object(self.ctx, 'getImportCVSDir') as gICD:
+                gICD.return_value = d
+                exportDir = self.ctx.getCVSImportExportDir('repo2', 'b1')
+                os.makedirs(exportDir + '/sub')
+                file(exportDir + '/sub/f', 'w').write('f')
+                self.imp.removeExportDir('repo2', 'b1')
+                self.assertFalse(os.path.exists(os.path.dirname(exportDir)))
+                # the repository directory is kept for the last imports
+                self.assertTrue(os.path.exists(d + '/repo2'))
+                # nothing to remove
+                self.imp.removeExportDir('repo2', 'b1')
+        finally:
+            self.removeRecursive(d)
+
+    @mock.patch('bigitr.pool.Results')
+    def test_importBranchesParallelWindow(self, R):
+        self.ctx._ac.set('import', 'parallel', '2')
+        # one export at a time
+        R().full.side_effect = lambda: R().start.call_count > \
+                                       self.imp.importcvs.call_count
+        with mock.patch.object(self.imp, 'importcvs'):
+            self.imp.importBranches('repo2', mock.Mock())
+            self.assertEqual(R().start.call_count, 2)
+            self.assertEqual(self.imp.importcvs.call_args_list[0][0][3], 'b1')
+            # b2 was not started before b1 was imported
+            self.assertEqual(R().result.call_args_list,
+                             [mock.call('b1'), mock.call('b2')])
+
+    @mock.patch('bigitr.pool.Results')
+    def test_importBranchesParallelError(self, R):
+        self.ctx._ac.set('import', 'parallel', '2')
+        R().full.return_value = False
+        def result(b):
+            if b == 'b1':
+                raise RuntimeError('export failed')
+            return 'fetched-' + b
+        R().result.side_effect = result
+        self.ctx._ac.set('import', 'onerror', 'continue')
+        with mock.patch.object(self.imp, 'importcvs'):
+            self.imp.importBranches('repo2', mock.Mock())
+            self.imp.importcvs.assert_called_once_with(
+                'repo2', mock.ANY, mock.ANY, 'b2', 'cvs-b2', 'fetched-b2')
+            R().finish.assert_called_once_with()
+
+    @mock.patch('bigitr.pool.Results')
+    def test_importBranchesChanged(self, R):
+        self.ctx._ac.set('import', 'parallel', '2')
+        R().full.return_value = False
+        R().result.side_effect = lambda b: 'fetched-' + b
+        Git = mock.Mock()
+        with mock.patch.object(self.imp, 'importcvs'):
+            self.imp.importBranches('repo2', Git, changedBranches=['b1', 'b2'])
+            # already known to have changed, so not checked again
+            R().start.assert_has_calls([
+                mock.call('b1', self.imp.fetchcvs, 'repo2', mock.ANY, 'b1',
+                          '/cvsdir/repo2/.export-b1/Loc', False),
+                mock.call('b2', self.imp.fetchcvs, 'repo2', mock.ANY, 'b2',
+                          '/cvsdir/repo2/.export-b2/Loc', False)])
+            self.assertEqual(self.imp.importcvs.call_count, 2)
+            Git.pushQueued.assert_called_once_with()
+
+    def test_importBranchesChangedSequential(self):
+        Git = mock.Mock()
+        with mock.patch.multiple(self.imp, importcvs=mock.DEFAULT,
+                                 fetchcvs=mock.DEFAULT):
+            self.imp.fetchcvs.return_value = 'fetched'
+            self.imp.importBranches('repo2', Git, changedBranches=['b2'])
+            self.imp.fetchcvs.assert_called_once_with(
+                'repo2', mock.ANY, 'b2', skipUnchanged=False)
+            self.imp.importcvs.assert_called_once_with(
+                'repo2', Git, mock.ANY, 'b2', 'cvs-b2', 'fetched')
+            Git.pushQueued.assert_called_once_with()
+
+    @mock.patch('bigitr.pool.Results')
+    def test_importBranchesOneBranch(self, R):
+        self.ctx._ac.set('import', 'parallel', '2')
+        with mock.patch.object(self.imp, 'importcvs'):
+            self.imp.importBranches('repo2', mock.Mock(), 'b1')
+            self.assertFalse(R.called)
+            self.imp.importcvs.assert_called_once_with(
+                'repo2', mock.ANY, mock.ANY, 'b1', 'cvs-b1')
+
+    def test_lastImport(self):
+        d = tempfile.mkdtemp(suffix='.bigitr')
+        try:
+            os.makedirs(d + '/repo')
+            with mock.patch.object(self.ctx, 'getImportCVSDir') as gICD:
+                gICD.return_value = d
+                self.assertEqual(self.imp.getLastImport('repo', 'b1'), None)
+                self.imp.setLastImport('repo', 'b1', 1234.5)
+                self.assertEqual(self.imp.getLastImport('repo', 'b1'), 1234.5)
+                self.assertEqual(self.imp.getLastImport('repo', 'b2'), None)
+                self.imp.clearLastImport('repo', 'b1')
+                self.assertEqual(self.imp.getLastImport('repo', 'b1'), None)
+                self.imp.clearLastImport('repo', 'b1')
+        finally:
+            self.removeRecursive(d)
+
+    @mock.patch('bigitr.cvs.CVS')
+    def test_changedBranches(self, C):
+        lastImport = {'b1': 1000.0, 'b2': None}
+        with mock.patch.object(self.imp, 'getLastImport'):
+            self.imp.getLastImport.side_effect = lambda r, b: lastImport[b]
+            C().changedSince.return_value = False
+            self.assertEqual(self.imp.changedBranches('repo2'), ['b2'])
+            C().changedSince.assert_called_once_with(1000.0)
+            C().changedSince.return_value = True
+            self.assertEqual(self.imp.changedBranches('repo2'), ['b1', 'b2'])
+
+    @mock.patch('bigitr.cvs.CVS')
+    def test_updateCheckout(self, C):
+        with mock.patch.multiple(self.imp, getLastImport=mock.DEFAULT,
+                                 clearLastImport=mock.DEFAULT):
+            self.imp.getLastImport.return_value = 1000.0
+            C().listContentFiles.side_effect = [
+                ['a', 'b', 'd/c'], ['a', 'd/c', 'd/e', 'f']]
+            C().updateFiles.return_value = ['a', 'd/e']
+            with mock.patch('os.path.exists') as pe:
+                pe.return_value = True
+                result = self.imp.updateCheckout('repo2', 'b1', '/co/b1/Loc')
+            C.assert_called_with(self.ctx, 'repo2', 'b1', path='/co/b1/Loc')
+            self.imp.clearLastImport.assert_called_once_with('repo2', 'b1')
+            self.assertEqual(result, (['a', 'd/c', 'd/e', 'f'],
+                                      ['a', 'd/e', 'f'], ['b']))
+            self.assertFalse(C().checkout.called)
+
+    @mock.patch('bigitr.cvs.CVS')
+    def test_updateCheckoutNoLastImport(self, C):
+        with mock.patch.multiple(self.imp, getLastImport=mock.DEFAULT,
+                                 clearLastImport=mock.DEFAULT):
+            self.imp.getLastImport.return_value = None
+            C().listContentFiles.side_effect = [['a', 'b'], ['a']]
+            with mock.patch('os.path.exists') as pe:
+                pe.return_value = True
+                result = self.imp.updateCheckout('repo2', 'b1', '/co/b1/Loc')
+            C().updateFiles.assert_called_once_with()
+            self.assertEqual(result, (['a'], None, None))
+
+    @mock.patch('os.makedirs')
+    @mock.patch('bigitr.cvs.CVS')
+    def test_updateCheckoutNew(self, C, md):
+        with mock.patch.multiple(self.imp, getLastImport=mock.DEFAULT,
+                                 clearLastImport=mock.DEFAULT):
+            self.imp.getLastImport.return_value = 1000.0
+            C().listContentFiles.return_value = ['a']
+            with mock.patch('os.path.exists') as pe:
+                pe.side_effect = [False, False, True]
+                result = self.imp.updateCheckout('repo2', 'b1', '/co/b1/Loc')
+            md.assert_called_once_with('/co/b1')
+            C().checkout.assert_called_once_with()
+            self.assertFalse(C().updateFiles.called)
+            self.assertEqual(result, (['a'], None, None))
+
+            pe.reset_mock()
+            with mock.patch('os.path.exists') as pe:
+                pe.return_value = False
+                self.assertRaises(RuntimeError, self.imp.updateCheckout,
+                                  'repo2', 'b1', '/co/b1/Loc')
+
+    @mock.patch('bigitr.cvsimport.Importer.updateCheckout')
+    @mock.patch('bigitr.cvsimport.Importer.setLastImport')
+    @mock.patch('bigitr.ignore.Ignore.parse')
+    @mock.patch('bigitr.gitmerge.Merger')
+    @mock.patch('bigitr.util.syncFiles')
+    @mock.patch('os.path.exists')
+    @mock.patch('os.chdir')
+    def test_importcvsIncremental(self, cd, pe, sF, M, Ip, sLI, uC):
+        self.ctx._ac.set('import', 'incremental', 'true')
+        self.Git.branches.return_value = ['cvs-b1', 'master']
+        self.Git.branch.return_value = 'cvs-b1'
+        self.Git.listContentFiles.return_value = ['a', 'b', 'c']
+        self.Git.status.return_value = ''
+        uC.return_value = (['a', 'c', 'new'], ['a', 'new'], ['b', 'gone'])
+        self.imp.importcvs('repo2', self.Git, self.CVS, 'b1', 'cvs-b1')
+        uC.assert_called_once_with('repo2', 'b1', '/cvsdir/repo2/b1/Loc')
+        self.assertFalse(self.CVS.export.called)
+        sF.assert_called_once_with('/cvsdir/repo2/b1/Loc', '/gitdir/repo2',
+                                   ['a', 'new'], ['b', 'gone'])
+        sLI.assert_called_once_with('repo2', 'b1', mock.ANY)
+
+        # no record of the previous import
+        sF.reset_mock()
+        uC.return_value = (['a', 'c', 'new'], None, None)
+        self.imp.importcvs('repo2', self.Git, self.CVS, 'b1', 'cvs-b1')
+        sF.assert_called_once_with('/cvsdir/repo2/b1/Loc', '/gitdir/repo2',
+                                   ['a', 'c', 'new'], set(['a', 'b', 'c']))
+
+    @mock.patch('bigitr.cvsimport.Importer.fastImport')
+    @mock.patch('bigitr.cvsimport.Importer.setLastImport')
+    @mock.patch('bigitr.ignore.Ignore.parse')
+    @mock.patch('bigitr.gitmerge.Merger')
+    @mock.patch('bigitr.util.syncFiles')
+    @mock.patch('bigitr.util.listFiles')
+    @mock.patch('os.path.exists')
+    @mock.patch('os.makedirs')
+    @mock.patch('os.chdir')
+    @mock.patch('os.rmdir')
+    def test_importcvsFastImport(self, rmdir, cd, md, pe, lF, sF, M, Ip, sLI, fI):
+        self.ctx._ac.set('import', 'fastimport', 'true')
+        lF.return_value = ['a']
+        self.imp.importcvs('repo2', self.Git, self.CVS, 'b1', 'cvs-b1')
+        fI.assert_called_once_with('repo2', self.Git, 'cvs-b1', mock.ANY,
+            '/cvsdir/repo2/Loc', ['a'], None, None, mock.ANY)
+        self.assertFalse(sF.called)
+        self.assertFalse(self.Git.pristine.called)
+        self.assertFalse(self.Git.addAll.called)
+        self.assertFalse(self.Git.commit.called)
+        self.assertFalse(sLI.called)
+        fI.call_args[0][-1]()
+        sLI.assert_called_once_with('repo2', 'b1', mock.ANY)
+        M(self.ctx).mergeFrom.assert_called_once_with('repo2', self.Git, 'cvs-b1')
+
+    @mock.patch('bigitr.cvsimport.Importer.fastImport')
+    @mock.patch('bigitr.cvsimport.Importer.setLastImport')
+    @mock.patch('bigitr.ignore.Ignore.parse')
+    @mock.patch('bigitr.gitmerge.Merger')
+    @mock.patch('bigitr.util.syncFiles')
+    @mock.patch('bigitr.util.listFiles')
+    @mock.patch('os.path.exists')
+    @mock.patch('os.makedirs')
+    @mock.patch('os.chdir')
+    @mock.patch('os.rmdir')
+    def test_importcvsFastImportPreHooks(self, rmdir, cd, md, pe, lF, sF, M, Ip, sLI, fI):
+        self.ctx._ac.set('import', 'fastimport', 'true')
+        self.ctx._rm.set('repo2', 'prehook.imp.git', 'hook')
+        lF.return_value = ['a']
+        self.Git.branches.return_value = ['cvs-b1']
+        self.Git.listContentFiles.return_value = []
+        self.imp.importcvs('repo2', self.Git, self.CVS, 'b1', 'cvs-b1')
+        self.assertFalse(fI.called)
+        self.assertTrue(sF.called)
+        self.Git.runImpPreHooks.assert_called_once_with('cvs-b1')
+
+    @mock.patch('time.asctime')
+    def test_fastImport(self, at):
+        at.return_value = 'TIME'
+        cvsignore = mock.Mock()
+        cvsignore.filter.side_effect = lambda x: set(
+            y for y in x if not y.endswith('.o'))
+        self.Git.branches.return_value = ['remotes/origin/cvs-b1']
+        self.Git.listTreeFiles.return_value = [
+            '.gitignore', 'd/.gitattributes', 'a', 'b', 'b.o', '.bigitrsync']
+        self.Git.fastImport.return_value = True
+        sLI = mock.Mock()
+        self.imp.fastImport('repo2', self.Git, 'cvs-b1', cvsignore, '/e',
+                            ['a', 'c'], None, None, sLI)
+        self.Git.fetch.assert_called_once_with()
+        self.Git.listTreeFiles.assert_called_once_with('origin/cvs-b1')
+        self.Git.fastImport.assert_called_once_with('cvs-b1', 'origin/cvs-b1',
+            'import from CVS as of TIME', [('a', '/e/a'), ('c', '/e/c')], ['b'])
+        self.Git.infoDiff.assert_called_once_with('origin/cvs-b1', 'cvs-b1')
+        self.Git.queuePush.assert_called_once_with('cvs-b1', 'cvs-b1',
+            mock.ANY, sLI)
+        # nothing more until the push
+        self.assertFalse(self.Git.runImpPostHooks.called)
+        self.assertFalse(sLI.called)
+
+    def test_fastImportIncremental(self):
+        self.Git.branches.return_value = ['remotes/origin/cvs-b1']
+        self.Git.fastImport.return_value = False
+        sLI = mock.Mock()
+        self.imp.fastImport('repo2', self.Git, 'cvs-b1', mock.Mock(), '/e',
+                            ['a', 'c'], ['c'], ['b'], sLI)
+        self.assertFalse(self.Git.listTreeFiles.called)
+        self.Git.fastImport.assert_called_once_with('cvs-b1', 'origin/cvs-b1',
+            mock.ANY, [('c', '/e/c')], ['b'])
+        self.assertFalse(self.Git.queuePush.called)
+        # nothing to push, so the import is already complete
+        sLI.assert_called_once_with()
+
+    @mock.patch('bigitr.util.listFiles')
+    def test_fastImportNewBranch(self, lF):
+        lF.return_value = ['.gitignore']
+        self.ctx._rm.set('repo2', 'posthook.imp.git', 'hook')
+        self.Git.branches.return_value = ['master', 'remotes/origin/master']
+        self.Git.fastImport.return_value = True
+        self.imp.fastImport('repo2', self.Git, 'cvs-b1', mock.Mock(), '/e',
+                            ['a'], ['a'], ['b'], mock.Mock())
+        lF.assert_called_once_with('/skel')
+        self.Git.fastImport.assert_called_once_with('cvs-b1', None, mock.ANY,
+            [('a', '/e/a'), ('.gitignore', '/skel/.gitignore')], [])
+        self.assertFalse(self.Git.infoDiff.called)
+        self.Git.queuePush.assert_called_once_with('cvs-b1', 'cvs-b1',
+            mock.ANY, mock.ANY)
+        self.Git.queuePush.call_args[0][2]()
+        self.Git.runImpPostHooks.assert_called_once_with('cvs-b1', checkout=True)
+
+    def test_unchanged(self):
+        self.CVS.changedSince.return_value = False
+        with mock.patch.object(self.imp, 'getLastImport'):
+            self.imp.getLastImport.return_value = 1000.0
+            # disabled by default
+            self.assertFalse(self.imp.unchanged('repo2', self.CVS, 'b1'))
+            self.assertFalse(self.CVS.changedSince.called)
+            self.ctx._ac.set('import', 'skipunchanged', 'true')
+            self.assertTrue(self.imp.unchanged('repo2', self.CVS, 'b1'))
+            self.CVS.changedSince.assert_called_once_with(1000.0)
+            self.CVS.changedSince.return_value = True
+            self.assertFalse(self.imp.unchanged('repo2', self.CVS, 'b1'))
+            self.imp.getLastImport.return_value = None
+            self.assertFalse(self.imp.unchanged('repo2', self.CVS, 'b1'))
+
+    @mock.patch('bigitr.cvsimport.Importer.unchanged')
+    @mock.patch('bigitr.gitmerge.Merger')
+    @mock.patch('os.path.exists')
+    @mock.patch('os.makedirs')
+    @mock.patch('os.chdir')
+    def test_importcvsUnchanged(self, cd, md, pe, M, u):
+        u.return_value = True
+        self.Git.branches.return_value = ['cvs-b1', 'master']
+        self.Git.branch.return_value = 'master'
+        self.imp.importcvs('repo2', self.Git, self.CVS, 'b1', 'cvs-b1')
+        u.assert_called_once_with('repo2', self.CVS, 'b1')
+        self.assertFalse(self.CVS.export.called)
+        self.assertFalse(md.called)
+        self.assertFalse(self.Git.initializeGitRepository.called)
+        self.Git.checkout.assert_called_once_with('cvs-b1')
+        self.Git.fetch.assert_called_once_with()
+        self.Git.mergeFastForward.assert_called_once_with('origin/cvs-b1')
+        self.assertFalse(self.Git.commit.called)
+        self.assertFalse(self.Git.queuePush.called)
+        M(self.ctx).mergeFrom.assert_called_once_with('repo2', self.Git, 'cvs-b1')
+
+    @mock.patch('bigitr.cvsimport.Importer.setLastImport')
+    @mock.patch('bigitr.cvsimport.Importer.unchanged')
+    @mock.patch('bigitr.ignore.Ignore.parse')
+    @mock.patch('bigitr.gitmerge.Merger')
+    @mock.patch('bigitr.util.syncFiles')
+    @mock.patch('bigitr.util.copyFiles')
+    @mock.patch('bigitr.util.listFiles')
+    @mock.patch('os.path.exists')
+    @mock.patch('os.makedirs')
+    @mock.patch('os.chdir')
+    @mock.patch('os.rmdir')
+    def test_importcvsUnchangedNewBranch(self, rmdir, cd, md, pe, lF, cF, sF, M, Ip, u, sLI):
+        # no local branch to merge from; import as usual
+        u.return_value = True
+        self.Git.branches.return_value = ['master']
+        self.Git.listContentFiles.return_value = []
+        self.imp.importcvs('repo2', self.Git, self.CVS, 'b1', 'cvs-b1')
+        self.CVS.export.assert_called_once_with('Loc')
+        self.Git.checkoutNewImportBranch.assert_called_once_with('cvs-b1')
+        for callback in self.Git.queuePush.call_args[0][2:]:
+            callback()
+        sLI.assert_called_once_with('repo2', 'b1', mock.ANY)
+
+    @mock.patch('bigitr.cvsimport.Importer.unchanged')
+    @mock.patch('time.time')
+    @mock.patch('bigitr.util.listFiles')
+    @mock.patch('os.path.exists')
+    @mock.patch('os.makedirs')
+    @mock.patch('os.chdir')
+    def test_fetchcvs(self, cd, md, pe, lF, t, u):
+        t.return_value = 1000.0
+        pe.return_value = False
+        lF.return_value = ['a']
+        self.assertEqual(
+            self.imp.fetchcvs('repo2', self.CVS, 'b1', '/cvsdir/x/Loc'),
+            (1000.0, '/cvsdir/x/Loc', ['a'], None, None))
+        md.assert_called_once_with('/cvsdir/x/Loc')
+        cd.assert_any_call('/cvsdir/x')
+        self.CVS.export.assert_called_once_with('Loc')
+        self.assertEqual(self.imp.fetchcvs('repo2', self.CVS, 'b1'),
+            (1000.0, '/cvsdir/repo2/Loc', ['a'], None, None))
+        # unchanged only matters when there is a Git repository
+        self.assertFalse(u.called)
+        pe.return_value = True
+        u.return_value = True
+        with mock.patch('bigitr.util.removeRecursive'):
+            self.assertEqual(self.imp.fetchcvs('repo2', self.CVS, 'b1'), ())
+            self.assertEqual(self.CVS.export.call_count, 2)
+            self.assertEqual(self.imp.fetchcvs('repo2', self.CVS, 'b1',
+                skipUnchanged=False)[1], '/cvsdir/repo2/Loc')
+            self.assertEqual(self.CVS.export.call_count, 3)
+
+    @mock.patch('bigitr.cvsimport.Importer.setLastImport')
+    @mock.patch('bigitr.cvsimport.Importer.fetchcvs')
+    @mock.patch('bigitr.ignore.Ignore.parse')
+    @mock.patch('bigitr.gitmerge.Merger')
+    @mock.patch('bigitr.util.syncFiles')
+    @mock.patch('os.chdir')
+    def test_importcvsFetched(self, cd, sF, M, Ip, f, sLI):
+        self.Git.branches.return_value = ['cvs-b1', 'master']
+        self.Git.listContentFiles.return_value = ['a']
+        self.Git.status.return_value = False
+        self.imp.importcvs('repo2', self.Git, self.CVS, 'b1', 'cvs-b1',
+            (1000.0, '/cvsdir/x/Loc', ['a', 'b'], None, None))
+        self.assertFalse(f.called)
+        self.assertFalse(self.CVS.export.called)
+        sF.assert_called_once_with('/cvsdir/x/Loc', '/gitdir/repo2',
+                                   ['a', 'b'], set(['a']))
+        M(self.ctx).mergeFrom.assert_called_once_with('repo2', self.Git, 'cvs-b1')
+        sLI.assert_called_once_with('repo2', 'b1', 1000.0)
+
+    @mock.patch('bigitr.cvsimport.Importer.setLastImport')
+    @mock.patch('time.time')
     @mock.patch('bigitr.ignore.Ignore.parse')
     @mock.patch('bigitr.gitmerge.Merger')
+    @mock.patch('bigitr.util.syncFiles')
     @mock.patch('bigitr.util.copyFiles')
     @mock.patch('time.asctime')
-    @mock.patch('os.remove')
     @mock.patch('bigitr.util.listFiles')
     @mock.patch('os.path.exists')
     @mock.patch('os.makedirs')
     @mock.patch('os.chdir')
     @mock.patch('os.rmdir')
-    def test_importcvs(self, rmdir, cd, md, pe, lF, rm, at, cF, M, Ip):
+    def test_importcvs(self, rmdir, cd, md, pe, lF, at, cF, sF, M, Ip, t, sLI):
+        t.return_value = 1000.0
         self.Git.branches.return_value = ['b1', 'master']
-        self.Git.listContentFiles.return_value = ['a']
+        self.Git.listContentFiles.return_value = ['a', '.bigitrsync']
+        lF.return_value = ['a', 'b']
         at.return_value = 'TIME'
         self.imp.importcvs('repo2', self.Git, self.CVS, 'b1', 'cvs-b1')
 
@@ -90,20 +555,27 @@ class CVSImportTest(testutils.TestCase):
         self.Git.initializeGitRepository.assert_called()
         self.Git.checkoutNewImportBranch.assert_called_once_with('cvs-b1')
         self.Git.pristine.assert_called_once_with()
-        cF.assert_has_calls([
-            mock.call('/cvsdir/repo2/Loc', '/gitdir/repo2', mock.ANY),
-            mock.call('/skel', '/gitdir/repo2', mock.ANY),
-        ])
-        self.assertEquals(cF.call_count, 2)
+        sF.assert_called_once_with('/cvsdir/repo2/Loc', '/gitdir/repo2',
+                                   ['a', 'b'], set(['a']))
+        self.Git.branchDir.assert_called_once_with('cvs-b1')
+        cF.assert_called_once_with('/skel', '/gitdir/repo2', mock.ANY)
         self.Git.runImpPreHooks.assert_called_once_with('cvs-b1')
         self.Git.infoStatus.assert_called_once_with()
         self.Git.infoDiff.assert_called_once_with()
         self.Git.addAll.assert_called_once_with()
         self.Git.status.assert_has_calls([mock.call(), mock.call()])
         self.Git.commit.assert_called_once_with('import from CVS as of TIME')
-        self.Git.push.assert_called_once_with('origin', 'cvs-b1', 'cvs-b1')
+        self.Git.queuePush.assert_called_once_with('cvs-b1', 'cvs-b1',
+            mock.ANY, mock.ANY)
         self.Git.runImpPreHooks.assert_called_once_with('cvs-b1')
         M(self.ctx).mergeFrom.assert_called_once_with('repo2', self.Git, 'cvs-b1')
+        # post hooks and recording the import wait for the push
+        self.assertFalse(self.Git.runImpPostHooks.called)
+        self.assertFalse(sLI.called)
+        for callback in self.Git.queuePush.call_args[0][2:]:
+            callback()
+        self.Git.runImpPostHooks.assert_called_once_with('cvs-b1', checkout=True)
+        sLI.assert_called_once_with('repo2', 'b1', 1000.0)
 
         self.Git.infoStatus.reset_mock()
         self.Git.commit.reset_mock()
@@ -42,6 +42,11 @@ email = other@other blah@blah
         self.removeRecursive(self.dir)
         os.unsetenv('DDIR')
 
+    def test_getCVSConnections(self):
+        self.assertEqual(0, self.cfg.getCVSConnections())
+        self.cfg.set('GLOBAL', 'cvsconnections', '4')
+        self.assertEqual(4, self.cfg.getCVSConnections())
+
     def test_parallelConversions(self):
         self.assertEqual(1, self.cfg.parallelConversions())
         self.cfg.set('GLOBAL', 'parallel', '8')
@@ -52,6 +57,13 @@ email = other@other blah@blah
         self.cfg.set('GLOBAL', 'pollfrequency', '1h')
         self.assertEqual(3600, self.cfg.getPollFrequency())
 
+    def test_getMaxPollFrequency(self):
+        self.assertEqual(300, self.cfg.getMaxPollFrequency())
+        self.cfg.set('GLOBAL', 'pollfrequency', '1h')
+        self.assertEqual(3600, self.cfg.getMaxPollFrequency())
+        self.cfg.set('GLOBAL', 'maxpollfrequency', '2h')
+        self.assertEqual(7200, self.cfg.getMaxPollFrequency())
+
     def test_getFullSyncFrequency(self):
         self.assertEqual(86000, self.cfg.getFullSyncFrequency())
         self.cfg.set('GLOBAL', 'syncfrequency', '1h')
@@ -16,6 +16,7 @@
 
 import mock
 from cStringIO import StringIO
+import subprocess
 import testutils
 
 from bigitr import git, shell, context
@@ -56,11 +57,191 @@ class TestGit(testutils.TestCase):
             shell.run.assert_called_once_with(mock.ANY,
                 'git', 'clone', uri)
 
+    def test_cloneReference(self):
+        self.ctx._ac.set('global', 'gitreferencedir', '/ref.git')
+        with mock.patch.object(self.git, 'updateReference') as uR:
+            uR.return_value = '/ref.git'
+            with mock.patch('bigitr.git.shell.run'):
+                self.git.clone('/path/to/repo')
+                shell.run.assert_called_once_with(mock.ANY,
+                    'git', 'clone', '--reference', '/ref.git', '/path/to/repo')
+                self.ctx._ac.set('global', 'gitdissociate', 'true')
+                shell.run.reset_mock()
+                self.git.clone('/path/to/repo')
+                shell.run.assert_called_once_with(mock.ANY,
+                    'git', 'clone', '--reference', '/ref.git', '--dissociate',
+                    '/path/to/repo')
+
+    def test_cloneShallow(self):
+        self.ctx._ac.set('global', 'gitclonefilter', 'blob:none')
+        self.ctx._ac.set('global', 'gitclonedepth', '50')
+        with mock.patch('bigitr.git.shell.run'):
+            self.git.clone('/path/to/repo')
+            shell.run.assert_called_once_with(mock.ANY,
+                'git', 'clone', '--filter=blob:none',
+                '--depth', '50', '--no-single-branch', '/path/to/repo')
+
+    def test_shallow(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, 'true\n')
+            self.assertTrue(self.git.shallow())
+            r.assert_called_once_with(mock.ANY,
+                'git', 'rev-parse', '--is-shallow-repository')
+            r.return_value = (0, 'false\n')
+            self.assertFalse(self.git.shallow())
+
+    def test_deepen(self):
+        self.ctx._ac.set('global', 'gitclonedepth', '50')
+        self.git.cache['branches'] = set()
+        with mock.patch.object(self.git, 'shallow') as s:
+            s.return_value = True
+            with mock.patch('bigitr.git.shell.read') as r:
+                with mock.patch('bigitr.git.shell.run'):
+                    r.side_effect = [(1, ''), (1, ''), (0, 'a44dfd\n')]
+                    self.git.deepen('export-b', 'b')
+                    r.assert_called_with(mock.ANY,
+                        'git', 'merge-base', 'export-b', 'b', error=False)
+                    self.assertEqual(r.call_count, 3)
+                    shell.run.assert_has_calls([
+                        mock.call(mock.ANY, 'git', 'fetch', '--deepen=50', 'origin'),
+                        mock.call(mock.ANY, 'git', 'fetch', '--deepen=100', 'origin')])
+                    self.assertEqual(shell.run.call_count, 2)
+                    self.assertEqual(self.git.cache, {})
+
+    @mock.patch('os.path.exists')
+    def test_deepenWorktree(self, pe):
+        # a linked worktree has a .git file, never a .git/shallow file
+        pe.return_value = False
+        self.ctx._ac.set('global', 'gitworktrees', 'true')
+        with mock.patch('bigitr.git.shell.read') as r:
+            with mock.patch('bigitr.git.shell.run'):
+                r.side_effect = [(0, 'true\n'), (1, ''),
+                                 (0, 'true\n'), (0, 'a44dfd\n')]
+                self.git.deepen('export-b', 'b')
+                r.assert_has_calls([
+                    mock.call(mock.ANY,
+                        'git', 'rev-parse', '--is-shallow-repository'),
+                    mock.call(mock.ANY,
+                        'git', 'merge-base', 'export-b', 'b', error=False)])
+                shell.run.assert_called_once_with(mock.ANY,
+                    'git', 'fetch', '--deepen=1', 'origin')
+
+    def test_deepenUnrelated(self):
+        # fetching the roots makes the clone complete
+        with mock.patch.object(self.git, 'shallow') as s:
+            s.side_effect = [True, False]
+            with mock.patch('bigitr.git.shell.read') as r:
+                with mock.patch('bigitr.git.shell.run'):
+                    r.return_value = (1, '')
+                    self.git.deepen('export-b', 'b')
+                    shell.run.assert_called_once_with(mock.ANY,
+                        'git', 'fetch', '--deepen=1', 'origin')
+
+    def test_deepenComplete(self):
+        with mock.patch.object(self.git, 'shallow') as s:
+            s.return_value = False
+            with mock.patch('bigitr.git.shell.read') as r:
+                self.git.deepen('export-b', 'b')
+                self.assertFalse(r.called)
+
+    def test_updateReferenceNone(self):
+        with mock.patch('bigitr.git.shell.run'):
+            self.assertEqual(self.git.updateReference(), None)
+            self.assertFalse(shell.run.called)
+
+    @mock.patch('os.path.exists')
+    def test_updateReference(self, pe):
+        pe.return_value = False
+        self.ctx._ac.set('global', 'gitreferencedir', '/ref.git')
+        with mock.patch('bigitr.git.shell.run'):
+            self.assertEqual(self.git.updateReference(), '/ref.git')
+            pe.assert_called_once_with('/ref.git')
+            shell.run.assert_has_calls([
+                mock.call(mock.ANY, 'git', 'init', '--quiet', '--bare', '/ref.git'),
+                mock.call(mock.ANY, 'git', '--git-dir=/ref.git',
+                          'config', 'gc.pruneExpire', 'never'),
+                mock.call(mock.ANY, 'git', '--git-dir=/ref.git',
+                          'fetch', '--quiet', '--no-tags', 'git@host:repo',
+                          '+refs/heads/*:refs/remotes/repo/*', error=False),
+                mock.call(mock.ANY, 'git', '--git-dir=/ref.git',
+                          'gc', '--auto', '--quiet', error=False),
+            ])
+            self.assertEqual(shell.run.call_count, 4)
+            # once per Git object
+            self.assertEqual(self.git.updateReference(), '/ref.git')
+            self.assertEqual(shell.run.call_count, 4)
+
+    @mock.patch('os.path.exists')
+    def test_updateReferenceExisting(self, pe):
+        pe.return_value = True
+        self.ctx._ac.set('global', 'gitreferencedir', '/ref.git')
+        with mock.patch('bigitr.git.shell.run'):
+            self.git.updateReference()
+            self.assertEqual(shell.run.call_args_list[0][0][1:5],
+                ('git', '--git-dir=/ref.git', 'fetch', '--quiet'))
+            self.assertEqual(shell.run.call_count, 2)
+
     def test_fetch(self):
         with mock.patch('bigitr.git.shell.run'):
             self.git.fetch()
             shell.run.assert_called_once_with(mock.ANY,
                 'git', 'fetch', '--all')
+            self.assertTrue(self.git.fetched)
+
+    def test_fetchOnce(self):
+        with mock.patch('bigitr.git.shell.run'):
+            self.git.fetch()
+            self.git.fetch()
+            self.assertEqual(shell.run.call_count, 1)
+            self.git.push('origin', 'master', 'master')
+            self.git.fetch()
+            self.assertEqual(shell.run.call_args_list[-1][0][1:],
+                ('git', 'fetch', '--all'))
+            self.assertEqual(shell.run.call_count, 3)
+            # hooks might push
+            self.git.runExpPostHooks('brnch')
+            self.assertFalse(self.git.fetched)
+            # fetchAll always fetches
+            self.git.fetchAll()
+            self.git.fetchAll()
+            self.assertEqual(shell.run.call_args_list[-1][0][1:],
+                ('git', 'fetch', '--all'))
+
+    def test_fetchAfterClone(self):
+        with mock.patch('bigitr.git.shell.run'):
+            self.git.clone('/path/to/repo')
+            self.git.fetch()
+            shell.run.assert_called_once_with(mock.ANY,
+                'git', 'clone', '/path/to/repo')
+
+    def test_fetchError(self):
+        with mock.patch('bigitr.git.shell.run') as run:
+            run.side_effect = shell.ErrorExitCode(1)
+            self.assertRaises(shell.ErrorExitCode, self.git.fetch)
+            self.assertFalse(self.git.fetched)
+
+    def test_lsRemote(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, '''\
+a44dfd94fd9de6c27f739274f2fae99ab83fa2f5\trefs/heads/master
+fe9a5fbf7fe7ca3f6f08946187e2d1ce302c0201\trefs/heads/export-master
+''')
+            refs = self.git.lsRemote('origin',
+                'refs/heads/master', 'refs/heads/export-master')
+            r.assert_called_once_with(mock.ANY,
+                'git', 'ls-remote', '--heads', 'origin',
+                'refs/heads/master', 'refs/heads/export-master')
+            self.assertEquals(refs, {
+                'refs/heads/master':
+                    'a44dfd94fd9de6c27f739274f2fae99ab83fa2f5',
+                'refs/heads/export-master':
+                    'fe9a5fbf7fe7ca3f6f08946187e2d1ce302c0201',
+            })
+
+    def test_lsRemoteEmpty(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, '')
+            self.assertEquals(self.git.lsRemote('origin'), {})
 
     def test_reset(self):
         with mock.patch('bigitr.git.shell.run'):
@@ -82,16 +263,61 @@ class TestGit(testutils.TestCase):
     def test_pristine(self):
         with mock.patch.multiple(self.git, statusIgnored=mock.DEFAULT,
                                         clean=mock.DEFAULT,
-                                        refs=mock.DEFAULT,
+                                        revParse=mock.DEFAULT,
                                         reset=mock.DEFAULT) as mockgit:
             mockgit['statusIgnored'].return_value = True
-            mockgit['refs'].return_value = [('ignore', 'HEAD')]
+            mockgit['revParse'].return_value = 'a44dfd'
             self.git.pristine()
             mockgit['statusIgnored'].assert_called_once_with()
             mockgit['clean'].assert_called_once_with()
-            mockgit['refs'].assert_called_once_with()
+            mockgit['revParse'].assert_called_once_with('HEAD')
             mockgit['reset'].assert_called_once_with()
 
+    def test_pristineNoHead(self):
+        with mock.patch.multiple(self.git, statusIgnored=mock.DEFAULT,
+                                        clean=mock.DEFAULT,
+                                        revParse=mock.DEFAULT,
+                                        reset=mock.DEFAULT) as mockgit:
+            mockgit['statusIgnored'].return_value = True
+            mockgit['revParse'].return_value = None
+            self.git.pristine()
+            mockgit['clean'].assert_called_once_with()
+            self.assertFalse(mockgit['reset'].called)
+
+    def test_branchesCached(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, '* master\n  remotes/origin/master\n')
+            branches = self.git.branches()
+            branches.add('modified')
+            self.assertEquals(self.git.branches(),
+                set(('master', 'remotes/origin/master')))
+            self.assertEquals(r.call_count, 1)
+            r.return_value = (0, '* master\n')
+            self.assertEquals(self.git.branch(), '* master')
+            self.assertEquals(r.call_count, 2)
+
+    def test_cacheInvalidated(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            with mock.patch('bigitr.git.shell.run') as run:
+                r.return_value = (0, 'a' * 40 + ' refs/heads/master\n')
+                self.git.refs()
+                self.git.fetch()
+                self.git.refs()
+                self.assertEquals(r.call_count, 2)
+                # commands that fail may still change refs
+                run.side_effect = shell.ErrorExitCode(1)
+                self.assertRaises(shell.ErrorExitCode,
+                    self.git.mergeFastForward, 'origin/master')
+                self.git.refs()
+                self.assertEquals(r.call_count, 3)
+                # hooks may commit
+                run.side_effect = None
+                self.git.ctx.getGitImpPostHooks = mock.Mock()
+                self.git.ctx.getGitImpPostHooks.return_value = [['true']]
+                self.git.runImpPostHooks('master')
+                self.git.refs()
+                self.assertEquals(r.call_count, 4)
+
     def test_branches(self):
         with mock.patch('bigitr.git.shell.read') as r:
             r.return_value = (0, '''
@@ -118,10 +344,10 @@ class TestGit(testutils.TestCase):
 
     def test_branch(self):
         with mock.patch('bigitr.git.shell.read') as r:
-            r.return_value = (0, 'master')
+            r.return_value = (0, 'master\n')
             branch = self.git.branch()
             r.assert_called_once_with(mock.ANY,
-                'git', 'symbolic-ref', '--short', '-q', 'HEAD')
+                'git', 'symbolic-ref', '--short', '-q', 'HEAD', error=False)
             self.assertEquals(branch, 'master')
 
     def test_branchOther(self):
@@ -129,9 +355,14 @@ class TestGit(testutils.TestCase):
             r.return_value = (0, 'other')
             branch = self.git.branch()
             r.assert_called_once_with(mock.ANY,
-                'git', 'symbolic-ref', '--short', '-q', 'HEAD')
+                'git', 'symbolic-ref', '--short', '-q', 'HEAD', error=False)
             self.assertEquals(branch, 'other')
 
+    def test_branchDetached(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (1, '')
+            self.assertEquals(self.git.branch(), '')
+
     def test_refs(self):
         with mock.patch('bigitr.git.shell.read') as r:
             r.return_value = (0, '''
@@ -160,6 +391,160 @@ fe9a5fbf7fe7ca3f6f08946187e2d1ce302c0201 refs/remotes/origin/master
             self.assertEquals(refs, None)
 
 
+    def test_revParse(self):
+        with mock.patch.object(self.git, 'objectInfo') as oI:
+            oI.return_value = ('a44dfd', 'commit')
+            self.assertEquals(self.git.revParse('foo'), 'a44dfd')
+            oI.assert_called_once_with('foo')
+            oI.return_value = None
+            self.assertEquals(self.git.revParse('foo'), None)
+
+    def test_revParsePerWorktree(self):
+        with mock.patch.object(self.git, 'objectInfo') as oI:
+            with mock.patch('bigitr.git.shell.read') as r:
+                r.return_value = (0, 'a44dfd\n')
+                self.assertEquals(self.git.revParse('HEAD'), 'a44dfd')
+                r.assert_called_once_with(mock.ANY,
+                    'git', 'rev-parse', '--verify', '-q', 'HEAD', error=False)
+                r.return_value = (1, '')
+                self.assertEquals(self.git.revParse('ORIG_HEAD'), None)
+                self.assertFalse(oI.called)
+
+    def test_perWorktree(self):
+        for ref in ('HEAD', 'HEAD~1', 'HEAD^{tree}', 'MERGE_HEAD', '@',
+                    '@{-1}', ':path', 'refs/worktree/x', 'refs/bisect/bad'):
+            self.assertTrue(git.Git.perWorktree(ref), ref)
+        for ref in ('master', 'origin/master', 'refs/heads/HEAD-work',
+                    'refs/remotes/origin/HEAD', 'master~1', 'a44dfd'):
+            self.assertFalse(git.Git.perWorktree(ref), ref)
+
+    @mock.patch('bigitr.git.shell.LoggingShell')
+    @mock.patch('fcntl.fcntl')
+    def test_objectInfo(self, fc, LS):
+        LS.return_value.stdout.readline.side_effect = [
+            'a44dfd commit 200\n', 'bar missing\n']
+        self.assertEquals(self.git.objectInfo('foo'), ('a44dfd', 'commit'))
+        self.assertEquals(self.git.objectInfo('bar'), None)
+        # one process answers all queries
+        # in the repository, whichever working tree is current
+        LS.assert_called_once_with(mock.ANY,
+            'git', 'cat-file', '--batch-check',
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            cwd=self.git.repoDir())
+        LS.return_value.stdin.write.assert_has_calls([
+            mock.call('foo\n'), mock.call('bar\n')])
+        self.assertEquals(self.git.objectInfo('a\nb'), None)
+        self.assertEquals(LS.return_value.stdin.write.call_count, 2)
+        self.git.close()
+        LS.return_value.stdin.close.assert_called_once_with()
+        LS.return_value.finish.assert_called_once_with()
+        self.assertEquals(self.git.catFile, None)
+        # closing again is harmless
+        self.git.close()
+        LS.return_value.finish.assert_called_once_with()
+
+    @mock.patch('bigitr.git.shell.LoggingShell')
+    @mock.patch('fcntl.fcntl')
+    def test_objectInfoExited(self, fc, LS):
+        LS.return_value.stdout.readline.return_value = ''
+        self.assertRaises(RuntimeError, self.git.objectInfo, 'foo')
+        LS.return_value.finish.assert_called_once_with()
+        self.assertEquals(self.git.catFile, None)
+
+    def test_updateRef(self):
+        with mock.patch('bigitr.git.shell.run'):
+            self.git.updateRef('refs/heads/foo', 'a44dfd')
+            shell.run.assert_called_once_with(mock.ANY,
+                'git', 'update-ref', 'refs/heads/foo', 'a44dfd')
+
+    def test_listTreeFiles(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, 'a\0dir/b c\0')
+            self.assertEquals(self.git.listTreeFiles('foo'), ['a', 'dir/b c'])
+            r.assert_called_once_with(mock.ANY,
+                'git', 'ls-tree', '-r', '-z', '--name-only', 'foo')
+
+    def test_committerIdent(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, 'A U Thor <a@b> 1000000000 -0400\n')
+            self.assertEquals(self.git.committerIdent(),
+                'A U Thor <a@b> 1000000000 -0400')
+            r.assert_called_once_with(mock.ANY,
+                'git', 'var', 'GIT_COMMITTER_IDENT')
+
+    def test_fastImportPath(self):
+        self.assertEquals(git.Git.fastImportPath('a b/c'), 'a b/c')
+        self.assertEquals(git.Git.fastImportPath('a\nb'), '"a\\nb"')
+        self.assertEquals(git.Git.fastImportPath('"a\\b'), '"\\"a\\\\b"')
+
+    def fastImportMocks(self, revs):
+        p = mock.Mock()
+        stream = []
+        p.stdin.write.side_effect = stream.append
+        self.git.committerIdent = mock.Mock()
+        self.git.committerIdent.return_value = 'A <a@b> 1 +0000'
+        self.git.revParse = mock.Mock()
+        self.git.revParse.side_effect = lambda x: revs[x]
+        self.git.updateRef = mock.Mock()
+        return p, stream
+
+    @mock.patch('bigitr.git.shell.LoggingShell')
+    @mock.patch('os.stat')
+    def test_fastImport(self, st, LS):
+        p, stream = self.fastImportMocks({
+            'origin/b': 'p1',
+            'refs/heads/b^{tree}': 't2',
+            'p1^{tree}': 't1'})
+        LS.return_value = p
+        st.side_effect = lambda x: mock.Mock(st_mode={
+            '/s/a': 0100644, '/s/x': 0100755}[x])
+        with mock.patch('__builtin__.file') as f:
+            f.side_effect = lambda x: StringIO({'/s/a': 'A\n', '/s/x': 'X'}[x])
+            self.assertTrue(self.git.fastImport('b', 'origin/b', 'msg',
+                [('a', '/s/a'), ('d/x', '/s/x')], ['gone']))
+        LS.assert_called_once_with(mock.ANY,
+            'git', 'fast-import', '--quiet', '--force', stdin=mock.ANY)
+        self.assertEquals(''.join(stream),
+            'reset refs/heads/b\n'
+            'commit refs/heads/b\n'
+            'committer A <a@b> 1 +0000\n'
+            'data 3\nmsg\n'
+            'from p1\n'
+            'D gone\n'
+            'M 100644 inline a\ndata 2\nA\n\n'
+            'M 100755 inline d/x\ndata 1\nX\n'
+            'done\n')
+        p.stdin.close.assert_called_once_with()
+        p.finish.assert_called_once_with()
+        self.assertFalse(self.git.updateRef.called)
+
+    @mock.patch('bigitr.git.shell.LoggingShell')
+    def test_fastImportUnchanged(self, LS):
+        p, stream = self.fastImportMocks({
+            'origin/b': 'p1',
+            'refs/heads/b^{tree}': 't1',
+            'p1^{tree}': 't1'})
+        LS.return_value = p
+        self.assertFalse(self.git.fastImport('b', 'origin/b', 'msg', [], []))
+        self.git.updateRef.assert_called_once_with('refs/heads/b', 'p1')
+
+    @mock.patch('bigitr.git.shell.LoggingShell')
+    def test_fastImportNewBranch(self, LS):
+        p, stream = self.fastImportMocks({})
+        LS.return_value = p
+        self.assertTrue(self.git.fastImport('b', None, 'msg', [], []))
+        self.assertFalse('from' in ''.join(stream))
+        self.assertFalse(self.git.revParse.called)
+
+    @mock.patch('bigitr.git.shell.LoggingShell')
+    def test_fastImportError(self, LS):
+        p, stream = self.fastImportMocks({})
+        p.stdin.write.side_effect = IOError
+        LS.return_value = p
+        self.assertRaises(IOError, self.git.fastImport, 'b', None, 'msg', [], [])
+        p.stdin.close.assert_called_once_with()
+        p.finish.assert_called_once_with()
+
     def test_newBranch(self):
         with mock.patch('bigitr.git.shell.run'):
             self.git.newBranch('b')
@@ -196,6 +581,82 @@ fe9a5fbf7fe7ca3f6f08946187e2d1ce302c0201 refs/remotes/origin/master
             shell.run.assert_called_once_with(mock.ANY,
                 'git', 'checkout', '-f', 'b')
 
+    def test_branchDir(self):
+        self.assertEqual(self.git.branchDir('a/b'), '/git/repo')
+        self.ctx._ac.set('global', 'gitworktrees', 'true')
+        self.assertEqual(self.git.branchDir('a/b'), '/git/repo.worktrees/a/b')
+
+    @mock.patch('os.chdir')
+    def test_addWorktree(self, cd):
+        with mock.patch('bigitr.git.shell.read') as r:
+            with mock.patch('bigitr.git.shell.run'):
+                r.return_value = (0, 'refs/heads/b\n')
+                self.git.addWorktree('b', 'b')
+                r.assert_called_once_with(mock.ANY, 'git', '-C', '/git/repo',
+                    'symbolic-ref', '-q', 'HEAD', error=False)
+                shell.run.assert_has_calls([
+                    mock.call(mock.ANY,
+                        'git', '-C', '/git/repo', 'checkout', '--detach'),
+                    mock.call(mock.ANY,
+                        'git', '-C', '/git/repo', 'worktree', 'prune'),
+                    mock.call(mock.ANY,
+                        'git', '-C', '/git/repo', 'worktree', 'add',
+                        '/git/repo.worktrees/b', 'b')])
+                cd.assert_called_once_with('/git/repo.worktrees/b')
+                shell.run.reset_mock()
+                r.return_value = (1, '')
+                self.git.addWorktree('b', 'b')
+                self.assertEqual(shell.run.call_count, 2)
+
+    @mock.patch('os.path.exists')
+    @mock.patch('os.chdir')
+    def test_checkoutWorktree(self, cd, pe):
+        self.ctx._ac.set('global', 'gitworktrees', 'true')
+        pe.return_value = True
+        with mock.patch.multiple(self.git, pristine=mock.DEFAULT,
+                                 addWorktree=mock.DEFAULT) as mockgit:
+            with mock.patch('bigitr.git.shell.run'):
+                self.git.checkout('b')
+                self.assertFalse(shell.run.called)
+            pe.assert_called_once_with('/git/repo.worktrees/b')
+            cd.assert_called_once_with('/git/repo.worktrees/b')
+            mockgit['pristine'].assert_called_once_with()
+            self.assertFalse(mockgit['addWorktree'].called)
+            pe.return_value = False
+            self.git.checkout('b')
+            mockgit['addWorktree'].assert_called_once_with('b', 'b')
+
+    def test_checkoutTrackingWorktree(self):
+        self.ctx._ac.set('global', 'gitworktrees', 'true')
+        with mock.patch.object(self.git, 'addWorktree') as aW:
+            with mock.patch('bigitr.git.shell.run'):
+                self.git.checkoutTracking('b')
+                self.assertFalse(shell.run.called)
+            aW.assert_called_once_with('b', '--track', '-b', 'b', 'origin/b')
+
+    def test_checkoutNewImportBranchWorktree(self):
+        self.ctx._ac.set('global', 'gitworktrees', 'true')
+        with mock.patch.object(self.git, 'addWorktree') as aW:
+            with mock.patch('bigitr.git.shell.run'):
+                self.git.checkoutNewImportBranch('b')
+                aW.assert_called_once_with('b', '--detach')
+                shell.run.assert_has_calls([
+                    mock.call(mock.ANY, 'git', 'checkout', '--orphan', 'b'),
+                    mock.call(mock.ANY, 'git', 'rm', '-rf', '.', error=False)])
+
+    @mock.patch('os.getcwd')
+    def test_branchCachedPerDirectory(self, gc):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, 'master')
+            gc.return_value = '/git/repo'
+            self.git.branch()
+            self.git.branch()
+            self.assertEqual(r.call_count, 1)
+            gc.return_value = '/git/repo.worktrees/b'
+            r.return_value = (0, 'b')
+            self.assertEqual(self.git.branch(), 'b')
+            self.assertEqual(r.call_count, 2)
+
     def test_listContentFiles(self):
         with mock.patch('bigitr.git.shell.read') as r:
             r.return_value = (0, '.gitignore\0foo\0.gitmodules\0bar/baz\0')
@@ -204,6 +665,20 @@ fe9a5fbf7fe7ca3f6f08946187e2d1ce302c0201 refs/remotes/origin/master
                 'git', 'ls-files', '--exclude-standard', '-z')
             self.assertEquals(files, ['foo', 'bar/baz'])
 
+    def test_diffTree(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, 'M\0a b\0A\0c/d\0D\0e\0')
+            files = self.git.diffTree('origin/export-b', 'b')
+            r.assert_called_once_with(mock.ANY,
+                'git', 'diff-tree', '-r', '--no-renames', '--name-status',
+                '-z', 'origin/export-b', 'b')
+            self.assertEquals(files, [('M', 'a b'), ('A', 'c/d'), ('D', 'e')])
+
+    def test_diffTreeEmpty(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, '')
+            self.assertEquals(self.git.diffTree('a', 'b'), [])
+
     def test_statusEmpty(self):
         with mock.patch('bigitr.git.shell.read') as r:
             r.return_value = (0, '')
@@ -296,6 +771,144 @@ fe9a5fbf7fe7ca3f6f08946187e2d1ce302c0201 refs/remotes/origin/master
                 'git', 'merge', 'brnch', '-m', 'msg', error=False)
             self.assertEqual(rc, 1)
 
+    def test_isAncestor(self):
+        with mock.patch('bigitr.git.shell.run') as r:
+            r.return_value = 0
+            self.assertTrue(self.git.isAncestor('a', 'b'))
+            r.assert_called_once_with(mock.ANY,
+                'git', 'merge-base', '--is-ancestor', 'a', 'b', error=False)
+            r.return_value = 1
+            self.assertFalse(self.git.isAncestor('a', 'b'))
+
+    def mockMergeTree(self, revs, ancestors, mergeTree=(0, 'tree\n')):
+        self.git.revParse = mock.Mock()
+        self.git.revParse.side_effect = lambda ref: revs.get(ref)
+        self.git.isAncestor = mock.Mock()
+        self.git.isAncestor.side_effect = lambda a, d: a == d or (a, d) in ancestors
+        self.git.deepen = mock.Mock()
+        self.git.branch = mock.Mock()
+        self.git.branch.return_value = 'other'
+        def read(log, *args, **kwargs):
+            if args[1] == 'merge-tree':
+                return mergeTree
+            return (0, 'merged\n')
+        return read
+
+    def test_upToDate(self):
+        self.mockMergeTree(
+            {'refs/heads/t': 't', 'refs/remotes/origin/t': 'o', 'b': 'b'},
+            set())
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, '')
+            self.assertTrue(self.git.upToDate('t', 'b'))
+            r.assert_called_once_with(mock.ANY,
+                'git', 'rev-list', '-n', '1', '^o', 'b', 't', error=False)
+            r.return_value = (0, 'b\n')
+            self.assertFalse(self.git.upToDate('t', 'b'))
+
+    def test_upToDateSame(self):
+        self.mockMergeTree(
+            {'refs/heads/t': 'o', 'refs/remotes/origin/t': 'o', 'b': 'o'},
+            set())
+        with mock.patch('bigitr.git.shell.read') as r:
+            self.assertTrue(self.git.upToDate('t', 'b'))
+            self.assertFalse(r.called)
+
+    def test_upToDateNoLocal(self):
+        self.mockMergeTree(
+            {'refs/remotes/origin/t': 'o', 'b': 'b'}, set())
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, '')
+            self.assertTrue(self.git.upToDate('t', 'b'))
+            r.assert_called_once_with(mock.ANY,
+                'git', 'rev-list', '-n', '1', '^o', 'b', error=False)
+
+    def test_upToDateNoOrigin(self):
+        self.mockMergeTree({'refs/heads/t': 't', 'b': 'b'}, set())
+        with mock.patch('bigitr.git.shell.read') as r:
+            self.assertFalse(self.git.upToDate('t', 'b'))
+            self.assertFalse(r.called)
+
+    def test_mergeTree(self):
+        read = self.mockMergeTree(
+            {'refs/heads/t': 't', 'refs/remotes/origin/t': 'o', 'b': 'b'},
+            set([('t', 'o')]))
+        with mock.patch.multiple('bigitr.git.shell',
+                                 run=mock.DEFAULT, read=mock.DEFAULT):
+            shell.read.side_effect = read
+            self.assertTrue(self.git.mergeTree('t', 'b', 'msg'))
+            self.git.deepen.assert_called_once_with('o', 'b')
+            shell.read.assert_has_calls([
+                mock.call(mock.ANY,
+                    'git', 'merge-tree', '--write-tree', 'o', 'b', error=False),
+                mock.call(mock.ANY,
+                    'git', 'commit-tree', 'tree', '-p', 'o', '-p', 'b',
+                    '-m', 'msg')])
+            shell.run.assert_called_once_with(mock.ANY,
+                'git', 'update-ref', '-m', 'msg', 'refs/heads/t', 'merged', 't')
+
+    def test_mergeTreeCheckedOut(self):
+        read = self.mockMergeTree(
+            {'refs/remotes/origin/t': 'o', 'b': 'b'}, set())
+        self.git.branch.return_value = 't'
+        with mock.patch.multiple('bigitr.git.shell',
+                                 run=mock.DEFAULT, read=mock.DEFAULT):
+            shell.read.side_effect = read
+            self.assertTrue(self.git.mergeTree('t', 'b', 'msg'))
+            shell.run.assert_has_calls([
+                mock.call(mock.ANY, 'git', 'update-ref', '-m', 'msg',
+                    'refs/heads/t', 'merged', ''),
+                mock.call(mock.ANY, 'git', 'reset', '--hard', 'merged')])
+
+    def test_mergeTreeFastForward(self):
+        self.mockMergeTree(
+            {'refs/heads/t': 't', 'refs/remotes/origin/t': 't', 'b': 'b'},
+            set([('t', 'b')]))
+        with mock.patch.multiple('bigitr.git.shell',
+                                 run=mock.DEFAULT, read=mock.DEFAULT):
+            self.assertTrue(self.git.mergeTree('t', 'b', 'msg'))
+            self.assertFalse(shell.read.called)
+            shell.run.assert_called_once_with(mock.ANY,
+                'git', 'update-ref', '-m', 'msg', 'refs/heads/t', 'b', 't')
+
+    def test_mergeTreeUpToDate(self):
+        self.mockMergeTree(
+            {'refs/heads/t': 't', 'refs/remotes/origin/t': 'o', 'b': 'b'},
+            set([('o', 't'), ('b', 't')]))
+        with mock.patch.multiple('bigitr.git.shell',
+                                 run=mock.DEFAULT, read=mock.DEFAULT):
+            self.assertTrue(self.git.mergeTree('t', 'b', 'msg'))
+            self.assertFalse(shell.read.called)
+            self.assertFalse(shell.run.called)
+
+    def test_mergeTreeConflict(self):
+        read = self.mockMergeTree(
+            {'refs/heads/t': 't', 'refs/remotes/origin/t': 't', 'b': 'b'},
+            set(), mergeTree=(1, 'tree\nCONFLICT'))
+        with mock.patch.multiple('bigitr.git.shell',
+                                 run=mock.DEFAULT, read=mock.DEFAULT):
+            shell.read.side_effect = read
+            self.assertFalse(self.git.mergeTree('t', 'b', 'msg'))
+            self.assertEqual(shell.read.call_count, 1)
+            self.assertFalse(shell.run.called)
+
+    def test_mergeTreeDiverged(self):
+        self.mockMergeTree(
+            {'refs/heads/t': 't', 'refs/remotes/origin/t': 'o', 'b': 'b'},
+            set())
+        with mock.patch.multiple('bigitr.git.shell',
+                                 run=mock.DEFAULT, read=mock.DEFAULT):
+            self.assertFalse(self.git.mergeTree('t', 'b', 'msg'))
+            self.assertFalse(shell.read.called)
+            self.assertFalse(shell.run.called)
+
+    def test_mergeTreeNoOrigin(self):
+        self.mockMergeTree({'refs/heads/t': 't', 'b': 'b'}, set())
+        with mock.patch.multiple('bigitr.git.shell',
+                                 run=mock.DEFAULT, read=mock.DEFAULT):
+            self.assertFalse(self.git.mergeTree('t', 'b', 'msg'))
+            self.assertFalse(shell.run.called)
+
     def test_mergeFastForward(self):
         with mock.patch('bigitr.git.shell.run'):
             self.git.mergeFastForward('brnch')
@@ -322,7 +935,70 @@ fe9a5fbf7fe7ca3f6f08946187e2d1ce302c0201 refs/remotes/origin/master
             shell.run.assert_called_once_with(mock.ANY,
                 'git', 'push', 'origin', 'master:master')
 
-    def test_logmessages(self):
+    def test_queuePush(self):
+        with mock.patch.object(self.git, 'revParse') as rP:
+            rP.side_effect = lambda x: {'a': '1111', 'b': '2222'}[x]
+            cb1, cb2 = mock.Mock(), mock.Mock()
+            self.git.queuePush('a', 'a', cb1)
+            self.git.queuePush('b', 'export-b')
+            self.git.queuePush('b', 'a', cb2)
+            self.assertEqual(self.git.pushes, [
+                ['2222', 'refs/heads/a', [cb1, cb2]],
+                ['2222', 'refs/heads/export-b', []]])
+
+    @mock.patch('os.chdir')
+    @mock.patch('os.getcwd')
+    def test_pushQueued(self, gc, cd):
+        cb1, cb2, cb3 = mock.Mock(), mock.Mock(), mock.Mock()
+        self.git.pushes = [
+            ['1111', 'refs/heads/a', [cb1]],
+            ['2222', 'refs/heads/b', [cb2]],
+            ['2222', 'refs/heads/c', [cb3]]]
+        self.git.fetched = True
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (1, 'To git@host:repo\n'
+                '*\t1111:refs/heads/a\t[new branch]\n'
+                '!\t2222:refs/heads/b\t[rejected] (non-fast-forward)\n'
+                ' \t2222:refs/heads/c\tabc..def\n'
+                'Done\n')
+            self.assertRaises(RuntimeError, self.git.pushQueued)
+            r.assert_called_once_with(mock.ANY,
+                'git', 'push', '--porcelain', 'origin',
+                '1111:refs/heads/a', '2222:refs/heads/b', '2222:refs/heads/c',
+                error=False)
+        cd.assert_has_calls([mock.call('/git/repo'), mock.call(gc.return_value)])
+        cb1.assert_called_once_with()
+        self.assertFalse(cb2.called)
+        cb3.assert_called_once_with()
+        self.assertEqual(self.git.pushes, [])
+        self.assertFalse(self.git.fetched)
+
+    @mock.patch('os.chdir')
+    def test_pushQueuedAtomic(self, cd):
+        self.ctx._ac.set('global', 'pushatomic', 'true')
+        cb1, cb2 = mock.Mock(), mock.Mock()
+        cb1.side_effect = lambda: 1/0
+        self.git.pushes = [
+            ['1111', 'refs/heads/a', [cb1]],
+            ['2222', 'refs/heads/b', [cb2]]]
+        with mock.patch('bigitr.git.shell.read') as r:
+            r.return_value = (0, ' \t1111:refs/heads/a\tabc..def\n'
+                                 ' \t2222:refs/heads/b\tabc..def\n')
+            # a failing callback does not stop the others
+            self.assertRaises(ZeroDivisionError, self.git.pushQueued)
+            r.assert_called_once_with(mock.ANY,
+                'git', 'push', '--porcelain', '--atomic', 'origin',
+                '1111:refs/heads/a', '2222:refs/heads/b', error=False)
+        cb2.assert_called_once_with()
+
+    def test_pushQueuedEmpty(self):
+        with mock.patch('bigitr.git.shell.read') as r:
+            self.git.pushQueued()
+            self.assertFalse(r.called)
+
+    @mock.patch('bigitr.git.Git.shallow')
+    def test_logmessages(self, s):
+        s.return_value = False
         with mock.patch('bigitr.git.shell.read') as r:
             r.return_value = (0, 'a message\n')
             msg = self.git.logmessages('since', 'until')
@@ -330,8 +1006,10 @@ fe9a5fbf7fe7ca3f6f08946187e2d1ce302c0201 refs/remotes/origin/master
                 'git', 'log', 'since..until')
             self.assertEqual(msg, 'a message\n')
 
+    @mock.patch('bigitr.git.Git.shallow')
     @mock.patch('bigitr.git.shell.read')
-    def test_logmessagesArgs(self, r):
+    def test_logmessagesArgs(self, r, s):
+        s.return_value = False
         r.return_value = (0, 'a message\n')
         self.ctx._rm.set('repo', 'gitlog.until', '--stat=500 --test')
         msg = self.git.logmessages('since', 'until')
@@ -458,3 +1136,17 @@ fe9a5fbf7fe7ca3f6f08946187e2d1ce302c0201 refs/remotes/origin/master
                 mock.call(mock.ANY, 'postcommand', 'brnch'),
                 mock.call(mock.ANY, 'postexpcommand', 'brnch'),
             ])
+
+    def test_runImpPostHooksCheckout(self):
+        with mock.patch('bigitr.git.shell.run'):
+            self.git.runImpPostHooks('brnch', checkout=True)
+            self.assertEqual(shell.run.call_args_list[0],
+                mock.call(mock.ANY, 'git', 'checkout', '-f', 'brnch'))
+            self.assertEqual(shell.run.call_count, 5)
+
+    def test_runExpPostHooksCheckoutNoHooks(self):
+        with mock.patch('bigitr.git.shell.run'):
+            self.ctx.getGitExpPostHooks = mock.Mock()
+            self.ctx.getGitExpPostHooks.return_value = []
+            self.git.runExpPostHooks('brnch', checkout=True)
+            self.assertFalse(shell.run.called)
@@ -46,6 +46,7 @@ class GitExportTest(testutils.TestCase):
                 self.mocklog = mocklog()
                 self.exp = gitexport.Exporter(self.ctx)
                 self.Git = mock.Mock()
+                self.Git.branchDir.return_value = '/gitdir/repo2'
                 self.CVS = mock.Mock()
                 self.CVS.path = '/gitdir'
 
@@ -66,6 +67,169 @@ class GitExportTest(testutils.TestCase):
             self.exp.exportgit.side_effect = lambda *x: 1/0
             self.assertRaises(ZeroDivisionError,
                 self.exp.exportBranches, 'repo', self.Git)
+            # exports completed before the error are still pushed
+            self.Git.pushQueued.assert_called_once_with()
+
+    def test_exportBranchesPushError(self):
+        with mock.patch.object(self.exp, 'exportgit'):
+            self.Git.pushQueued.side_effect = lambda: 1/0
+            self.assertRaises(ZeroDivisionError,
+                self.exp.exportBranches, 'repo', self.Git)
+            self.exp.exportgit.assert_called_once_with(
+                'repo', self.Git, mock.ANY, 'master', 'export-master')
+
+    def test_exportBranchesParallel(self):
+        self.ctx._ac.set('export', 'parallel', '2')
+        with mock.patch.multiple(self.exp, exportgit=mock.DEFAULT,
+                                 refreshCheckouts=mock.DEFAULT):
+            self.exp.refreshCheckouts.return_value = set(('master',))
+            self.exp.exportBranches('repo2', self.Git)
+            self.exp.refreshCheckouts.assert_called_once_with(
+                'repo2', self.Git, [('b1', mock.ANY, 'export-b1'),
+                                    ('master', mock.ANY, 'export-master')])
+            self.exp.exportgit.assert_has_calls([
+                mock.call('repo2', self.Git, mock.ANY, 'b1', 'export-b1'),
+                mock.call('repo2', self.Git, mock.ANY, 'master',
+                          'export-master', refreshed=True)])
+            # one branch has nothing to do concurrently
+            self.exp.refreshCheckouts.reset_mock()
+            self.exp.exportBranches('repo2', self.Git, 'b1')
+            self.assertFalse(self.exp.refreshCheckouts.called)
+
+    @mock.patch('os.path.exists')
+    @mock.patch('os.chdir')
+    def test_refreshCheckouts(self, cd, pe):
+        self.ctx._ac.set('export', 'parallel', '2')
+        pe.return_value = True
+        self.Git.revParse.side_effect = lambda x: {
+            'origin/a': '1', 'remotes/origin/export-a': '0',
+            'origin/b': '1', 'remotes/origin/export-b': '1',
+            'origin/c': '1', 'remotes/origin/export-c': '0',
+            'origin/d': '1'}.get(x)
+        finished = []
+        def start(CVS, block=True):
+            if CVS.fail:
+                def finish():
+                    finished.append(CVS.name)
+                    raise RuntimeError
+                return finish
+            return lambda: finished.append(CVS.name)
+        branchMaps = []
+        for name in 'abcd':
+            CVS = mock.Mock()
+            CVS.name = name
+            CVS.fail = name == 'd'
+            branchMaps.append((name, CVS, 'export-' + name))
+        with mock.patch.object(self.exp, 'startCheckoutCVS') as sCC:
+            sCC.side_effect = start
+            refreshed = self.exp.refreshCheckouts('repo2', self.Git, branchMaps)
+            cd.assert_any_call('/gitdir/repo2')
+            self.Git.fetch.assert_called_once_with()
+            # b has nothing new to export; at most two at once
+            self.assertEqual(sCC.call_args_list, [
+                mock.call(branchMaps[0][1], block=True),
+                mock.call(branchMaps[2][1], block=False),
+                mock.call(branchMaps[3][1], block=False)])
+            self.assertEqual(finished, ['a', 'c', 'd'])
+            # the failure is left for exportgit to retry and report
+            self.assertEqual(refreshed, set(('a', 'c')))
+
+    @mock.patch('os.path.exists')
+    @mock.patch('os.chdir')
+    def test_refreshCheckoutsNoConnection(self, cd, pe):
+        self.ctx._ac.set('export', 'parallel', '4')
+        pe.return_value = True
+        self.Git.revParse.side_effect = lambda x: x
+        finished = []
+        def start(CVS, block=True):
+            if not block:
+                # no connection free while holding one
+                return None
+            return lambda: finished.append(CVS)
+        branchMaps = [('a', 'A', 'export-a'), ('b', 'B', 'export-b')]
+        with mock.patch.object(self.exp, 'startCheckoutCVS') as sCC:
+            sCC.side_effect = start
+            refreshed = self.exp.refreshCheckouts('repo2', self.Git, branchMaps)
+            self.assertEqual(sCC.call_args_list, [
+                mock.call('A', block=True),
+                mock.call('B', block=False),
+                mock.call('B', block=True)])
+            self.assertEqual(finished, ['A', 'B'])
+            self.assertEqual(refreshed, set(('a', 'b')))
+
+    @mock.patch('os.path.exists')
+    def test_refreshCheckoutsNoClone(self, pe):
+        pe.return_value = False
+        with mock.patch.object(self.exp, 'startCheckoutCVS') as sCC:
+            self.assertEqual(self.exp.refreshCheckouts('repo2', self.Git,
+                [('a', 'A', 'export-a')]), set())
+            self.assertFalse(self.Git.fetch.called)
+            self.assertFalse(sCC.called)
+
+    @mock.patch('bigitr.gitexport.Exporter.assertNoCVSMetaData')
+    @mock.patch('bigitr.gitexport.Exporter.calculateFileSets')
+    @mock.patch('bigitr.gitexport.Exporter.startCheckoutCVS')
+    @mock.patch('bigitr.gitexport.Exporter.checkoutCVS')
+    @mock.patch('bigitr.gitexport.Exporter.getGitMessages')
+    @mock.patch('bigitr.gitexport.Exporter.prepareGitClone')
+    @mock.patch('bigitr.gitexport.Exporter.cloneGit')
+    @mock.patch('os.chdir')
+    def test_exportgitRefreshed(self, cd, cG, pGC, gGM, cC, sCC, cFS, aNCMD):
+        self.Git.revParse.side_effect = lambda x: x
+        pGC.return_value = set(('b1', 'export-b1', 'remotes/origin/export-b1'))
+        gGM.return_value = 'message'
+        cFS.return_value = [set(('f',)), set(), set(('f',)), set(), set(), set()]
+        self.CVS.branch = 'b1'
+        self.exp.exportgit('repo2', self.Git, self.CVS, 'b1', 'export-b1',
+                           refreshed=True)
+        self.assertFalse(sCC.called)
+        self.assertFalse(cC.called)
+        self.CVS.commit.assert_called_with('message')
+
+    @mock.patch('bigitr.gitexport.Exporter.assertNoCVSMetaData')
+    @mock.patch('bigitr.gitexport.Exporter.calculateFileSets')
+    @mock.patch('bigitr.gitexport.Exporter.startCheckoutCVS')
+    @mock.patch('bigitr.gitexport.Exporter.checkoutCVS')
+    @mock.patch('bigitr.gitexport.Exporter.getGitMessages')
+    @mock.patch('bigitr.gitexport.Exporter.prepareGitClone')
+    @mock.patch('bigitr.gitexport.Exporter.cloneGit')
+    @mock.patch('os.chdir')
+    def test_exportgitPipelined(self, cd, cG, pGC, gGM, cC, sCC, cFS, aNCMD):
+        self.Git.revParse.side_effect = lambda x: {
+            'origin/b1': 'new', 'remotes/origin/export-b1': 'old'}[x]
+        finish = sCC.return_value
+        # CVS is not waited for until Git is ready
+        def prepareGitClone(*args):
+            self.assertFalse(finish.called)
+            return mock.DEFAULT
+        pGC.side_effect = prepareGitClone
+        pGC.return_value = set(('b1', 'export-b1', 'remotes/origin/export-b1'))
+        gGM.return_value = 'message'
+        cFS.return_value = [set(('f',)), set(), set(('f',)), set(), set(), set()]
+        self.CVS.branch = 'b1'
+        self.exp.exportgit('repo2', self.Git, self.CVS, 'b1', 'export-b1')
+        self.Git.fetch.assert_called_once_with()
+        sCC.assert_called_once_with(self.CVS)
+        finish.assert_called_once_with()
+        self.assertFalse(cC.called)
+        self.Git.runExpPreHooks.assert_called_with('b1')
+        self.CVS.commit.assert_called_with('message')
+
+        # nothing to export after all
+        finish.reset_mock()
+        gGM.return_value = ''
+        self.CVS.commit.reset_mock()
+        self.exp.exportgit('repo2', self.Git, self.CVS, 'b1', 'export-b1')
+        finish.assert_called_once_with()
+        self.assertFalse(self.CVS.commit.called)
+
+        # the Git error is reported even if CVS fails too
+        finish.reset_mock()
+        finish.side_effect = lambda: 1/0
+        gGM.side_effect = lambda *x: [][1]
+        self.assertRaises(IndexError,
+            self.exp.exportgit, 'repo2', self.Git, self.CVS, 'b1', 'export-b1')
+        finish.assert_called_once_with()
 
     @mock.patch('bigitr.gitexport.Exporter.assertNoCVSMetaData')
     @mock.patch('bigitr.gitexport.Exporter.calculateFileSets')
@@ -91,14 +255,19 @@ class GitExportTest(testutils.TestCase):
         aNCMD.assert_called_with(set(()))
         self.CVS.deleteFiles.assert_called_with([])
         self.CVS.copyFiles.assert_called_with('/gitdir/repo2', ['f'])
+        self.Git.branchDir.assert_called_with('b1')
         self.CVS.addDirectories.assert_called_with([])
         self.CVS.addFiles.assert_called_with(['f'])
         self.CVS.runPreHooks.assert_called_with()
         self.Git.infoDiff.assert_called_with('remotes/origin/export-b1', 'b1')
         self.CVS.commit.assert_called_with('message')
-        self.Git.push.assert_called_with('origin', 'b1', 'export-b1')
-        self.CVS.runPostHooks.assert_called_with()
-        self.Git.runExpPostHooks.assert_called_with('b1')
+        self.Git.queuePush.assert_called_with('b1', 'export-b1',
+            self.CVS.runPostHooks, mock.ANY)
+        # post hooks wait for the push
+        self.assertFalse(self.CVS.runPostHooks.called)
+        self.assertFalse(self.Git.runExpPostHooks.called)
+        self.Git.queuePush.call_args[0][3]()
+        self.Git.runExpPostHooks.assert_called_with('b1', checkout=True)
 
         # test other cases from the bottom up
         self.Git.infoDiff.reset_mock()
@@ -122,6 +291,26 @@ class GitExportTest(testutils.TestCase):
         self.assertRaises(RuntimeError,
             self.exp.exportgit, 'repo2', self.Git, self.CVS, 'b1', 'export-b1')
 
+        cFS.reset_mock()
+        self.ctx._ac.set('export', 'incremental', 'true')
+        pGC.return_value = set(('b1', 'remotes/origin/export-b1'))
+        with mock.patch.object(self.exp, 'calculateChangedFileSets') as cCFS:
+            cCFS.return_value = [set(('f',)), set(), set(), set(('f',)), set(), set()]
+            self.exp.exportgit('repo2', self.Git, self.CVS, 'b1', 'export-b1')
+            cCFS.assert_called_once_with(self.CVS, self.Git,
+                'remotes/origin/export-b1', 'b1')
+            self.assertFalse(cFS.called)
+            self.CVS.copyFiles.assert_called_with('/gitdir/repo2', ['f'])
+            self.CVS.addFiles.assert_called_with([])
+            # the initial export compares the whole tree
+            pGC.return_value = set(('b1',))
+            cCFS.reset_mock()
+            cFS.return_value = cCFS.return_value
+            self.exp.exportgit('repo2', self.Git, self.CVS, 'b1', 'export-b1')
+            self.assertFalse(cCFS.called)
+            cFS.assert_called_once_with(self.CVS, self.Git)
+        self.ctx._ac.set('export', 'incremental', 'false')
+
         gGM.return_value = ''
         self.Git.runExpPreHooks.reset_mock()
         self.exp.exportgit('repo2', self.Git, self.CVS, 'b1', 'export-b1')
@@ -137,11 +326,23 @@ class GitExportTest(testutils.TestCase):
         self.Git.logmessages.assert_not_called()
 
         self.Git.logmessages.return_value = 'fakemessage'
+        self.Git.revParse.side_effect = lambda x: {
+            'a': '2222', 'remotes/origin/e-a': '1111'}[x]
         gm = self.exp.getGitMessages(self.Git,
             set(['a', 'e-a', 'remotes/origin/e-a']),
             set(['e-a', 'remotes/origin/e-a']),
             'a',  'remotes/origin/e-a')
         self.assertEqual(gm, 'fakemessage')
+        self.Git.logmessages.assert_called_once_with('remotes/origin/e-a', 'a')
+
+    def test_getGitMessagesUnchanged(self):
+        self.Git.revParse.return_value = '1111'
+        gm = self.exp.getGitMessages(self.Git,
+            set(['a', 'e-a', 'remotes/origin/e-a']),
+            set(['e-a', 'remotes/origin/e-a']),
+            'a',  'remotes/origin/e-a')
+        self.assertEqual(gm, '')
+        self.assertFalse(self.Git.logmessages.called)
 
     def test_assertNoCVSMetaData(self):
         self.exp.assertNoCVSMetaData(['a', 'b'])
@@ -168,6 +369,43 @@ class GitExportTest(testutils.TestCase):
                 self.Git.clone.assert_not_called()
                 cd.assert_called_once_with('/gitdir/repo')
 
+    def test_startCheckoutCVS(self):
+        with mock.patch('os.makedirs') as md:
+            with mock.patch('os.path.exists') as exists:
+                exists.side_effect = [False, False, True]
+                self.CVS.path = '/cvsdir/repo/b1/Loc'
+                finish = self.exp.startCheckoutCVS(self.CVS)
+                md.assert_called_once_with('/cvsdir/repo/b1')
+                self.CVS.startCheckout.assert_called_once_with(True)
+                self.assertFalse(self.CVS.startCheckout().called)
+                finish()
+                self.CVS.startCheckout().assert_called_once_with()
+                self.assertFalse(self.CVS.startUpdate.called)
+                exists.side_effect = [True, False, False]
+                finish = self.exp.startCheckoutCVS(self.CVS)
+                self.CVS.startCheckout().reset_mock()
+                self.assertRaises(RuntimeError, finish)
+                self.CVS.startCheckout().assert_called_once_with()
+
+    def test_startCheckoutCVSNoConnection(self):
+        with mock.patch('os.makedirs') as md:
+            with mock.patch('os.path.exists') as exists:
+                exists.side_effect = [True, False]
+                self.CVS.startCheckout.return_value = None
+                self.assertEqual(
+                    self.exp.startCheckoutCVS(self.CVS, block=False), None)
+                self.CVS.startCheckout.assert_called_once_with(False)
+
+    def test_startCheckoutCVSPopulated(self):
+        with mock.patch('os.makedirs') as md:
+            with mock.patch('os.path.exists') as exists:
+                exists.return_value = True
+                self.CVS.path = '/cvsdir/repo/b1/Loc'
+                finish = self.exp.startCheckoutCVS(self.CVS)
+                self.assertFalse(md.called)
+                self.assertEqual(finish, self.CVS.startUpdate())
+                self.assertFalse(self.CVS.startCheckout.called)
+
     def test_checkoutCVS(self):
         with mock.patch('os.makedirs') as md:
             with mock.patch('os.path.exists') as exists:
@@ -338,6 +576,80 @@ class GitExportTest(testutils.TestCase):
         ])
 
 
+    def cvsTree(self, files):
+        dirs = set()
+        for f in files:
+            d = os.path.dirname(f)
+            while d:
+                dirs.add(d)
+                d = os.path.dirname(d)
+        isfile = mock.patch('os.path.isfile',
+            side_effect=lambda x: x[len('/gitdir/'):] in files)
+        isdir = mock.patch('os.path.isdir',
+            side_effect=lambda x: x[len('/gitdir/'):] in dirs)
+        return isfile, isdir
+
+    def test_calculateChangedFileSets(self):
+        isfile, isdir = self.cvsTree(set(('a/b', 'a/c', 'd', '.cvsignore')))
+        self.Git.listContentFiles.return_value = ['a/b', 'b/c/a', 'd', 'e']
+        self.Git.diffTree.return_value = [
+            ('M', 'a/b'), ('D', 'a/c'), ('A', 'b/c/a'), ('A', 'd'),
+            ('D', '.cvsignore'), ('D', 'gone')]
+        with isfile:
+            with isdir:
+                G, D, AF, C, DD, AD = self.exp.calculateChangedFileSets(
+                    self.CVS, self.Git, 'remotes/origin/export-b1', 'b1')
+        self.Git.diffTree.assert_called_once_with(
+            'remotes/origin/export-b1', 'b1')
+        self.assertFalse(self.CVS.listContentFiles.called)
+        self.assertEqual(G, set(('a/b', 'b/c/a', 'd', 'e')))
+        self.assertEqual(D, set(('a/c',)))
+        self.assertEqual(AF, set(('b/c/a',)))
+        # added in Git, but already present in CVS
+        self.assertEqual(C, set(('a/b', 'd')))
+        self.assertEqual(DD, set())
+        self.assertEqual(AD, set(('b', 'b/c')))
+
+    def test_calculateChangedFileSetsFileToDirectory(self):
+        isfile, isdir = self.cvsTree(set(('a',)))
+        self.Git.listContentFiles.return_value = ['a/b']
+        self.Git.diffTree.return_value = [('D', 'a'), ('A', 'a/b')]
+        with isfile:
+            with isdir:
+                G, D, AF, C, DD, AD = self.exp.calculateChangedFileSets(
+                    self.CVS, self.Git, 'remotes/origin/export-b1', 'b1')
+        self.assertEqual(D, set(('a',)))
+        self.assertEqual(AD, set(('a',)))
+
+    def test_calculateChangedFileSetsDirectoryToFile(self):
+        isfile, isdir = self.cvsTree(set(('a/b',)))
+        self.Git.listContentFiles.return_value = ['a']
+        self.Git.diffTree.return_value = [('D', 'a/b'), ('A', 'a')]
+        with isfile:
+            with isdir:
+                G, D, AF, C, DD, AD = self.exp.calculateChangedFileSets(
+                    self.CVS, self.Git, 'remotes/origin/export-b1', 'b1')
+        self.assertEqual(D, set(('a/b',)))
+        self.assertEqual(AF, set(('a',)))
+        self.assertEqual(DD, set(('a',)))
+
+    def test_calculateChangedFileSetsCVSMetaData(self):
+        isfile, isdir = self.cvsTree(set(('sub/a', 'sub/CVS/Entries')))
+        self.Git.listContentFiles.return_value = ['sub/a', 'sub/CVS/Entries']
+        self.Git.diffTree.return_value = [('A', 'sub/CVS/Entries')]
+        with isfile:
+            with isdir:
+                G, D, AF, C, DD, AD = self.exp.calculateChangedFileSets(
+                    self.CVS, self.Git, 'remotes/origin/export-b1', 'b1')
+        self.assertEqual(AD, set(('sub/CVS',)))
+        # the same error as when comparing the whole tree
+        try:
+            self.exp.assertNoCVSMetaData(AD)
+            self.fail('no exception')
+        except RuntimeError, e:
+            self.assertEqual(str(e), "Not exporting with CVS metadata"
+                " included in Git repository: 'sub/CVS'")
+
     def test_trackBranch(self):
         self.exp.trackBranch('repo', self.Git, 'b1', set(('remotes/origin/b1',)))
         self.Git.trackBranch.assert_called_once_with('b1')
@@ -46,37 +46,121 @@ class GitMergeTest(testutils.TestCase):
                                      'cvs.b2 = b2\n'
                                      'merge.cvs-b1 = b1 b2\n'
                                      'merge.cvs-b2 = b2\n'
+                                     '[repo3]\n'
+                                     'cvsroot = fdsa\n'
+                                     'cvspath = Third/Loc\n'
+                                     'cvs.b1 = b1\n'
+                                     'merge.cvs-b1 = a b\n'
+                                     'merge.a = master\n'
+                                     'merge.b = master\n'
                                      )
                 self.ctx = context.Context(appConfig, repConfig)
                 self.mocklog = mocklog()
                 self.mrg = gitmerge.Merger(self.ctx)
 
 
+    def test_mergeTree(self):
+        Git = mock.Mock()
+        Git.mergeTree.return_value = True
+        Git.upToDate.return_value = False
+        rc = self.mrg.merge('repo', Git, 'cvs-b1')
+        Git.mergeTree.assert_has_calls([
+            mock.call('b1', 'cvs-b1', "Automated merge 'cvs-b1' into 'b1'"),
+            mock.call('master', 'b1', "Automated merge 'b1' into 'master'")])
+        self.assertFalse(Git.checkout.called)
+        self.assertFalse(Git.mergeDefault.called)
+        # no working tree is needed
+        self.assertFalse(Git.pristine.called)
+        Git.queuePush.assert_has_calls(
+            [mock.call('b1', 'b1', mock.ANY),
+             mock.call('master', 'master', mock.ANY)])
+        self.assertTrue(rc)
+
+    def test_mergeDiamond(self):
+        Git = mock.Mock()
+        Git.mergeTree.return_value = True
+        Git.upToDate.return_value = False
+        rc = self.mrg.merge('repo3', Git, 'cvs-b1')
+        self.assertEqual(Git.mergeTree.call_args_list, [
+            mock.call('a', 'cvs-b1', "Automated merge 'cvs-b1' into 'a'"),
+            mock.call('b', 'cvs-b1', "Automated merge 'cvs-b1' into 'b'"),
+            mock.call('master', 'a', "Automated merge 'a' into 'master'"),
+            mock.call('master', 'b', "Automated merge 'b' into 'master'")])
+        # master is pushed and hooked once
+        self.assertEqual(Git.queuePush.call_args_list, [
+            mock.call('a', 'a', mock.ANY),
+            mock.call('b', 'b', mock.ANY),
+            mock.call('master', 'master', mock.ANY)])
+        self.assertTrue(rc)
+
+    def test_mergeUpToDate(self):
+        Git = mock.Mock()
+        Git.mergeTree.return_value = True
+        Git.upToDate.side_effect = lambda target, branch: target == 'a'
+        rc = self.mrg.merge('repo3', Git, 'cvs-b1')
+        self.assertFalse(Git.checkout.called)
+        # a is not merged or pushed, but what origin has of a is still
+        # merged downstream
+        self.assertEqual(Git.mergeTree.call_args_list, [
+            mock.call('b', 'cvs-b1', "Automated merge 'cvs-b1' into 'b'"),
+            mock.call('master', 'origin/a', "Automated merge 'a' into 'master'"),
+            mock.call('master', 'b', "Automated merge 'b' into 'master'")])
+        self.assertEqual(Git.queuePush.call_args_list, [
+            mock.call('b', 'b', mock.ANY),
+            mock.call('master', 'master', mock.ANY)])
+        self.assertTrue(rc)
+
+    def test_mergeDiamondFailure(self):
+        Git = mock.Mock()
+        Git.mergeTree.side_effect = lambda target, branch, msg: target != 'b'
+        Git.upToDate.return_value = False
+        Git.mergeDefault.return_value = 1
+        rc = self.mrg.merge('repo3', Git, 'cvs-b1')
+        # master is still merged from a, but not from the failed b
+        self.assertEqual(Git.mergeTree.call_args_list, [
+            mock.call('a', 'cvs-b1', "Automated merge 'cvs-b1' into 'a'"),
+            mock.call('b', 'cvs-b1', "Automated merge 'cvs-b1' into 'b'"),
+            mock.call('master', 'a', "Automated merge 'a' into 'master'")])
+        Git.checkout.assert_called_once_with('b')
+        self.assertEqual(Git.queuePush.call_args_list, [
+            mock.call('a', 'a', mock.ANY),
+            mock.call('master', 'master', mock.ANY)])
+        self.assertFalse(rc)
+
     def test_merge(self):
         Git = mock.Mock()
+        Git.mergeTree.return_value = False
+        Git.upToDate.return_value = False
         Git.mergeDefault.return_value = 0
         rc = self.mrg.merge('repo2', Git, 'cvs-b1')
+        Git.pristine.assert_called_once_with()
         Git.checkout.assert_has_calls([mock.call('b1'), mock.call('b2')])
         Git.mergeFastForward.assert_has_calls(
             [mock.call('origin/b1'), mock.call('origin/b2')])
         Git.mergeDefault.assert_has_calls(
             [mock.call('cvs-b1', "Automated merge 'cvs-b1' into 'b1'"),
              mock.call('cvs-b1', "Automated merge 'cvs-b1' into 'b2'")])
-        Git.push.assert_has_calls(
-            [mock.call('origin', 'b1', 'b1'),
-             mock.call('origin', 'b2', 'b2')]
+        Git.queuePush.assert_has_calls(
+            [mock.call('b1', 'b1', mock.ANY),
+             mock.call('b2', 'b2', mock.ANY)]
         )
+        self.assertFalse(Git.push.called)
+        self.assertFalse(Git.runImpPostHooks.called)
+        Git.queuePush.call_args[0][2]()
+        Git.runImpPostHooks.assert_called_once_with('b2', checkout=True)
         self.assertTrue(rc)
         Git.reset_mock()
         rc = self.mrg.merge('repo2', Git, 'cvs-b2')
         Git.checkout.assert_called_once_with('b2')
         Git.mergeDefault.assert_called_once_with(
             'cvs-b2', "Automated merge 'cvs-b2' into 'b2'")
-        Git.push.assert_called_once_with('origin', 'b2', 'b2')
+        Git.queuePush.assert_called_once_with('b2', 'b2', mock.ANY)
         self.assertTrue(rc)
 
     def test_mergeFailure(self):
         Git = mock.Mock()
+        Git.mergeTree.return_value = False
+        Git.upToDate.return_value = False
         Git.mergeDefault.return_value = 1
         rc = self.mrg.merge('repo2', Git, 'cvs-b1')
         Git.checkout.assert_has_calls([mock.call('b1'), mock.call('b2')])
@@ -84,6 +168,8 @@ class GitMergeTest(testutils.TestCase):
 
     def test_mergeCascade(self):
         Git = mock.Mock()
+        Git.mergeTree.return_value = False
+        Git.upToDate.return_value = False
         Git.mergeDefault.return_value = 0
         rc = self.mrg.merge('repo', Git, 'cvs-b1')
         Git.checkout.assert_has_calls([mock.call('b1'), mock.call('master')])
@@ -91,6 +177,8 @@ class GitMergeTest(testutils.TestCase):
 
     def test_mergeFailureNoCascade(self):
         Git = mock.Mock()
+        Git.mergeTree.return_value = False
+        Git.upToDate.return_value = False
         Git.mergeDefault.return_value = 1
         rc = self.mrg.merge('repo', Git, 'cvs-b1')
         Git.checkout.assert_called_once_with('b1') # not 'master'
@@ -98,11 +186,13 @@ class GitMergeTest(testutils.TestCase):
 
     def test_mergeFailureInCascade(self):
         Git = mock.Mock()
+        Git.mergeTree.return_value = False
+        Git.upToDate.return_value = False
         Git.mergeDefault.return_value = 0
         Git.mergeDefault.side_effect = lambda x, y: x == 'b1'
         rc = self.mrg.merge('repo', Git, 'cvs-b1')
         Git.checkout.assert_has_calls([mock.call('b1'), mock.call('master')])
-        Git.push.assert_called_once_with('origin', 'b1', 'b1') # not 'master'
+        Git.queuePush.assert_called_once_with('b1', 'b1', mock.ANY) # not 'master'
         self.assertFalse(rc)
 
     def test_mergeBranches(self):
@@ -112,6 +202,7 @@ class GitMergeTest(testutils.TestCase):
             mb.assert_has_calls(
                 [mock.call('repo2', mock.ANY, 'cvs-b1'),
                  mock.call('repo2', mock.ANY, 'cvs-b2')])
+            Git.pushQueued.assert_called_once_with()
 
     def test_mergeBranchesError(self):
         Git = mock.Mock()
@@ -122,6 +213,7 @@ class GitMergeTest(testutils.TestCase):
             mb.side_effect = lambda x, y, z: raiseError()
             self.assertRaises(RuntimeError, self.mrg.mergeBranches, 'repo2', Git)
             mb.assert_called_once_with('repo2', mock.ANY, 'cvs-b1')
+            Git.pushQueued.assert_called_once_with()
 
     def test_mergeBranch(self):
         Git = mock.Mock()
@@ -0,0 +1,167 @@
+#
+# Copyright 2012 SAS Institute
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import errno
+import mock
+import os
+
+import testutils
+
+from bigitr import pool
+
+
+class TestPool(testutils.TestCase):
+    def test_size(self):
+        self.assertEqual(pool.Pool(0).size, 1)
+        self.assertEqual(pool.Pool(4).size, 4)
+
+    @mock.patch('os.fork')
+    def test_startInProcess(self, fork):
+        p = pool.Pool(1)
+        fn = mock.Mock()
+        fn.return_value = 3
+        p.start('job', fn, 'a', 'b')
+        fn.assert_called_once_with('a', 'b')
+        self.assertFalse(fork.called)
+        self.assertFalse(p.full())
+        self.assertEqual(p.active(), [])
+        self.assertEqual(p.reap(), [('job', 3)])
+        self.assertEqual(p.reap(), [])
+
+    @mock.patch('os.fork')
+    def test_startParent(self, fork):
+        fork.return_value = 1234
+        p = pool.Pool(2)
+        fn = mock.Mock()
+        p.start('job1', fn)
+        self.assertFalse(fn.called)
+        self.assertFalse(p.full())
+        fork.return_value = 1235
+        p.start('job2', fn)
+        self.assertTrue(p.full())
+        self.assertEqual(sorted(p.active()), ['job1', 'job2'])
+
+    @mock.patch('os._exit')
+    @mock.patch('os.fork')
+    def test_startChild(self, fork, _exit):
+        fork.return_value = 0
+        p = pool.Pool(2)
+        fn = mock.Mock()
+        fn.return_value = 1
+        p.start('job', fn, 'a')
+        fn.assert_called_once_with('a')
+        _exit.assert_called_once_with(1)
+        self.assertEqual(p.active(), [])
+
+    @mock.patch('os._exit')
+    @mock.patch('os.fork')
+    def test_startChildException(self, fork, _exit):
+        fork.return_value = 0
+        p = pool.Pool(2)
+        fn = mock.Mock()
+        fn.side_effect = lambda: [][1]
+        self.assertRaises(IndexError, p.start, 'job', fn)
+        _exit.assert_called_once_with(pool.FAILED)
+
+    @mock.patch('os.waitpid')
+    def test_reap(self, waitpid):
+        p = pool.Pool(2)
+        p.children = {1: 'job1', 2: 'job2'}
+        waitpid.side_effect = lambda pid, flags: {
+            1: (1, 0), 2: (0, 0)}[pid]
+        self.assertEqual(p.reap(), [('job1', 0)])
+        self.assertEqual(p.children, {2: 'job2'})
+
+    @mock.patch('os.waitpid')
+    def test_reapBlock(self, waitpid):
+        p = pool.Pool(2)
+        p.children = {2: 'job2'}
+        statuses = {2: (0, 0), -1: (2, 1 << 8)}
+        waitpid.side_effect = lambda pid, flags: statuses[pid]
+        self.assertEqual(p.reap(block=True), [('job2', 1)])
+        waitpid.assert_has_calls([
+            mock.call(2, os.WNOHANG),
+            mock.call(-1, 0)])
+        self.assertEqual(p.children, {})
+
+    @mock.patch('os.waitpid')
+    def test_reapInterrupted(self, waitpid):
+        p = pool.Pool(2)
+        p.children = {2: 'job2'}
+        results = [OSError(errno.EINTR, 'Interrupted'), (2, 0)]
+        def wait(pid, flags):
+            r = results.pop(0)
+            if isinstance(r, Exception):
+                raise r
+            return r
+        waitpid.side_effect = wait
+        self.assertEqual(p.reap(), [('job2', 0)])
+
+    @mock.patch('os.waitpid')
+    def test_reapError(self, waitpid):
+        p = pool.Pool(2)
+        p.children = {2: 'job2'}
+        def wait(pid, flags):
+            raise OSError(errno.ECHILD, 'No child processes')
+        waitpid.side_effect = wait
+        self.assertRaises(OSError, p.reap)
+
+    def test_status(self):
+        self.assertEqual(pool.Pool._status(0), 0)
+        self.assertEqual(pool.Pool._status(2 << 8), 2)
+        # killed by signal 9
+        self.assertEqual(pool.Pool._status(9), pool.FAILED)
+
+    def test_fork(self):
+        p = pool.Pool(2)
+        p.start('job', lambda: 7)
+        self.assertEqual(p.reap(block=True), [('job', 7)])
+        self.assertEqual(p.active(), [])
+
+
+class TestResults(testutils.TestCase):
+    def test_result(self):
+        p = pool.Results(2)
+        p.start('a', lambda x: [x, 2], 1)
+        p.start('b', lambda: 1/0)
+        self.assertTrue(p.full())
+        self.assertEqual(p.result('a'), [1, 2])
+        try:
+            p.result('b')
+            self.fail('no exception')
+        except RuntimeError, e:
+            self.assertTrue('ZeroDivisionError' in str(e))
+        self.assertEqual(p.active(), [])
+        self.assertEqual(p.files, {})
+
+    def test_resultExited(self):
+        p = pool.Results(2)
+        p.start('a', os._exit, 3)
+        self.assertRaises(RuntimeError, p.result, 'a')
+
+    def test_resultInProcess(self):
+        p = pool.Results(1)
+        p.start('a', lambda: 'result')
+        self.assertEqual(p.result('a'), 'result')
+
+    def test_finish(self):
+        p = pool.Results(2)
+        p.start('a', lambda: 1)
+        p.start('b', lambda: 2)
+        p.finish()
+        self.assertEqual(p.active(), [])
+        self.assertEqual(p.files, {})
+        self.assertEqual(p.statuses, {})
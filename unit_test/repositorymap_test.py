@@ -54,6 +54,7 @@ posthook.git.master = gitmasterposthook
 posthook.git = gitposthook
 posthook.cvs.cvs-a1 = cvsa1posthook
 email = foo@bar baz@blah
+pollfrequency = 1m30s
 
 [Path/To/Git/repo2]
 cvspath = Path/To/CVS/directory
@@ -177,6 +178,30 @@ prehook.cvs.cvs-a2 = cvsa2prehook "quoted arg"
                          {'cvs-a2': set(('a2', 'master')),
                           'cvs-a1': set(('a1',))})
 
+    def test_getMergePlan(self):
+        self.assertEqual(self.cfg.getMergePlan('Path/To/Git/repository', 'cvs-a2'),
+                         [('a2', ['cvs-a2']), ('master', ['cvs-a2'])])
+        self.assertEqual(self.cfg.getMergePlan('Path/To/Git/repository', 'a2'),
+                         [])
+
+    def test_getMergePlanDiamond(self):
+        cfg = repositorymap.RepositoryConfig(StringIO('[r]\n'
+            'merge.cvs-a = b c\n'
+            'merge.b = d master\n'
+            'merge.c = d\n'
+            'merge.d = master\n'))
+        self.assertEqual(cfg.getMergePlan('r', 'cvs-a'),
+                         [('b', ['cvs-a']),
+                          ('c', ['cvs-a']),
+                          ('d', ['b', 'c']),
+                          ('master', ['b', 'd'])])
+        self.assertEqual(cfg.getMergePlan('r', 'c'),
+                         [('d', ['c']), ('master', ['d'])])
+
+    def test_mergeCycle(self):
+        badcfg = StringIO('[r]\nmerge.cvs-a = b\nmerge.b = c\nmerge.c = b\n')
+        self.assertRaises(ValueError, repositorymap.RepositoryConfig, badcfg)
+
     def test_getMergeBranchMapsEmpty(self):
         self.assertEqual(self.cfg.getMergeBranchMaps('Path/To/Git/repo2'),
                          {})
@@ -220,6 +245,35 @@ prehook.cvs.cvs-a2 = cvsa2prehook "quoted arg"
             self.cfg.getCVSPostHooks('Path/To/Git/repository', 'cvs-a1'),
             [['cvsa1posthook']])
 
+    def test_getTrackedBranches(self):
+        self.assertEqual(self.cfg.getTrackedBranches('Path/To/Git/repository'),
+            set(('master', 'export-master', 'a1', 'export-a1',
+                 'cvs-a1', 'cvs-a2', 'a2')))
+        self.assertEqual(self.cfg.getTrackedBranches('Path/To/Git/repo2'),
+            set(('master', 'export-master')))
+
+    def test_getPollFrequency(self):
+        self.assertEqual(self.cfg.getPollFrequency('Path/To/Git/repository'), 90)
+        self.assertEqual(self.cfg.getPollFrequency('Path/To/Git/repo2'), None)
+
+    def test_getPollFrequencyDefault(self):
+        self.cfg = repositorymap.RepositoryConfig(StringIO(
+            '[GLOBAL]\npollfrequency = 2m\n[repo]\n'))
+        self.assertEqual(self.cfg.getPollFrequency('repo'), 120)
+
+    def test_getMaxPollFrequency(self):
+        self.assertEqual(self.cfg.getMaxPollFrequency('Path/To/Git/repo2'), None)
+        self.cfg = repositorymap.RepositoryConfig(StringIO(
+            '[GLOBAL]\nmaxpollfrequency = 1h\n[repo]\n'))
+        self.assertEqual(self.cfg.getMaxPollFrequency('repo'), 3600)
+
+    def test_getFullSyncFrequency(self):
+        self.assertEqual(self.cfg.getFullSyncFrequency('Path/To/Git/repo2'), None)
+        self.cfg = repositorymap.RepositoryConfig(StringIO(
+            '[GLOBAL]\nsyncfrequency = 1h\n[repo]\n[other]\nsyncfrequency = 10\n'))
+        self.assertEqual(self.cfg.getFullSyncFrequency('repo'), 3600)
+        self.assertEqual(self.cfg.getFullSyncFrequency('other'), 10)
+
     def test_getEmail(self):
         self.assertEqual(self.cfg.getEmail('Path/To/Git/repository'),
                          ['foo@bar', 'baz@blah'])
@@ -0,0 +1,152 @@
+#
+# Copyright 2012 SAS Institute
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import mock
+
+import testutils
+
+from bigitr import schedule
+
+
+def job(name, pollFrequency=10, syncFrequency=100, maxPollFrequency=None):
+    s = mock.Mock()
+    s.repos = [name]
+    s.ctx.getRepositoryName.return_value = name
+    return schedule.Job(s, pollFrequency, syncFrequency, maxPollFrequency)
+
+
+class TestJob(testutils.TestCase):
+    def test_init(self):
+        j = job('foo')
+        self.assertEqual(j.name, 'foo')
+        j.synchronizer.ctx.getRepositoryName.assert_called_once_with('foo')
+        self.assertEqual(j.deadline(), 0)
+
+    def test_firstRunIsFullSync(self):
+        j = job('foo')
+        j.start(1000)
+        self.assertFalse(j.poll)
+        j.finish()
+        self.assertEqual(j.nextPoll, 1010)
+        self.assertEqual(j.nextSync, 1100)
+        self.assertEqual(j.deadline(), 1010)
+
+    def test_poll(self):
+        j = job('foo')
+        j.nextPoll = 1010
+        j.nextSync = 1100
+        j.start(1015)
+        self.assertTrue(j.poll)
+        j.finish()
+        self.assertEqual(j.nextPoll, 1025)
+        self.assertEqual(j.nextSync, 1100)
+
+    def test_syncDue(self):
+        j = job('foo')
+        j.nextPoll = 1100
+        j.nextSync = 1100
+        j.start(1100)
+        self.assertFalse(j.poll)
+
+    def test_syncShorterThanPoll(self):
+        j = job('foo', pollFrequency=100, syncFrequency=10)
+        j.start(0)
+        j.finish()
+        self.assertEqual(j.deadline(), 10)
+        j.start(10)
+        self.assertFalse(j.poll)
+
+    def test_noBackoffByDefault(self):
+        j = job('foo')
+        self.assertEqual(j.maxPollFrequency, 10)
+        j.nextSync = 1000
+        j.start(0)
+        j.finish(schedule.IDLE)
+        self.assertEqual(j.nextPoll, 10)
+        self.assertEqual(j.idlePolls, 0)
+
+    def test_maxPollFrequencyBelowPollFrequency(self):
+        j = job('foo', maxPollFrequency=5)
+        self.assertEqual(j.maxPollFrequency, 10)
+
+    def test_backoff(self):
+        j = job('foo', maxPollFrequency=50)
+        j.nextSync = 1000
+        nextPolls = []
+        for now in (0, 100, 200, 300, 400):
+            j.start(now)
+            j.finish(schedule.IDLE)
+            nextPolls.append(j.nextPoll - now)
+        self.assertEqual(nextPolls, [20, 40, 50, 50, 50])
+        # stops counting at the ceiling
+        self.assertEqual(j.idlePolls, 3)
+
+    def test_backoffReset(self):
+        j = job('foo', maxPollFrequency=50)
+        j.nextSync = 1000
+        j.idlePolls = 3
+        j.start(0)
+        j.finish(schedule.SYNCED)
+        self.assertEqual(j.idlePolls, 0)
+        self.assertEqual(j.nextPoll, 10)
+
+    def test_backoffKeptAfterFullSyncOrFailure(self):
+        j = job('foo', maxPollFrequency=50)
+        j.idlePolls = 2
+        j.start(0)
+        self.assertFalse(j.poll)
+        j.finish(schedule.SYNCED)
+        self.assertEqual(j.idlePolls, 2)
+        self.assertEqual(j.nextPoll, 40)
+        j.start(40)
+        self.assertTrue(j.poll)
+        j.finish(schedule.FAILED)
+        self.assertEqual(j.idlePolls, 2)
+        j.finish(255)
+        self.assertEqual(j.idlePolls, 2)
+
+
+class TestSchedule(testutils.TestCase):
+    def test_empty(self):
+        s = schedule.Schedule()
+        self.assertEqual(len(s), 0)
+        self.assertFalse(s.due(1000))
+        self.assertEqual(s.waitTime(1000), None)
+
+    def test_order(self):
+        s = schedule.Schedule()
+        a = job('a')
+        b = job('b')
+        c = job('c')
+        a.nextPoll = 30
+        b.nextPoll = 10
+        c.nextPoll = 30
+        for j in (a, b, c):
+            j.nextSync = 1000
+            s.add(j)
+        self.assertEqual(len(s), 3)
+        self.assertEqual([s.pop(), s.pop(), s.pop()], [b, a, c])
+
+    def test_due(self):
+        s = schedule.Schedule()
+        a = job('a')
+        a.nextPoll = 30
+        a.nextSync = 20
+        s.add(a)
+        self.assertFalse(s.due(19))
+        self.assertTrue(s.due(20))
+        self.assertEqual(s.waitTime(15), 5)
+        self.assertEqual(s.waitTime(25), 0)
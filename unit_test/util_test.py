@@ -51,6 +51,39 @@ class TestUtil(testutils.TestCase):
         self.assertEqual(file(self.t + '/dir/metoo').read(), 'metoo')
         self.assertMode(self.t + '/dir/metoo', self.weirdMode)
 
+    def test_syncFiles(self):
+        os.makedirs(self.t + '/dir')
+        file(self.t + '/a', 'w').write('a')
+        file(self.t + '/b', 'w').write('B')
+        file(self.t + '/dir/metoo', 'w').write('metoo')
+        file(self.t + '/gone', 'w').write('gone')
+        file(self.t + '/ignored', 'w').write('ignored')
+        os.utime(self.t + '/a', (1000, 1000))
+        file(self.s + '/new', 'w').write('new')
+        copyFiles = util.copyFiles
+        with mock.patch('bigitr.util.copyFiles') as cF:
+            cF.side_effect = copyFiles
+            util.syncFiles(self.s, self.t, ['a', 'b', 'dir/metoo', 'new'],
+                           ['a', 'b', 'dir/metoo', 'gone', 'missing'])
+            cF.assert_called_once_with(self.s, self.t, ('new',))
+        self.assertEqual(file(self.t + '/new').read(), 'new')
+        # unchanged file not rewritten
+        self.assertEqual(os.stat(self.t + '/a').st_mtime, 1000)
+        self.assertEqual(file(self.t + '/b').read(), 'b')
+        self.assertEqual(file(self.t + '/dir/metoo').read(), 'metoo')
+        self.assertMode(self.t + '/dir/metoo', self.weirdMode)
+        self.assertFalse(os.path.exists(self.t + '/gone'))
+        self.assertTrue(os.path.exists(self.t + '/ignored'))
+
+    def test_sameContents(self):
+        file(self.t + '/a', 'w').write('a')
+        file(self.t + '/b', 'w').write('a' * 100000)
+        file(self.t + '/c', 'w').write('a' * 99999 + 'b')
+        self.assertTrue(util.sameContents(self.s + '/a', self.t + '/a'))
+        self.assertFalse(util.sameContents(self.s + '/b', self.t + '/a'))
+        self.assertFalse(util.sameContents(self.t + '/b', self.t + '/c'))
+        self.assertTrue(util.sameContents(self.t + '/b', self.t + '/b'))
+
     def test_removeRecursive(self):
         util.removeRecursive(self.s)
         self.assertEqual(util.listFiles(self.s), [])